@@ -0,0 +1,234 @@
+# Broker_common.py
+"""
+Small concurrency helpers shared by Broker_dhan, Broker_motilal and the router:
+  - RateLimiter   : per-client token bucket (one budget per broker account) with
+                    priority lanes: cancel > squareoff > modify > new
+  - parallel_map  : bounded thread pool that returns results in input order
+  - timing_summary: count / spread / percentiles for a list of timestamps or latencies
+  - clock_offset  : server-vs-local clock estimate from HTTP Date headers
+  - backoff_delay : full-jitter exponential backoff for retries
+  - retry_summary : retry counts / added latency across order responses
+  - dispatch_order: per-batch client ordering (rotate / random / capital) for fan-outs
+"""
+
+import heapq, itertools, os, random, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+
+# lower value = served first when several calls wait on the same client's budget
+LANES = {"cancel": 0, "squareoff": 1, "modify": 2, "new": 3}
+
+
+class RateLimiter:
+    """
+    Token bucket per key (broker userid). `rate` tokens/sec with a burst
+    of `burst`; acquire() blocks until the key has a token.
+
+    Waiters on a key are served by lane (LANES), FIFO within a lane, so a
+    cancel queued behind a burst of new orders takes the next token.
+    """
+
+    def __init__(self, rate: float, burst: Optional[int] = None) -> None:
+        self.rate  = max(0.001, float(rate))
+        self.burst = max(1, int(burst if burst is not None else rate))
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, List[float]] = {}   # key -> [tokens, last_refill]
+        self._queues: Dict[str, List[tuple]] = {}     # key -> heap of (lane prio, seq)
+        self._conds: Dict[str, threading.Condition] = {}
+        self._seq = itertools.count()
+        self._stats: Dict[str, Dict[str, float]] = {}  # lane -> {acquired, waited_ms, max_wait_ms, jumped}
+
+    def _tokens(self, key: str, now: float) -> float:
+        tokens, last = self._buckets.get(key) or [float(self.burst), now]
+        tokens = min(float(self.burst), tokens + (now - last) * self.rate)
+        self._buckets[key] = [tokens, now]
+        return tokens
+
+    def _record(self, lane: str, waited: float, jumped: int) -> None:   # caller holds the lock
+        st = self._stats.setdefault(lane, {"acquired": 0, "waited_ms": 0.0, "max_wait_ms": 0.0, "jumped": 0})
+        st["acquired"] += 1
+        st["waited_ms"] += waited * 1000.0
+        st["max_wait_ms"] = max(st["max_wait_ms"], waited * 1000.0)
+        st["jumped"] += jumped
+
+    def acquire(self, key: str, lane: str = "new") -> float:
+        """Take one token for `key` in `lane`; returns seconds spent waiting."""
+        start = time.monotonic()
+        me = (LANES.get(lane, len(LANES)), next(self._seq))
+        with self._lock:
+            q = self._queues.setdefault(key, [])
+            if not q and self._tokens(key, start) >= 1.0:
+                self._buckets[key][0] -= 1.0
+                self._record(lane, 0.0, 0)
+                return 0.0
+            # lower-priority calls already queued that this one overtakes
+            jumped = sum(1 for w in q if w[0] > me[0])
+            heapq.heappush(q, me)
+            cond = self._conds.setdefault(key, threading.Condition(self._lock))
+            try:
+                while True:
+                    now = time.monotonic()
+                    tokens = self._tokens(key, now)
+                    if q[0] == me and tokens >= 1.0:
+                        heapq.heappop(q)
+                        self._buckets[key][0] = tokens - 1.0
+                        break
+                    # only the head needs a timed wake-up; the rest wait for it to pass the turn on
+                    cond.wait((1.0 - tokens) / self.rate if q[0] == me else None)
+            except BaseException:
+                q.remove(me)
+                heapq.heapify(q)
+                cond.notify_all()
+                raise
+            cond.notify_all()
+            waited = time.monotonic() - start
+            self._record(lane, waited, jumped)
+            return waited
+
+    def stats(self) -> Dict[str, Any]:
+        """Per-lane {acquired, avg_wait_ms, max_wait_ms, jumped} plus calls currently queued."""
+        with self._lock:
+            out: Dict[str, Any] = {}
+            for lane, st in self._stats.items():
+                out[lane] = {
+                    "acquired": int(st["acquired"]),
+                    "avg_wait_ms": round(st["waited_ms"] / st["acquired"], 3) if st["acquired"] else 0.0,
+                    "max_wait_ms": round(st["max_wait_ms"], 3),
+                    "jumped": int(st["jumped"]),
+                }
+            out["queued"] = sum(len(q) for q in self._queues.values())
+            return out
+
+
+def parallel_map(fn: Callable[[Any], Any], items: Iterable[Any], max_workers: int = 16,
+                 executor: Optional[ThreadPoolExecutor] = None) -> List[Any]:
+    """
+    Run fn over items on at most max_workers threads, or on a shared `executor`
+    (callers that fan out per client pass one pool so the total stays bounded).
+    Results keep input order.
+    """
+    items = list(items)
+    if not items:
+        return []
+    if len(items) == 1 or max_workers <= 1:
+        return [fn(x) for x in items]
+    if executor is not None:
+        return list(executor.map(fn, items))
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as ex:
+        return list(ex.map(fn, items))
+
+
+def _pct(sorted_vals: List[float], q: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    i = min(len(sorted_vals) - 1, max(0, int(round(q * (len(sorted_vals) - 1)))))
+    return sorted_vals[i]
+
+
+def timing_summary(values: Iterable[float], unit: float = 1000.0) -> Dict[str, Any]:
+    """
+    Summary of timestamps or latencies (seconds in, milliseconds out by default):
+    {count, min_ms, p50_ms, p90_ms, p99_ms, max_ms, spread_ms}
+    """
+    vals = sorted(float(v) for v in values if v is not None)
+    if not vals:
+        return {"count": 0}
+    return {
+        "count": len(vals),
+        "min_ms": round(vals[0] * unit, 3),
+        "p50_ms": round(_pct(vals, 0.50) * unit, 3),
+        "p90_ms": round(_pct(vals, 0.90) * unit, 3),
+        "p99_ms": round(_pct(vals, 0.99) * unit, 3),
+        "max_ms": round(vals[-1] * unit, 3),
+        "spread_ms": round((vals[-1] - vals[0]) * unit, 3),
+    }
+
+
+def clock_offset(session: Any, url: str, samples: int = 8, spacing: float = 0.137) -> Dict[str, Any]:
+    """
+    Estimate (server clock - local clock) from HTTP Date headers.
+    Each reply bounds the offset: the server was somewhere in [Date, Date+1s)
+    while we were between send and receive. Intersecting the bounds from
+    samples spread across a second boundary gets well below the header's 1s
+    resolution. Returns {offset_ms, uncertainty_ms, samples}.
+    """
+    from email.utils import parsedate_to_datetime
+
+    lo, hi, n = float("-inf"), float("inf"), 0
+    last_mid: Optional[float] = None
+    for i in range(max(1, samples)):
+        try:
+            t0 = time.time()
+            r  = session.head(url, timeout=5)
+            t1 = time.time()
+            srv = parsedate_to_datetime(r.headers["Date"]).timestamp()
+        except Exception:
+            continue
+        n += 1
+        lo = max(lo, srv - t1)
+        hi = min(hi, srv + 1.0 - t0)
+        last_mid = srv + 0.5 - (t0 + t1) / 2.0
+        if i + 1 < samples:
+            time.sleep(spacing)
+    if not n:
+        return {"offset_ms": 0.0, "uncertainty_ms": None, "samples": 0}
+    if lo > hi:  # inconsistent bounds (server clock stepped / proxy): fall back to last sample
+        return {"offset_ms": round(last_mid * 1000.0, 3), "uncertainty_ms": 500.0, "samples": n}
+    return {"offset_ms": round((lo + hi) / 2.0 * 1000.0, 3),
+            "uncertainty_ms": round((hi - lo) / 2.0 * 1000.0, 3), "samples": n}
+
+
+def backoff_delay(attempt: int, base: float = 0.1, cap: float = 1.0) -> float:
+    """Full-jitter backoff: uniform in [0, min(cap, base * 2**attempt)] seconds."""
+    return random.uniform(0.0, min(cap, base * (2 ** max(0, attempt))))
+
+
+def retry_summary(responses: Iterable[Any]) -> Dict[str, Any]:
+    """{orders_retried, retries, deduped, extra: timing_summary of _retry_ms} over send responses."""
+    retried = [r for r in responses if isinstance(r, dict) and r.get("_retries")]
+    return {
+        "orders_retried": len(retried),
+        "retries": sum(int(r["_retries"]) for r in retried),
+        "deduped": sum(1 for r in retried if r.get("_deduped")),
+        "extra": timing_summary(((r.get("_retry_ms") or 0) for r in retried), unit=1.0),
+    }
+
+
+# ---------- fan-out fairness ----------
+# A batch is sent in list order, so whoever is listed last always reaches the
+# exchange last. DISPATCH_ORDER picks the default client ordering per batch.
+DISPATCH_MODES = ("fixed", "rotate", "random", "capital")
+DISPATCH_ORDER = os.getenv("DISPATCH_ORDER", "rotate").strip().lower()
+_rotation = itertools.count()
+
+
+def dispatch_order(items: Iterable[Any], client: Callable[[Any], str], mode: Optional[str] = None,
+                   capital: Optional[Callable[[Any], Any]] = None) -> List[Any]:
+    """
+    Reorder a batch for dispatch. A client's rows stay together, in their
+    original order; only the order of clients changes:
+      fixed   : as given
+      rotate  : start one client later on every call
+      random  : shuffled per call
+      capital : largest capital(item) first (unknown capital last)
+    """
+    groups: Dict[str, List[Any]] = {}
+    for it in items:
+        groups.setdefault(client(it), []).append(it)
+    keys = list(groups)
+    mode = (mode or DISPATCH_ORDER or "fixed").strip().lower()
+    if len(keys) > 1:
+        if mode == "rotate":
+            k = next(_rotation) % len(keys)
+            keys = keys[k:] + keys[:k]
+        elif mode == "random":
+            random.shuffle(keys)
+        elif mode == "capital" and capital is not None:
+            def _cap(k: str) -> float:
+                try:
+                    return float(capital(groups[k][0]) or 0)
+                except Exception:
+                    return 0.0
+            keys.sort(key=_cap, reverse=True)
+    return [it for k in keys for it in groups[k]]
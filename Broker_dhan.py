@@ -1,11 +1,31 @@
 # Broker_dhan.py
 
-import os, json, threading
-from typing import Dict, Any, List, Optional
+import os, json, threading, itertools
+from typing import Dict, Any, List, Optional, Tuple
 import requests
 
 STAT_KEYS = ["pending", "traded", "rejected", "cancelled", "others"]
 
+# order-API fan-out: bounded pool, one keep-alive connection pool, per-client budget
+from requests.adapters import HTTPAdapter
+from Broker_common import (DISPATCH_ORDER, RateLimiter, backoff_delay, clock_offset, dispatch_order,
+                           parallel_map, retry_summary, timing_summary)
+
+MAX_WORKERS        = int(os.getenv("DHAN_MAX_WORKERS", "32"))
+MODIFY_TIMEOUT_SEC = float(os.getenv("DHAN_MODIFY_TIMEOUT_SEC", "8"))
+_order_limiter     = RateLimiter(float(os.getenv("DHAN_ORDER_RPS", "25")))   # Dhan: 25 order calls/sec per client
+_http = requests.Session()
+_http.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=MAX_WORKERS))
+
+# new orders: retry transient failures (timeout / 429 / 5xx) for up to
+# RETRY_DEADLINE_SEC after the first failure. Before each resend the
+# correlationId is looked up; only a confirmed "not placed" (404) resends.
+RETRY_MAX          = int(os.getenv("DHAN_RETRY_MAX", "3"))
+RETRY_DEADLINE_SEC = float(os.getenv("DHAN_RETRY_DEADLINE_SEC", "4"))
+ORDER_TIMEOUT_SEC  = float(os.getenv("DHAN_ORDER_TIMEOUT_SEC", "15"))
+_TRANSIENT_HTTP    = (429, 500, 502, 503, 504)
+_corr_seq          = itertools.count(1)
+
 # use same DATA_DIR as router
 BASE_DIR    = os.path.abspath(os.environ.get("DATA_DIR", "./data"))
 CLIENTS_DIR = os.path.join(BASE_DIR, "clients", "dhan")
@@ -168,23 +188,309 @@ def login(client: Dict[str, Any]) -> Dict[str, Any]:
 
 
 
+# ---------------------------
+# live order updates (websocket -> local order store)
+# ---------------------------
+import time, random
+
+try:
+    import websocket  # websocket-client
+except Exception:
+    websocket = None
+
+ORDER_WS_URL = os.getenv("DHAN_ORDER_WS_URL", "wss://api-order-update.dhan.co")
+ORDER_WS_LOGIN_GRACE_SEC = float(os.getenv("DHAN_ORDER_WS_LOGIN_GRACE_SEC", "3"))
+
+# order-update feed uses short codes; map them to the REST /v2/orders enums
+_WS_TXN     = {"B": "BUY", "S": "SELL"}
+_WS_PRODUCT = {"C": "CNC", "I": "INTRADAY", "M": "MARGIN", "F": "MTF", "V": "CO", "B": "BO"}
+_WS_ORDTYPE = {"LMT": "LIMIT", "MKT": "MARKET", "SL": "STOP_LOSS", "SLM": "STOP_LOSS_MARKET"}
+_WS_SEGMENT = {"E": "EQ", "D": "FNO", "C": "CURRENCY", "M": "COMM"}
+
+
+def _ws_to_rest(d: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert an order_alert 'Data' block into the /v2/orders row shape."""
+    status = str(d.get("Status") or "").strip().upper().replace(" ", "_")
+    return {
+        "dhanClientId": str(d.get("ClientId") or d.get("dhanClientId") or ""),
+        "orderId": str(d.get("OrderNo") or ""),
+        "correlationId": d.get("CorrelationId") or "",
+        "orderStatus": status,
+        "transactionType": _WS_TXN.get(str(d.get("TxnType") or ""), d.get("TxnType") or ""),
+        "exchangeSegment": (f"{d.get('Exchange')}_{_WS_SEGMENT.get(str(d.get('Segment')), d.get('Segment'))}"
+                            if d.get("Exchange") else ""),
+        "productType": _WS_PRODUCT.get(str(d.get("Product") or ""), d.get("Product") or ""),
+        "orderType": _WS_ORDTYPE.get(str(d.get("OrderType") or ""), d.get("OrderType") or ""),
+        "validity": d.get("Validity") or "",
+        "tradingSymbol": d.get("DisplayName") or d.get("Symbol") or "",
+        "securityId": str(d.get("SecurityId") or ""),
+        "quantity": d.get("Quantity"),
+        "remainingQuantity": d.get("RemainingQuantity"),
+        "filledQty": d.get("TradedQty"),
+        "price": d.get("Price"),
+        "triggerPrice": d.get("TriggerPrice"),
+        "averageTradedPrice": d.get("AvgTradedPrice"),
+        "omsErrorDescription": d.get("ReasonDescription") or "",
+        "createTime": d.get("OrderDateTime") or "",
+        "updateTime": d.get("LastUpdatedTime") or "",
+    }
+
+
+# callbacks fn(row) run for every stored order update (risk counters, etc.)
+_order_listeners: List[Any] = []
+
+
+def add_order_listener(fn) -> None:
+    if fn not in _order_listeners:
+        _order_listeners.append(fn)
+
+
+class OrderStore:
+    """
+    Thread-safe in-memory Dhan order book keyed by orderId.
+    Rows keep the REST /v2/orders shape whether they came from a REST
+    seed or from the order-update feed. Dhan's book is per trading day, so
+    the store starts empty on a new IST day.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._day = self._today()
+        self._orders: Dict[str, Dict[str, Any]] = {}
+        self._by_client: Dict[str, Dict[str, None]] = {}
+
+    @staticmethod
+    def _today():
+        return (datetime.now(_IST) if _IST else datetime.now()).date()
+
+    def _roll_day(self) -> None:
+        # caller holds self._lock
+        today = self._today()
+        if today != self._day:
+            self._day = today
+            self._orders.clear()
+            self._by_client.clear()
+
+    def upsert(self, order: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        oid = str(order.get("orderId") or "").strip()
+        if not oid:
+            return None
+        with self._lock:
+            self._roll_day()
+            cur = self._orders.get(oid)
+            # never let an older REST snapshot overwrite a newer feed update
+            if cur and str(order.get("updateTime") or "") < str(cur.get("updateTime") or ""):
+                return cur
+            merged = {**(cur or {}), **{k: v for k, v in order.items() if v not in (None, "")}}
+            self._orders[oid] = merged
+            uid = str(merged.get("dhanClientId") or "")
+            if uid:
+                self._by_client.setdefault(uid, {})[oid] = None
+        for fn in _order_listeners:
+            try:
+                fn(dict(merged))
+            except Exception as e:
+                print(f"[DHAN] order listener error: {e}")
+        return merged
+
+    def get(self, order_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._roll_day()
+            o = self._orders.get(str(order_id).strip())
+            return dict(o) if o else None
+
+    def for_client(self, uid: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            self._roll_day()
+            return [dict(self._orders[oid]) for oid in self._by_client.get(uid, {}) if oid in self._orders]
+
+
+class _OrderFeed(threading.Thread):
+    """
+    One order-update websocket per access token. Reconnects with capped
+    exponential backoff; while disconnected the client's rows are treated
+    as stale so readers fall back to REST and re-seed the store.
+
+    The feed has no login reply: a bad LoginReq just gets the socket dropped.
+    The feed counts as live after the first message from the server, or once
+    the socket has stayed open ORDER_WS_LOGIN_GRACE_SEC past the login.
+    """
+
+    def __init__(self, client: Dict[str, Any], store: OrderStore, url: str = "") -> None:
+        self.client   = client
+        self.uid      = str(client.get("userid") or client.get("client_id") or "").strip()
+        self.token    = (client.get("apikey") or client.get("access_token") or "").strip()
+        self.store    = store
+        self.url      = url or ORDER_WS_URL
+        self.live     = False   # socket open + login accepted
+        self.seeded   = False   # store holds a full REST snapshot taken while live
+        self.attempts = 0
+        self.opened_at = 0.0    # when LoginReq went out on the current socket
+        self._stop    = threading.Event()
+        self._ws      = None
+        super().__init__(name=f"dhan-orders-{self.uid}", daemon=True)
+
+    def logged_in(self) -> bool:
+        if not self.live and self.opened_at and time.time() - self.opened_at >= ORDER_WS_LOGIN_GRACE_SEC:
+            self.live = True
+        return self.live
+
+    def fresh(self) -> bool:
+        return self.logged_in() and self.seeded
+
+    def stop(self) -> None:
+        self._stop.set()
+        try:
+            if self._ws:
+                self._ws.close()
+        except Exception:
+            pass
+
+    def _on_open(self, ws) -> None:
+        login = {"LoginReq": {"MsgCode": 42, "ClientId": self.uid, "Token": self.token}, "UserType": "SELF"}
+        ws.send(json.dumps(login))
+        self.opened_at = time.time()
+
+    def _on_message(self, ws, message) -> None:
+        self.attempts = 0
+        self.live = True
+        try:
+            msg = json.loads(message)
+        except Exception:
+            return
+        if not isinstance(msg, dict) or msg.get("Type") != "order_alert":
+            return
+        data = msg.get("Data") or {}
+        row = _ws_to_rest(data)
+        if not row["dhanClientId"]:
+            row["dhanClientId"] = self.uid
+        self.store.upsert(row)
+
+    def _on_close(self, ws, *args) -> None:
+        self.live = False
+        self.seeded = False
+        if self.opened_at and time.time() - self.opened_at > 30:
+            self.attempts = 0   # it was a healthy session, not a flapping one
+        self.opened_at = 0.0
+
+    def run(self) -> None:
+        while not self._stop.is_set():
+            self._ws = websocket.WebSocketApp(
+                self.url,
+                on_open=self._on_open,
+                on_message=self._on_message,
+                on_error=lambda ws, err: print(f"[DHAN] order feed error for {self.uid}: {err}"),
+                on_close=self._on_close,
+            )
+            try:
+                self._ws.run_forever(ping_interval=20, ping_timeout=10)
+            except Exception as e:
+                print(f"[DHAN] order feed crashed for {self.uid}: {e}")
+            self._on_close(self._ws)
+            if self._stop.is_set():
+                break
+            delay = min(60.0, 1.0 * (2 ** self.attempts)) * random.uniform(0.5, 1.0)
+            self.attempts += 1
+            self._stop.wait(delay)
+
+
+_order_store = OrderStore()
+_feeds: Dict[str, _OrderFeed] = {}
+_feeds_lock = threading.Lock()
+
+
+def start_order_feed(client: Dict[str, Any], url: str = "") -> Optional[_OrderFeed]:
+    """Start (or reuse) the order-update feed for this client's token."""
+    if websocket is None:
+        return None
+    token = (client.get("apikey") or client.get("access_token") or "").strip()
+    uid   = str(client.get("userid") or client.get("client_id") or "").strip()
+    if not token or not uid:
+        return None
+    with _feeds_lock:
+        feed = _feeds.get(token)
+        if feed and feed.is_alive():
+            feed.client = client
+            return feed
+        feed = _OrderFeed(client, _order_store, url)
+        _feeds[token] = feed
+        feed.start()
+        return feed
+
+
+def start_order_feeds(url: str = "") -> int:
+    """Start feeds for every saved Dhan client. Returns how many are running."""
+    return sum(1 for c in _read_clients() if start_order_feed(c, url))
+
+
+def stop_order_feeds() -> None:
+    with _feeds_lock:
+        for feed in _feeds.values():
+            feed.stop()
+        _feeds.clear()
+
+
+def _feed_for_uid(uid: str) -> Optional[_OrderFeed]:
+    with _feeds_lock:
+        for feed in _feeds.values():
+            if feed.uid == uid:
+                return feed
+    return None
+
+
+def get_order(order_id: str) -> Optional[Dict[str, Any]]:
+    """Latest known /v2/orders row for an orderId, served from memory."""
+    return _order_store.get(order_id)
+
+
+def client_for_order(order_id: str) -> Optional[Dict[str, Any]]:
+    """Client JSON owning an orderId, if the store has seen that order."""
+    o = _order_store.get(order_id)
+    feed = _feed_for_uid(str((o or {}).get("dhanClientId") or ""))
+    return feed.client if feed else None
+
+
+def _client_orders(c: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Orders for one client: from the store when its feed is live and seeded,
+    otherwise a REST pull that (re)seeds the store. Feeds are started at login
+    and startup only; a read never opens a socket.
+    """
+    token = (c.get("apikey") or c.get("access_token") or "").strip()
+    uid   = str(c.get("userid") or c.get("client_id") or "").strip()
+    with _feeds_lock:
+        feed = _feeds.get(token)
+    if feed and feed.fresh():
+        return _order_store.for_client(uid)
+
+    resp = _http.get("https://api.dhan.co/v2/orders",
+                     headers={"Content-Type": "application/json", "access-token": token},
+                     timeout=10)
+    orders = resp.json() if resp.status_code == 200 else []
+    if not isinstance(orders, list):
+        return []
+    for o in orders:
+        if isinstance(o, dict):
+            o.setdefault("dhanClientId", uid)
+            _order_store.upsert(o)
+    if feed and feed.logged_in() and resp.status_code == 200:
+        feed.seeded = True
+    return orders
+
+
 def get_orders() -> Dict[str, List[Dict[str, Any]]]:
     buckets: Dict[str, List[Dict[str, Any]]] = {k: [] for k in STAT_KEYS}
-    for c in _read_clients():
-        token = (c.get("apikey") or c.get("access_token") or "").strip()
-        if not token:
-            continue
+
+    def _fetch(c: Dict[str, Any]):
         name = c.get("name") or c.get("display_name") or c.get("userid") or c.get("client_id") or ""
         try:
-            resp = requests.get("https://api.dhan.co/v2/orders",
-                                headers={"Content-Type": "application/json", "access-token": token},
-                                timeout=10)
-            orders = resp.json() if resp.status_code == 200 else []
-            if not isinstance(orders, list):
-                orders = []
+            return c, name, _client_orders(c)
         except Exception as e:
             print(f"[DHAN] get_orders error for {name}: {e}")
-            orders = []
+            return c, name, []
+
+    clients = [c for c in _read_clients() if (c.get("apikey") or c.get("access_token") or "").strip()]
+    for c, name, orders in parallel_map(_fetch, clients, MAX_WORKERS):
         for o in orders:
             row = {
                 "name": name,
@@ -194,6 +500,7 @@ def get_orders() -> Dict[str, List[Dict[str, Any]]]:
                 "price": o.get("price", ""),
                 "status": o.get("orderStatus", ""),
                 "order_id": o.get("orderId", ""),
+                "client_id": str(c.get("userid") or c.get("client_id") or ""),
             }
             s = str(row["status"]).lower()
             if "pend" in s:
@@ -209,6 +516,71 @@ def get_orders() -> Dict[str, List[Dict[str, Any]]]:
     return buckets
 
 
+# ---------------------------
+# single-order snapshots (modify / cancel helpers)
+# ---------------------------
+SNAPSHOT_TTL_SEC = float(os.getenv("DHAN_SNAPSHOT_TTL_SEC", "2"))
+_snap_cache: Dict[str, Any] = {}   # orderId -> (fetched_at, row)
+_snap_lock = threading.Lock()
+
+
+def get_order_snapshots(client: Dict[str, Any], order_ids: List[str],
+                        max_age: Optional[float] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Current /v2/orders row for each orderId of ONE client.
+    Served from the live order store when the client's feed is fresh,
+    then from a short-lived cache (max_age, default SNAPSHOT_TTL_SEC; 0 skips it),
+    and only then via GET /v2/orders/{id} on a single keep-alive session.
+    """
+    ttl = SNAPSHOT_TTL_SEC if max_age is None else float(max_age)
+    token = (client.get("apikey") or client.get("access_token") or "").strip()
+    uid   = str(client.get("userid") or client.get("client_id") or "").strip()
+    out: Dict[str, Dict[str, Any]] = {}
+    need: List[str] = []
+
+    feed = _feed_for_uid(uid)
+    now  = time.time()
+    for oid in dict.fromkeys(str(o).strip() for o in order_ids or [] if str(o).strip()):
+        row = _order_store.get(oid) if feed and feed.fresh() else None
+        if not row:
+            with _snap_lock:
+                hit = _snap_cache.get(oid)
+            if hit and ttl > 0 and now - hit[0] <= ttl:
+                row = hit[1]
+        if row:
+            out[oid] = row
+        else:
+            need.append(oid)
+
+    if not need or not token:
+        return out
+
+    with requests.Session() as http:
+        http.headers.update({"Content-Type": "application/json", "access-token": token})
+        for oid in need:
+            try:
+                r = http.get(f"https://api.dhan.co/v2/orders/{oid}", timeout=10)
+                body = r.json() if r.status_code == 200 and r.content else None
+            except Exception as e:
+                print(f"[DHAN] order snapshot error for {uid}/{oid}: {e}")
+                continue
+            # the single-order GET answers with an object or a 1-element list
+            if isinstance(body, list):
+                body = body[0] if body else None
+            if not isinstance(body, dict):
+                continue
+            body.setdefault("dhanClientId", uid)
+            _order_store.upsert(body)
+            with _snap_lock:
+                if len(_snap_cache) > 5000:
+                    cutoff = time.time() - SNAPSHOT_TTL_SEC
+                    for k in [k for k, (ts, _) in _snap_cache.items() if ts < cutoff]:
+                        _snap_cache.pop(k, None)
+                _snap_cache[oid] = (time.time(), body)
+            out[oid] = body
+    return out
+
+
 # ---------------------------
 # cancel single order (used by router fallback)
 # ---------------------------
@@ -218,7 +590,9 @@ def cancel_order_dhan(client_json: Dict[str, Any], order_id: str) -> Dict[str, A
         return {"status": "error", "message": "Missing access token", "raw": {}}
 
     try:
-        r = requests.delete(
+        uid = str(client_json.get("userid") or client_json.get("client_id") or "").strip()
+        _order_limiter.acquire(uid or token, lane="cancel")
+        r = _http.delete(
             f"https://api.dhan.co/v2/orders/{order_id}",
             headers={"Content-Type": "application/json", "access-token": token},
             timeout=15,
@@ -257,6 +631,39 @@ def cancel_order_dhan(client_json: Dict[str, Any], order_id: str) -> Dict[str, A
         return {"status": "error", "message": str(e), "raw": {}}
 
 
+def cancel_orders(orders: List[Dict[str, Any]]) -> List[str]:
+    """
+    Cancel Dhan orders concurrently (pooled connections, per-client rate budget).
+    Input:  [{ "name", "order_id", "_client_json"? }, ...]
+    Clients resolve from the router-attached _client_json, then the live
+    order store, then one name -> client map built for the whole batch.
+    Output: user-facing status messages in input order.
+    """
+    if not isinstance(orders, list) or not orders:
+        return ["❌ No orders received for cancellation."]
+
+    by_name: Dict[str, Dict[str, Any]] = {}
+    if not all((od or {}).get("_client_json") for od in orders):
+        for c in _read_clients():
+            nm = (c.get("name") or c.get("display_name") or "").strip().lower()
+            if nm:
+                by_name[nm] = c
+
+    def _one(od: Dict[str, Any]) -> str:
+        name = (od or {}).get("name") or ""
+        oid  = str((od or {}).get("order_id") or (od or {}).get("orderId") or "").strip()
+        cj   = ((od or {}).get("_client_json") or client_for_order(oid)
+                or by_name.get(name.strip().lower()))
+        if not cj or not oid:
+            return f"❌ Missing client JSON or order_id for {name}"
+        resp = cancel_order_dhan(cj, oid)
+        if str(resp.get("status", "")).lower() == "success":
+            return f"✅ Cancelled Order {oid} for {name}"
+        return f"❌ Failed to cancel Order {oid} for {name}: {resp.get('message')}"
+
+    return parallel_map(_one, orders, MAX_WORKERS)
+
+
 # ---------------------------
 # positions / square-off
 # ---------------------------
@@ -306,111 +713,271 @@ def get_positions() -> Dict[str, List[Dict[str, Any]]]:
     return positions_data
 
 
+def _send_square_off(cj: Dict[str, Any], name: str, symbol: str, pos: Dict[str, Any], seq: int) -> str:
+    """One MARKET order flattening `pos`; returns the user-facing message."""
+    token  = (cj.get("apikey") or cj.get("access_token") or "").strip()
+    client = (cj.get("userid") or cj.get("client_id") or "").strip()
+
+    net_qty = int(pos.get("netQty", 0) or 0)
+    if net_qty == 0:
+        return f"ℹ️ Already flat: {name} - {symbol}"
+
+    side  = "SELL" if net_qty > 0 else "BUY"
+    qty   = abs(net_qty)
+
+    payload = {
+        "dhanClientId": client,
+        "correlationId": f"SQ{int(time.time())}{client[-4:]}{seq}",
+        "transactionType": side,
+        "exchangeSegment": pos.get("exchangeSegment"),
+        "productType": pos.get("productType", "CNC"),
+        "orderType": "MARKET",
+        "validity": "DAY",
+        "securityId": str(pos.get("securityId")),
+        "quantity": int(qty),
+        "disclosedQuantity": 0,
+        "price": 0,
+        "triggerPrice": 0,
+        "afterMarketOrder": False,
+        "amoTime": "OPEN",
+        "boProfitValue": 0,
+        "boStopLossValue": 0
+    }
+
+    try:
+        _order_limiter.acquire(client, lane="squareoff")
+        r = _http.post(
+            "https://api.dhan.co/v2/orders",
+            headers={"Content-Type": "application/json", "access-token": token},
+            json=payload,
+            timeout=10
+        )
+        try:
+            data = r.json() if r.content else {}
+        except Exception:
+            data = {}
+
+        order_id     = str(data.get("orderId") or "").strip()
+        order_status = str(data.get("orderStatus") or data.get("status") or "").strip().upper()
+        err_msg      = str(data.get("message") or data.get("errorMessage") or "").strip()
+
+        ok_http = r.status_code in (200, 202)
+        ok_body = (bool(order_id) or order_status in {"SUCCESS", "TRANSIT", "PENDING", "SENT", "RECEIVED", "PLACED", "OPEN"})
+        ok = ok_http and ok_body
+
+        if ok:
+            shown = {"orderId": order_id} if order_id else {}
+            if order_status:
+                shown["orderStatus"] = order_status
+            return f"✅ {name} - close {symbol}: {shown or 'OK'}"
+        detail = err_msg or (data if data else f"HTTP {r.status_code}")
+        return f"❌ {name} - close {symbol}: {detail}"
+
+    except Exception as e:
+        return f"❌ {name} - close {symbol}: {e}"
+
+
 def close_positions(positions: List[Dict[str, Any]]) -> List[str]:
+    """
+    Square off [{name, symbol}, ...]. Requests are grouped by client: each
+    client's /v2/positions is fetched once, then every square-off order (all
+    clients) goes out together on the worker pool. Messages keep input order.
+    """
     by_name = {}
     for c in _read_clients():
         nm = (c.get("name") or c.get("display_name") or "").strip()
         if nm:
             by_name[nm] = c
 
-    messages: List[str] = []
+    reqs = list(positions or [])
+    messages: List[Optional[str]] = [None] * len(reqs)
 
-    for req in positions or []:
-        name   = (req or {}).get("name") or ""
-        symbol = (req or {}).get("symbol") or ""
-        cj     = by_name.get(name)
+    # --- group by client (index -> symbol)
+    groups: Dict[str, List[int]] = {}
+    for i, req in enumerate(reqs):
+        name = (req or {}).get("name") or ""
+        cj   = by_name.get(name)
         if not cj:
-            messages.append(f"❌ Client not found for: {name}")
+            messages[i] = f"❌ Client not found for: {name}"
             continue
-
         token  = (cj.get("apikey") or cj.get("access_token") or "").strip()
         client = (cj.get("userid") or cj.get("client_id") or "").strip()
         if not token or not client:
-            messages.append(f"❌ Missing token/client for: {name}")
+            messages[i] = f"❌ Missing token/client for: {name}"
             continue
+        groups.setdefault(name, []).append(i)
 
-        # fetch fresh positions
+    # --- one positions fetch per client, all clients at once
+    def _fetch(name: str):
+        token = (by_name[name].get("apikey") or by_name[name].get("access_token") or "").strip()
         try:
-            p = requests.get(
+            p = _http.get(
                 "https://api.dhan.co/v2/positions",
                 headers={"Content-Type": "application/json", "access-token": token},
                 timeout=10
             )
-            prow = []
-            if p.status_code == 200:
-                arr = p.json() if p.content else []
-                if isinstance(arr, list):
-                    for x in arr:
-                        if (x.get("tradingSymbol") or "") == symbol:
-                            prow.append(x)
-            if not prow:
-                messages.append(f"❌ Position not found: {name} - {symbol}")
-                continue
-            pos = prow[0]
+            arr = p.json() if (p.status_code == 200 and p.content) else []
+            return name, (arr if isinstance(arr, list) else []), None
         except Exception as e:
-            messages.append(f"❌ Fetch positions failed for {name}: {e}")
-            continue
+            return name, [], e
+
+    jobs = []
+    for name, rows, err in parallel_map(_fetch, list(groups), MAX_WORKERS):
+        by_sym: Dict[str, Dict[str, Any]] = {}
+        for x in rows:
+            by_sym.setdefault(x.get("tradingSymbol") or "", x)
+        for i in groups[name]:
+            symbol = (reqs[i] or {}).get("symbol") or ""
+            if err is not None:
+                messages[i] = f"❌ Fetch positions failed for {name}: {err}"
+            elif symbol not in by_sym:
+                messages[i] = f"❌ Position not found: {name} - {symbol}"
+            else:
+                jobs.append((i, name, symbol, by_sym[symbol]))
 
-        net_qty = int(pos.get("netQty", 0) or 0)
-        if net_qty == 0:
-            messages.append(f"ℹ️ Already flat: {name} - {symbol}")
-            continue
+    # --- all square-offs concurrently
+    results = parallel_map(
+        lambda j: _send_square_off(by_name[j[1]], j[1], j[2], j[3], j[0]), jobs, MAX_WORKERS
+    )
+    for (i, *_), msg in zip(jobs, results):
+        messages[i] = msg
 
-        side  = "SELL" if net_qty > 0 else "BUY"
-        qty   = abs(net_qty)
-
-        payload = {
-            "dhanClientId": client,
-            "correlationId": f"SQ{int(__import__('time').time())}{client[-4:]}",
-            "transactionType": side,
-            "exchangeSegment": pos.get("exchangeSegment"),
-            "productType": pos.get("productType", "CNC"),
-            "orderType": "MARKET",
-            "validity": "DAY",
-            "securityId": str(pos.get("securityId")),
-            "quantity": int(qty),
-            "disclosedQuantity": 0,
-            "price": 0,
-            "triggerPrice": 0,
-            "afterMarketOrder": False,
-            "amoTime": "OPEN",
-            "boProfitValue": 0,
-            "boStopLossValue": 0
-        }
+    return [m for m in messages if m is not None]
 
-        try:
-            r = requests.post(
-                "https://api.dhan.co/v2/orders",
-                headers={"Content-Type": "application/json", "access-token": token},
-                json=payload,
-                timeout=10
-            )
-            try:
-                data = r.json() if r.content else {}
-            except Exception:
-                data = {}
 
-            order_id     = str(data.get("orderId") or "").strip()
-            order_status = str(data.get("orderStatus") or data.get("status") or "").strip().upper()
-            err_msg      = str(data.get("message") or data.get("errorMessage") or "").strip()
+_OPEN_ORDER_STATES = ("PENDING", "TRANSIT", "PART_TRADED")
 
-            ok_http = r.status_code in (200, 202)
-            ok_body = (bool(order_id) or order_status in {"SUCCESS", "TRANSIT", "PENDING", "SENT", "RECEIVED", "PLACED", "OPEN"})
-            ok = ok_http and ok_body
 
-            if ok:
-                shown = {"orderId": order_id} if order_id else {}
-                if order_status:
-                    shown["orderStatus"] = order_status
-                messages.append(f"✅ {name} - close {symbol}: {shown or 'OK'}")
-            else:
-                detail = err_msg or (data if data else f"HTTP {r.status_code}")
-                messages.append(f"❌ {name} - close {symbol}: {detail}")
+def _same_instrument(row: Dict[str, Any], exchange: str, ids: Tuple[str, ...]) -> bool:
+    """Order/position row is the instrument (securityId in `ids`, same segment); no `ids` = any."""
+    if not ids:
+        return True
+    if str(row.get("securityId") or "") not in ids:
+        return False
+    seg = str(row.get("exchangeSegment") or "")
+    ex = (exchange or "").upper()
+    return not ex or not seg or seg == EXCHANGE_MAP.get(ex, ex)
 
-        except Exception as e:
-            messages.append(f"❌ {name} - close {symbol}: {e}")
 
-    return messages
+def open_orders(cj: Dict[str, Any], exchange: str = "", ids: Tuple[str, ...] = ()) -> List[Dict[str, Any]]:
+    """
+    Working (cancellable / modifiable) orders for one client in REST row shape,
+    optionally only one instrument (`exchange` + security ids). Served from the
+    live order store when the feed is fresh, else one /v2/orders pull.
+    """
+    return [
+        o for o in _client_orders(cj)
+        if isinstance(o, dict)
+        and str(o.get("orderStatus") or "").upper() in _OPEN_ORDER_STATES
+        and _same_instrument(o, exchange, ids)
+        and o.get("orderId")
+    ]
+
+
+def net_positions(cj: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+    """
+    Net position per security id for one client (seeds the router's risk
+    counters): [{symbol, net_qty, avg_price, realized}], None if the fetch failed.
+    """
+    token = (cj.get("apikey") or cj.get("access_token") or "").strip()
+    if not token:
+        return None
+    try:
+        p = _http.get(
+            "https://api.dhan.co/v2/positions",
+            headers={"Content-Type": "application/json", "access-token": token},
+            timeout=10
+        )
+        if p.status_code != 200:
+            return None
+        rows = p.json() if p.content else []
+    except Exception as e:
+        print(f"[DHAN] net_positions error for {cj.get('userid') or cj.get('client_id')}: {e}")
+        return None
+    out = []
+    for x in (rows if isinstance(rows, list) else []):
+        net = int(x.get("netQty", 0) or 0)
+        out.append({
+            "symbol": str(x.get("securityId") or ""),
+            "net_qty": net,
+            "avg_price": float((x.get("buyAvg") if net > 0 else x.get("sellAvg")) or 0),
+            "realized": float(x.get("realizedProfit", 0) or 0),
+        })
+    return out
+
+
+def kill_client(cj: Dict[str, Any], exchange: str = "", ids: Tuple[str, ...] = (),
+                pool=None) -> Dict[str, Any]:
+    """
+    Kill-switch for one client: cancel every open order, then square off every
+    non-zero position (optionally only one instrument). Cancels and square-offs each
+    go out concurrently (on `pool` when the caller shares one across clients).
+    Returns messages plus a per-phase latency breakdown:
+    { client_id, name, cancelled:[...], closed:[...],
+      timing:{orders_ms, cancel_ms, positions_ms, close_ms, total_ms} }
+    """
+    t0     = time.perf_counter()
+    name   = cj.get("name") or cj.get("display_name") or cj.get("userid") or cj.get("client_id") or ""
+    token  = (cj.get("apikey") or cj.get("access_token") or "").strip()
+    client = str(cj.get("userid") or cj.get("client_id") or "").strip()
+    out: Dict[str, Any] = {"client_id": client, "name": name, "cancelled": [], "closed": [], "timing": {}}
+    timing = out["timing"]
+
+    def _ms(a: float, b: float) -> float:
+        return round((b - a) * 1000.0, 3)
+
+    if not token or not client:
+        out["cancelled"].append(f"❌ Missing token/client for: {name}")
+        return out
+
+    # --- 1) cancel open orders
+    t = time.perf_counter()
+    try:
+        open_ids = [str(o["orderId"]) for o in open_orders(cj, exchange, ids)]
+    except Exception as e:
+        open_ids = []
+        out["cancelled"].append(f"❌ Fetch orders failed for {name}: {e}")
+    t1 = time.perf_counter()
+    timing["orders_ms"] = _ms(t, t1)
+
+    def _cancel(oid: str) -> str:
+        resp = cancel_order_dhan(cj, oid)
+        if str(resp.get("status", "")).lower() == "success":
+            return f"✅ Cancelled Order {oid} for {name}"
+        return f"❌ Failed to cancel Order {oid} for {name}: {resp.get('message')}"
+
+    out["cancelled"].extend(parallel_map(_cancel, open_ids, MAX_WORKERS, pool))
+    t2 = time.perf_counter()
+    timing["cancel_ms"] = _ms(t1, t2)
+
+    # --- 2) flatten positions
+    try:
+        p = _http.get(
+            "https://api.dhan.co/v2/positions",
+            headers={"Content-Type": "application/json", "access-token": token},
+            timeout=10
+        )
+        rows = p.json() if (p.status_code == 200 and p.content) else []
+        rows = rows if isinstance(rows, list) else []
+    except Exception as e:
+        rows = []
+        out["closed"].append(f"❌ Fetch positions failed for {name}: {e}")
+    open_pos = [
+        x for x in rows
+        if int(x.get("netQty", 0) or 0) != 0
+        and _same_instrument(x, exchange, ids)
+    ]
+    t3 = time.perf_counter()
+    timing["positions_ms"] = _ms(t2, t3)
+
+    out["closed"].extend(parallel_map(
+        lambda ix: _send_square_off(cj, name, ix[1].get("tradingSymbol") or "", ix[1], ix[0]),
+        list(enumerate(open_pos)), MAX_WORKERS, pool
+    ))
+    t4 = time.perf_counter()
+    timing["close_ms"] = _ms(t3, t4)
+    timing["total_ms"] = _ms(t0, t4)
+    return out
 
 
 # ---------------------------
@@ -525,169 +1092,294 @@ def get_holdings() -> Dict[str, Any]:
 # ---------------------------
 # place orders (fixed)
 # ---------------------------
-def place_orders(orders: List[Dict[str, Any]]) -> Dict[str, Any]:
+# Dhan mappings
+EXCHANGE_MAP = {
+    "NSE": "NSE_EQ",
+    "BSE": "BSE_EQ",
+    "NSEFO": "NSE_FNO",
+    "NSE_FO": "NSE_FNO",
+    "NSECD": "NSE_CURRENCY",
+    "MCX": "MCX_COMM",
+    "BSEFO": "BSE_FNO",
+    "BSECD": "BSE_CURRENCY",
+    "NCDEX": "NCDEX",
+}
+PRODUCT_MAP = {
+    "INTRADAY": "INTRADAY",
+    "MIS": "INTRADAY",
+    "DELIVERY": "CNC",
+    "CNC": "CNC",
+    "NORMAL": "MARGIN",
+    "NRML": "MARGIN",
+    "VALUEPLUS": "INTRADAY",
+    "MTF": "MTF",
+}
+
+
+def prepare_order(od: Dict[str, Any], cj: Optional[Dict[str, Any]]) -> Dict[str, Any]:
     """
-    Place a batch of orders on Dhan.
-    Input  : list of normalized items from the router; each item should include:
-             client_id, action, ordertype, producttype, orderduration, exchange,
-             qty, price, triggerprice, disclosedquantity, amoorder, correlation_id,
-             security_id (Dhan), symboltoken (ignored), tag, symbol (label)
-    Output : {"status": "completed", "order_responses": { "<tag:client>": <dhan json> , ...}}
+    Everything about a new order that doesn't depend on the price: resolved
+    client, headers and the normalized Dhan payload. Returns
+      {"key", "name", "uid", "headers", "payload", "ordertype"}  or  {"key", "name", "error": {...}}
+    send_prepared() stamps price/trigger and posts it.
     """
-    if not isinstance(orders, list) or not orders:
-        return {"status": "empty", "order_responses": {}}
+    uid  = str(od.get("client_id") or "").strip()
+    tag  = od.get("tag") or ""
+    key  = od.get("slice_key") or (f"{tag}:{uid}" if tag else uid)   # freeze slices carry their own key
+    name = od.get("name") or uid
 
-    # Build a quick lookup: dhan userid -> client json
-    by_id: Dict[str, Dict[str, Any]] = {}
-    for c in _read_clients():
-        uid = str(c.get("userid") or c.get("client_id") or "").strip()
-        if uid:
-            by_id[uid] = c
+    if not cj:
+        return {"key": key, "name": name, "error": {"status": "ERROR", "message": "Client JSON not found"}}
 
-    # Dhan mappings
-    EXCHANGE_MAP = {
-        "NSE": "NSE_EQ",
-        "BSE": "BSE_EQ",
-        "NSEFO": "NSE_FNO",
-        "NSE_FO": "NSE_FNO",
-        "NSECD": "NSE_CURRENCY",
-        "MCX": "MCX_COMM",
-        "BSEFO": "BSE_FNO",
-        "BSECD": "BSE_CURRENCY",
-        "NCDEX": "NCDEX",
+    token = (cj.get("apikey") or cj.get("access_token") or "").strip()
+    if not token:
+        return {"key": key, "name": name, "error": {"status": "ERROR", "message": "Missing access token"}}
+
+    # Gather/normalize fields
+    exchange   = (od.get("exchange") or "NSE").upper()
+    ordertype  = _norm_order_type(od.get("ordertype") or "")
+    product_in = (od.get("producttype") or "").upper()
+    validity   = (od.get("orderduration") or "DAY").upper()
+
+    security_id = str(od.get("security_id") or "").strip()  # REQUIRED
+    qty         = int(od.get("qty") or 0)
+    disc_qty    = int(od.get("disclosedquantity") or 0)
+    is_amo      = (od.get("amoorder") or "N") == "Y"
+    corr_base   = od.get("correlation_id") or ""
+
+    if not security_id:
+        return {"key": key, "name": name, "error": {"status": "ERROR", "message": "Missing securityId for Dhan"}}
+
+    data: Dict[str, Any] = {
+        "dhanClientId": uid,
+        "correlationId": "",                   # unique per send, see _child_corr()
+        "transactionType": (od.get("action") or "").upper(),
+        "exchangeSegment": EXCHANGE_MAP.get(exchange, exchange),
+        "productType": PRODUCT_MAP.get(product_in, product_in),
+        "orderType": ordertype,                # already normalized
+        "validity": validity,
+        "securityId": security_id,
+        "quantity": qty,
+        "disclosedQuantity": disc_qty,         # always numeric
+        "price": 0,
+        "triggerPrice": 0,
+        "afterMarketOrder": is_amo,
+        "amoTime": "OPEN",
+        "boProfitValue": 0,
+        "boStopLossValue": 0,
     }
-    PRODUCT_MAP = {
-        "INTRADAY": "INTRADAY",
-        "MIS": "INTRADAY",
-        "DELIVERY": "CNC",
-        "CNC": "CNC",
-        "NORMAL": "MARGIN",
-        "NRML": "MARGIN",
-        "VALUEPLUS": "INTRADAY",
-        "MTF": "MTF",
+    return {
+        "key": key, "name": name, "uid": uid, "ordertype": ordertype, "corr_base": corr_base,
+        "headers": {"Content-Type": "application/json", "access-token": token},
+        "payload": data,
     }
 
-    responses: Dict[str, Any] = {}
-    lock = threading.Lock()
-    threads: List[threading.Thread] = []
 
-    def _worker(od: Dict[str, Any]) -> None:
-        uid  = str(od.get("client_id") or "").strip()
-        tag  = od.get("tag") or ""
-        key  = f"{tag}:{uid}" if tag else uid
-        name = od.get("name") or uid
+def _child_corr(base: str, uid: str) -> str:
+    """Unique correlationId per send (<= 25 chars): '<base>-<n>' or 'RT<uid4><n>'."""
+    n = f"{int(time.time() * 1000) % 10**8:08d}{next(_corr_seq) % 1000:03d}"
+    return f"{base[:13]}-{n}" if base else f"RT{uid[-4:].zfill(4)}{n}"
 
-        cj = by_id.get(uid)
-        if not cj:
-            with lock:
-                responses[key] = {"status": "ERROR", "message": "Client JSON not found"}
-            return
 
-        token = (cj.get("apikey") or cj.get("access_token") or "").strip()
-        if not token:
-            with lock:
-                responses[key] = {"status": "ERROR", "message": "Missing access token"}
-            return
+def _is_transient(status_code: Optional[int], resp: Any) -> bool:
+    if status_code is None:                      # timeout / connection error
+        return True
+    if status_code in _TRANSIENT_HTTP:
+        return True
+    return isinstance(resp, dict) and str(resp.get("errorCode") or "") == "DH-904"   # rate limited
 
-        # Gather/normalize fields
-        exchange   = (od.get("exchange") or "NSE").upper()
-        ordertype  = _norm_order_type(od.get("ordertype") or "")
-        product_in = (od.get("producttype") or "").upper()
-        validity   = (od.get("orderduration") or "DAY").upper()
 
-        security_id = str(od.get("security_id") or "").strip()  # REQUIRED
-        qty         = int(od.get("qty") or 0)
-        try:
-            price = float(od.get("price") or 0)
-        except Exception:
-            price = 0.0
-        try:
-            trig = float(od.get("triggerprice") or 0)
-        except Exception:
-            trig = 0.0
-        disc_qty    = int(od.get("disclosedquantity") or 0)
-        is_amo      = (od.get("amoorder") or "N") == "Y"
-        corr_id     = od.get("correlation_id") or f"ROUTER{uid[-4:].zfill(4)}"
-
-        # Validations to prevent DH-905
-        if not security_id:
-            with lock:
-                responses[key] = {"status": "ERROR", "message": "Missing securityId for Dhan"}
-            return
-        if _needs_price(ordertype) and price <= 0:
-            with lock:
-                responses[key] = {"status": "ERROR", "message": "Order requires price > 0"}
-            return
-        if _needs_trigger(ordertype) and trig <= 0:
-            with lock:
-                responses[key] = {"status": "ERROR", "message": "Order requires triggerPrice > 0"}
-            return
-
-        data: Dict[str, Any] = {
-            "dhanClientId": uid,
-            "correlationId": corr_id,
-            "transactionType": (od.get("action") or "").upper(),
-            "exchangeSegment": EXCHANGE_MAP.get(exchange, exchange),
-            "productType": PRODUCT_MAP.get(product_in, product_in),
-            "orderType": ordertype,                # already normalized
-            "validity": validity,
-            "securityId": security_id,
-            "quantity": qty,
-            "disclosedQuantity": disc_qty,         # always numeric
-            "price": price if _needs_price(ordertype) else 0,
-            "triggerPrice": trig if _needs_trigger(ordertype) else 0,
-            "afterMarketOrder": is_amo,
-            "amoTime": "OPEN",
-            "boProfitValue": 0,
-            "boStopLossValue": 0,
-        }
-
-        # --- DEBUG: print final payload & response ---
-        try:
-            safe_token = f"{token[:6]}...{token[-4:]}" if token else ""
-            print(f"[DHAN] placing name={name} uid={uid} token={safe_token}")
-            print("[DHAN] payload =>")
-            print(json.dumps(data, indent=2))
-        except Exception:
-            pass
+def _order_by_correlation(headers: Dict[str, str], corr: str, timeout: float = 5) -> tuple:
+    """
+    Look up the order an earlier attempt created with this correlationId.
+    Returns ("found", row), ("absent", None) when Dhan confirms there is no
+    such order, or ("unknown", None) when the lookup itself failed.
+    """
+    try:
+        r = _http.get(f"{API_ROOT}/v2/orders/external/{corr}", headers=headers, timeout=timeout)
+        if r.status_code == 404:
+            return "absent", None
+        if r.status_code != 200:
+            return "unknown", None
+        body = r.json() if r.content else []
+    except Exception:
+        return "unknown", None
+    if isinstance(body, dict) and (body.get("errorType") or body.get("errorCode")):
+        return "unknown", None
+    rows = body if isinstance(body, list) else [body]
+    for o in rows:
+        if isinstance(o, dict) and o.get("orderId"):
+            return "found", o
+    return "absent", None
+
+
+API_ROOT = "https://api.dhan.co"
+
+
+def send_prepared(prep: Dict[str, Any], price: Any = 0, triggerprice: Any = 0) -> Dict[str, Any]:
+    """
+    Stamp price/trigger onto a prepare_order() result and POST it.
+    Returns the Dhan response (or an ERROR dict); adds "_sent_at"/"_ack_at"
+    wall-clock stamps for latency reporting.
+    """
+    if prep.get("error"):
+        return dict(prep["error"])
 
+    ordertype = prep["ordertype"]
+    try:
+        price = float(price or 0)
+    except Exception:
+        price = 0.0
+    try:
+        trig = float(triggerprice or 0)
+    except Exception:
+        trig = 0.0
+
+    # Validations to prevent DH-905
+    if _needs_price(ordertype) and price <= 0:
+        return {"status": "ERROR", "message": "Order requires price > 0"}
+    if _needs_trigger(ordertype) and trig <= 0:
+        return {"status": "ERROR", "message": "Order requires triggerPrice > 0"}
+
+    data = dict(prep["payload"])
+    data["price"] = price if _needs_price(ordertype) else 0
+    data["triggerPrice"] = trig if _needs_trigger(ordertype) else 0
+    data["correlationId"] = _child_corr(prep.get("corr_base") or "", prep["uid"])
+
+    r = None
+    first_sent = first_ack = None
+    retries, deduped = 0, False
+    while True:
+        r = None
+        _order_limiter.acquire(prep["uid"])
+        sent_at = time.time()
         try:
-            r = requests.post(
-                "https://api.dhan.co/v2/orders",
-                headers={"Content-Type": "application/json", "access-token": token},
-                json=data,
-                timeout=15,
-            )
+            r = _http.post(f"{API_ROOT}/v2/orders", headers=prep["headers"], json=data, timeout=ORDER_TIMEOUT_SEC)
             try:
                 resp = r.json()
             except Exception:
                 resp = {"_raw": getattr(r, "text", "")}
         except Exception as e:
-            r = None
             resp = {"status": "ERROR", "message": str(e)}
+        ack_at = time.time()
+        if first_sent is None:
+            first_sent, first_ack = sent_at, ack_at
+        if retries >= RETRY_MAX or not _is_transient(getattr(r, "status_code", None), resp):
+            break
+        delay = backoff_delay(retries)
+        left = RETRY_DEADLINE_SEC - (ack_at + delay - first_ack)
+        if left <= 0:
+            break
+        time.sleep(delay)
+        retries += 1
+        # the failed attempt may still have reached the exchange: look before resending
+        state, placed = _order_by_correlation(prep["headers"], data["correlationId"], timeout=min(5.0, left))
+        if state == "found":
+            resp, deduped, ack_at = placed, True, time.time()
+            break
+        if state == "unknown":
+            # can't tell whether the last send went through: never resend blind
+            resp = {"status": "UNKNOWN", "orderStatus": "UNKNOWN", "needs_reconcile": True,
+                    "correlationId": data["correlationId"],
+                    "message": f"placement unconfirmed after {retries} attempt(s); reconcile by correlationId",
+                    "last_error": resp}
+            ack_at = time.time()
+            break
+
+    # --- DEBUG: one line per order so concurrent sends don't interleave
+    try:
+        print(f"[DHAN] placed name={prep['name']} uid={prep['uid']} http_status={getattr(r, 'status_code', 'NA')} "
+              f"in {(ack_at - sent_at) * 1000:.0f}ms{f' retries={retries}' if retries else ''}{' (deduped)' if deduped else ''} "
+              f"payload={json.dumps(data)} -> {json.dumps(resp)}", flush=True)
+    except Exception:
+        pass
+
+    if isinstance(resp, dict):
+        resp.setdefault("_sent_at", first_sent)
+        resp.setdefault("_ack_at", ack_at)
+        if retries:
+            resp["_retries"] = retries
+            resp["_retry_ms"] = round((ack_at - first_ack) * 1000.0, 3)
+            if deduped:
+                resp["_deduped"] = True
+    return resp
+
 
+def prewarm(connections: int = 4) -> int:
+    """
+    Open up to `connections` keep-alive sockets (DNS + TCP + TLS) in the shared
+    session's pool ahead of a timed burst. Returns how many requests succeeded.
+    """
+    n = max(1, min(int(connections or 1), MAX_WORKERS))
+
+    def _touch(_):
         try:
-            print(f"[DHAN] http_status={getattr(r, 'status_code', 'NA')}")
-            print("[DHAN] response =>")
-            print(json.dumps(resp, indent=2))
+            _http.head(API_ROOT, timeout=5)
+            return 1
         except Exception:
-            pass
+            return 0
 
-        with lock:
-            responses[key] = resp
+    return sum(parallel_map(_touch, range(n), n))
 
-    for item in orders:
-        t = threading.Thread(target=_worker, args=(item,))
-        t.start()
-        threads.append(t)
-    for t in threads:
-        t.join()
 
-    return {"status": "completed", "order_responses": responses}
+def broker_clock_offset(samples: int = 8) -> Dict[str, Any]:
+    """Dhan server clock minus local clock (see Broker_common.clock_offset)."""
+    return clock_offset(_http, API_ROOT, samples)
+
+
+def fetch_available_margin(cj: Dict[str, Any]) -> Optional[float]:
+    """Available balance from /v2/fundlimit; None when the call fails (unknown, not zero)."""
+    token = (cj.get("apikey") or cj.get("access_token") or "").strip()
+    if not token:
+        return None
+    try:
+        r = _http.get(f"{API_ROOT}/v2/fundlimit",
+                      headers={"Content-Type": "application/json", "access-token": token}, timeout=10)
+        if r.status_code != 200 or not r.content:
+            return None
+        f = r.json() or {}
+        return float(f.get("availabelBalance", f.get("availableBalance", 0)) or 0)
+    except Exception as e:
+        print(f"[DHAN] fundlimit error for {cj.get('userid')}: {e}")
+        return None
 
-from typing import Dict, Any, List
-import requests
-import json
+
+def place_orders(orders: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Place a batch of orders on Dhan.
+    Input  : list of normalized items from the router; each item should include:
+             client_id, action, ordertype, producttype, orderduration, exchange,
+             qty, price, triggerprice, disclosedquantity, amoorder, correlation_id,
+             security_id (Dhan), symboltoken (ignored), tag, symbol (label)
+    Output : {"status": "completed", "order_responses": { "<tag:client>": <dhan json> , ...}}
+    """
+    if not isinstance(orders, list) or not orders:
+        return {"status": "empty", "order_responses": {}}
+
+    # Build a quick lookup: dhan userid -> client json
+    by_id: Dict[str, Dict[str, Any]] = {}
+    for c in _read_clients():
+        uid = str(c.get("userid") or c.get("client_id") or "").strip()
+        if uid:
+            by_id[uid] = c
+
+    # fairness: which client goes first changes per batch (DISPATCH_ORDER / row "dispatch_order")
+    mode = str(orders[0].get("dispatch_order") or DISPATCH_ORDER).lower()
+    orders = dispatch_order(orders, lambda od: str(od.get("client_id") or "").strip(), mode,
+                            capital=lambda od: (by_id.get(str(od.get("client_id") or "").strip()) or {}).get("capital"))
+
+    def _worker(item):
+        pos, od = item
+        prep = prepare_order(od, by_id.get(str(od.get("client_id") or "").strip()))
+        resp = send_prepared(prep, od.get("price"), od.get("triggerprice"))
+        if isinstance(resp, dict):
+            resp["_dispatch_pos"] = pos
+            if resp.get("_sent_at") and resp.get("_ack_at"):
+                resp["_ack_ms"] = round((resp["_ack_at"] - resp["_sent_at"]) * 1000.0, 3)
+        return prep["key"], resp
+
+    responses: Dict[str, Any] = dict(parallel_map(_worker, list(enumerate(orders)), MAX_WORKERS))
+    return {"status": "completed", "order_responses": responses, "retry": retry_summary(responses.values()), "dispatch": mode}
 
 def _build_dhan_modify_payload(row: Dict[str, Any]) -> Dict[str, Any]:
     """
@@ -783,101 +1475,91 @@ def _build_dhan_modify_payload(row: Dict[str, Any]) -> Dict[str, Any]:
     return payload
 
 
+def _modify_one(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Validate + PUT one modify. Returns {"msg", "ok", "order_id", "sent_at", "ack_at"}."""
+    name     = (row.get("name") or "").strip() or "<unknown>"
+    order_id = str(row.get("order_id") or row.get("orderId") or "").strip()
+    out: Dict[str, Any] = {"msg": "", "ok": False, "order_id": order_id, "sent_at": None, "ack_at": None}
+    try:
+        cj       = row.get("_client_json") or {}
+        token    = (cj.get("apikey") or cj.get("access_token") or "").strip()
+        dhan_id  = str(cj.get("userid") or cj.get("client_id") or "").strip()
+
+        if not order_id or not token or not dhan_id:
+            out["msg"] = f"❌ {name}: missing order_id/client/token"
+            return out
+
+        payload = _build_dhan_modify_payload(row)
+
+        # Basic validations for explicit types
+        ot = payload.get("orderType")
+        if ot == "LIMIT" and "price" not in payload:
+            out["msg"] = f"❌ {name} ({order_id}): LIMIT requires Price > 0"
+            return out
+        if ot == "STOP_LOSS" and not {"price", "triggerPrice"} <= payload.keys():
+            out["msg"] = f"❌ {name} ({order_id}): STOP_LOSS requires Price & Trigger > 0"
+            return out
+        if ot == "STOP_LOSS_MARKET" and "triggerPrice" not in payload:
+            out["msg"] = f"❌ {name} ({order_id}): SL-MARKET requires Trigger > 0"
+            return out
+        if payload.get("quantity", 1) <= 0:
+            payload.pop("quantity", None)  # don't send zero/negative qty
+
+        _order_limiter.acquire(dhan_id, lane="modify")
+        out["sent_at"] = time.time()
+        r = _http.put(f"https://api.dhan.co/v2/orders/{order_id}",
+                      headers={"Content-Type": "application/json", "access-token": token},
+                      json=payload, timeout=MODIFY_TIMEOUT_SEC)
+        out["ack_at"] = time.time()
+        try:
+            body = r.json() if r.content else {}
+        except Exception:
+            body = {"raw": getattr(r, "text", "")}
+
+        print(f"[DHAN] modify {dhan_id}/{order_id} -> HTTP {r.status_code} "
+              f"in {(out['ack_at'] - out['sent_at']) * 1000:.0f}ms {json.dumps(payload)}")
+
+        # Success heuristic: 2xx and no errorType
+        ok = (200 <= r.status_code < 300) and not (isinstance(body, dict) and body.get("errorType"))
+        out["ok"] = ok
+        if ok:
+            out["msg"] = f"✅ {name} ({order_id}): Modified"
+        else:
+            err = ""
+            if isinstance(body, dict):
+                err = body.get("errorMessage") or body.get("message") or body.get("status") or ""
+            out["msg"] = f"❌ {name} ({order_id}): {err or ('HTTP ' + str(r.status_code))}"
+    except Exception as e:
+        out["msg"] = f"❌ {row.get('name','<unknown>')} ({row.get('order_id','?')}): {e}"
+    return out
+
+
 def modify_orders(orders: List[Dict[str, Any]]) -> Dict[str, Any]:
     """
-    Batch modify Dhan orders.
+    Batch modify Dhan orders, concurrently.
 
     Each row should contain:
       name, order_id, orderType (or leave blank and provide price/trigger),
       price?, triggerPrice?, quantity?, validity?, disclosedQuantity? (ignored -> always 0),
       _client_json { userid, apikey|access_token }
 
-    Returns: {"message": [ "...", ... ]}
-    """
-    messages: List[str] = []
-
-    for row in (orders or []):
-        try:
-            name     = (row.get("name") or "").strip() or "<unknown>"
-            order_id = str(row.get("order_id") or row.get("orderId") or "").strip()
-            cj       = row.get("_client_json") or {}
-            token    = (cj.get("apikey") or cj.get("access_token") or "").strip()
-            dhan_id  = str(cj.get("userid") or cj.get("client_id") or "").strip()
-
-            if not order_id or not token or not dhan_id:
-                messages.append(f"❌ {name}: missing order_id/client/token")
-                continue
-
-            payload = _build_dhan_modify_payload(row)
-
-            # Basic validations for explicit types
-            ot = payload.get("orderType")
-            if ot == "LIMIT" and "price" not in payload:
-                messages.append(f"❌ {name} ({order_id}): LIMIT requires Price > 0")
-                continue
-            if ot == "STOP_LOSS" and not {"price", "triggerPrice"} <= payload.keys():
-                messages.append(f"❌ {name} ({order_id}): STOP_LOSS requires Price & Trigger > 0")
-                continue
-            if ot == "STOP_LOSS_MARKET" and "triggerPrice" not in payload:
-                messages.append(f"❌ {name} ({order_id}): SL-MARKET requires Trigger > 0")
-                continue
-            if payload.get("quantity", 1) <= 0:
-                payload.pop("quantity", None)  # don't send zero/negative qty
-
-            url = f"https://api.dhan.co/v2/orders/{order_id}"
-            headers = {"Content-Type": "application/json", "access-token": token}
-
-            # --- DEBUG OUT ---
-            try:
-                safe_token = f"{token[:6]}...{token[-4:]}"
-                print("---- Dhan ModifyOrder (OUT) ----")
-                print(json.dumps({
-                    "url": url,
-                    "headers": {"access-token": safe_token},
-                    "payload": payload
-                }, indent=2))
-            except Exception:
-                pass
-
-            r = requests.put(url, headers=headers, json=payload, timeout=20)
-            try:
-                body = r.json() if r.content else {}
-            except Exception:
-                body = {"raw": getattr(r, "text", "")}
-
-            # --- DEBUG RESP ---
-            try:
-                print("---- Dhan ModifyOrder (RESP) ----")
-                print(json.dumps({"status_code": r.status_code, "response": body}, indent=2))
-            except Exception:
-                pass
-
-            # Success heuristic: 2xx and no errorType
-            ok = (200 <= r.status_code < 300) and not (isinstance(body, dict) and body.get("errorType"))
-            if ok:
-                messages.append(f"✅ {name} ({order_id}): Modified")
-            else:
-                err = ""
-                if isinstance(body, dict):
-                    err = body.get("errorMessage") or body.get("message") or body.get("status") or ""
-                messages.append(f"❌ {name} ({order_id}): {err or ('HTTP ' + str(r.status_code))}")
-
-        except Exception as e:
-            messages.append(f"❌ {row.get('name','<unknown>')} ({row.get('order_id','?')}): {e}")
-
-    return {"message": messages}
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+    PUTs run on a bounded pool (DHAN_MAX_WORKERS) and respect each client's
+    order-API rate budget. Messages come back in input order.
 
+    Returns: {"message": [ "...", ... ],
+              "timing": {count, spread_ms (first->last ack), p50_ms/p90_ms/... of ack latency},
+              "modified": [order_id, ...]  # only the PUTs Dhan accepted}
+    """
+    results = parallel_map(_modify_one, orders or [], MAX_WORKERS)
+
+    acked = [r for r in results if r["ack_at"]]
+    timing: Dict[str, Any] = {"count": len(acked)}
+    if acked:
+        first_sent = min(r["sent_at"] for r in acked)
+        timing = timing_summary(r["ack_at"] - r["sent_at"] for r in acked)
+        timing["first_to_last_ack_ms"] = round((max(r["ack_at"] for r in acked)
+                                                - min(r["ack_at"] for r in acked)) * 1000, 3)
+        timing["wall_ms"] = round((max(r["ack_at"] for r in acked) - first_sent) * 1000, 3)
+
+    return {"message": [r["msg"] for r in results], "timing": timing,
+            "modified": [r["order_id"] for r in results if r["ok"]]}
@@ -1,5 +1,5 @@
 import os, json, logging
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple
 from collections import OrderedDict
 import threading
 from datetime import datetime, timedelta, timezone
@@ -14,7 +14,10 @@ try:
 except Exception:
     pyotp = None
 
+import requests
 from MOFSLOPENAPI import MOFSLOPENAPI  # requires your SDK
+from Broker_common import (DISPATCH_ORDER, RateLimiter, backoff_delay, dispatch_order,
+                           parallel_map, retry_summary, timing_summary)
 
 BASE_URL        = os.getenv("MO_BASE_URL", "https://openapi.motilaloswal.com")
 SOURCE_ID       = os.getenv("MO_SOURCE_ID", "Desktop")
@@ -24,6 +27,24 @@ BROWSER_VERSION = os.getenv("MO_BROWSER_VER", "104")
 STAT_KEYS = ["pending","traded","rejected","cancelled","others"]
 _sessions: Dict[str, MOFSLOPENAPI] = {}
 
+# order-API fan-out: bounded pool + per-client budget
+MAX_WORKERS    = int(os.getenv("MO_MAX_WORKERS", "32"))
+_order_limiter = RateLimiter(float(os.getenv("MO_ORDER_RPS", "10")))
+
+# new orders: retry transient failures inside a deadline; before each resend the
+# client's order book is checked for the order (same token/side/tag placed since
+# the first attempt) so a retry never duplicates
+RETRY_MAX          = int(os.getenv("MO_RETRY_MAX", "3"))
+RETRY_DEADLINE_SEC = float(os.getenv("MO_RETRY_DEADLINE_SEC", "4"))
+# transport failures only: raised by the SDK call, or the SDK's own FAILED reply when
+# the POST got no JSON back. Broker error codes are retried only when listed here.
+_TRANSIENT_EXC     = (requests.RequestException, TimeoutError, ConnectionError)
+_TRANSIENT_CODES   = {c.strip() for c in os.getenv("MO_TRANSIENT_ERRORCODES", "").split(",") if c.strip()}
+_claimed_lock = threading.Lock()
+_claimed_ids: set = set()      # uniqueorderids already attributed to a send today (dedupe must not reuse them)
+_claimed_day = datetime.now(IST).date()
+_inflight: Dict[tuple, int] = {}   # (uid, token, side, tag, lots) -> sends running right now
+
 DATA_DIR    = os.path.abspath(os.environ.get("DATA_DIR", "./data"))
 CLIENTS_DIR = os.path.join(DATA_DIR, "clients", "motilal")
 _MO_DIR     = CLIENTS_DIR
@@ -89,6 +110,182 @@ def _ensure_session(c: Dict[str, Any]) -> MOFSLOPENAPI | None:
     if login(c):
         return _sessions.get(uid)
     return None
+
+
+# ---------------------------
+# incremental order book (datetimestamp watermark)
+# ---------------------------
+import time
+
+# GetOrderBook returns orders changed since `datetimestamp`; a full pull is
+# still forced at day change and every MO_BOOK_FULL_REFRESH_SEC as a resync.
+_BOOK_FULL_REFRESH_SEC = float(os.getenv("MO_BOOK_FULL_REFRESH_SEC", "300"))
+_MO_TS_FMT = "%d-%b-%Y %H:%M:%S"
+_books: Dict[str, Dict[str, Any]] = {}
+_books_lock = threading.Lock()
+
+
+def _parse_mo_ts(v) -> datetime | None:
+    s = str(v or "").strip()
+    if not s:
+        return None
+    for fmt in (_MO_TS_FMT, "%Y-%m-%d %H:%M:%S", "%d/%m/%Y %H:%M:%S", "%d-%m-%Y %H:%M:%S"):
+        try:
+            return datetime.strptime(s, fmt)
+        except Exception:
+            continue
+    return None
+
+
+def _row_ts(row: Dict[str, Any]) -> datetime | None:
+    stamps = [_parse_mo_ts(row.get(k)) for k in ("lastmodifiedtime", "recordinserttime")]
+    stamps = [t for t in stamps if t]
+    return max(stamps) if stamps else None
+
+
+# callbacks fn(uid, row) run for every order-book row fetched (risk counters, etc.)
+_order_listeners: List[Any] = []
+
+
+def add_order_listener(fn) -> None:
+    if fn not in _order_listeners:
+        _order_listeners.append(fn)
+
+
+def _fetch_order_book(sdk, uid: str) -> List[Dict[str, Any]]:
+    """
+    Cached order book for one client. The first call of the day pulls from
+    09:00:00; later calls ask only for rows at/after the newest timestamp
+    seen and merge them by uniqueorderid.
+    """
+    with _books_lock:
+        book = _books.setdefault(uid, {"lock": threading.Lock(), "rows": OrderedDict(),
+                                       "watermark": None, "day": None, "full_at": 0.0})
+    with book["lock"]:
+        today = datetime.now(IST).date()
+        full  = (book["day"] != today or book["watermark"] is None
+                 or time.time() - book["full_at"] > _BOOK_FULL_REFRESH_SEC)
+        since = (today.strftime("%d-%b-%Y") + " 09:00:00") if full else book["watermark"].strftime(_MO_TS_FMT)
+
+        resp = sdk.GetOrderBook({"clientcode": uid, "datetimestamp": since})
+        if not (isinstance(resp, dict) and resp.get("status") == "SUCCESS"):
+            # an empty delta comes back as a non-SUCCESS "no data" reply; keep the cache
+            if full or not book["rows"]:
+                logging.error("❌ Error fetching orders for %s: %s", uid,
+                              (resp or {}).get("message", "No message") if isinstance(resp, dict) else resp)
+            return list(book["rows"].values()) if book["day"] == today else []
+
+        rows = resp.get("data", [])
+        if not isinstance(rows, list):
+            rows = []
+
+        if full:
+            book["rows"]      = OrderedDict()
+            book["day"]       = today
+            book["full_at"]   = time.time()
+            book["watermark"] = datetime.strptime(since, _MO_TS_FMT)
+        for r in rows:
+            oid = str(r.get("uniqueorderid") or "").strip()
+            if oid:
+                book["rows"][oid] = r
+            ts = _row_ts(r)
+            if ts and ts > book["watermark"]:
+                book["watermark"] = ts
+            for fn in _order_listeners:
+                try:
+                    fn(uid, r)
+                except Exception as e:
+                    logging.error("order listener error for %s: %s", uid, e)
+        return list(book["rows"].values())
+
+
+# ---------------------------
+# LTP broadcast feed (MOFSLOPENAPI websocket)
+# ---------------------------
+# One logged-in session (MO_FEED_CLIENT, else the first client that logs in)
+# carries the broadcast socket. Subscribed scrips are re-registered on every
+# (re)open; LTP packets go to the handler passed to start_ltp_feed().
+_ltp_lock = threading.Lock()
+_ltp_feed: Dict[str, Any] = {"sdk": None, "uid": "", "open": False, "scrips": {}, "handler": None}
+
+
+def _exchange_type(exchange: str) -> str:
+    return "CASH" if (exchange or "").upper() in ("NSE", "BSE") else "DERIVATIVES"
+
+
+def _ltp_register(sdk, exchange: str, scrip: int) -> None:
+    try:
+        sdk.Register(exchange.upper(), _exchange_type(exchange), int(scrip))
+    except Exception as e:
+        print(f"[MO][LTP] register {exchange}:{scrip} failed: {e}", flush=True)
+
+
+def start_ltp_feed(handler) -> bool:
+    """
+    Start (once) the broadcast socket; handler(exchange, scrip_code, ltp) is
+    called from the SDK's websocket thread for every LTP packet.
+    """
+    with _ltp_lock:
+        _ltp_feed["handler"] = handler
+        if _ltp_feed["sdk"] is not None:
+            return True
+
+        want = os.getenv("MO_FEED_CLIENT", "").strip()
+        sdk, uid = None, ""
+        for c in _read_clients():
+            cuid = str(c.get("userid") or c.get("client_id") or "").strip()
+            if want and cuid != want:
+                continue
+            sdk = _ensure_session(c)
+            if sdk:
+                uid = cuid
+                break
+        if not sdk:
+            print("[MO][LTP] no logged-in client for the broadcast feed", flush=True)
+            return False
+
+        def _on_open(ws1):
+            _ltp_feed["open"] = True
+            for (exch, scrip) in list(_ltp_feed["scrips"].values()):
+                _ltp_register(sdk, exch, scrip)
+            print(f"[MO][LTP] feed open ({uid}); registered {len(_ltp_feed['scrips'])} scrips", flush=True)
+
+        def _on_message(ws1, message_type, message):
+            if message_type != "LTP" or not isinstance(message, dict):
+                return
+            h = _ltp_feed["handler"]
+            if h:
+                try:
+                    h(message.get("Exchange") or "", int(message.get("Scrip Code") or 0),
+                      float(message.get("LTP_Rate") or 0))
+                except Exception as e:
+                    print(f"[MO][LTP] handler error: {e}", flush=True)
+
+        def _on_close(ws1, code, msg):
+            _ltp_feed["open"] = False
+            print(f"[MO][LTP] feed closed: {code} {msg}", flush=True)
+
+        sdk._Broadcast_on_open    = _on_open
+        sdk._Broadcast_on_message = _on_message
+        sdk._Broadcast_on_close   = _on_close
+        sdk._Broadcast_on_error   = lambda ws1, err: print(f"[MO][LTP] feed error: {err}", flush=True)
+        _ltp_feed.update(sdk=sdk, uid=uid)
+    sdk.Broadcast_connect()
+    return True
+
+
+def subscribe_ltp(exchange: str, scrip: int) -> None:
+    """Add a scrip to the broadcast subscription (registered now if the socket is open)."""
+    key = f"{(exchange or '').upper()}:{int(scrip)}"
+    with _ltp_lock:
+        if key in _ltp_feed["scrips"]:
+            return
+        _ltp_feed["scrips"][key] = ((exchange or "NSE").upper(), int(scrip))
+        sdk, is_open = _ltp_feed["sdk"], _ltp_feed["open"]
+    if sdk is not None and is_open:
+        _ltp_register(sdk, exchange, scrip)
+
+
 def get_orders() -> Dict[str, List[Dict[str, Any]]]:
     """
     Fetch Motilal orders for all logged-in clients and bucketize:
@@ -111,16 +308,7 @@ def get_orders() -> Dict[str, List[Dict[str, Any]]]:
             continue
 
         try:
-            today_date = datetime.now().strftime("%d-%b-%Y 09:00:00")
-            resp = sdk.GetOrderBook({"clientcode": userid, "datetimestamp": today_date})
-
-            if resp and resp.get("status") != "SUCCESS":
-                logging.error("❌ Error fetching orders for %s: %s",
-                              name, resp.get("message", "No message"))
-
-            orders = resp.get("data", []) if isinstance(resp, dict) else []
-            if not isinstance(orders, list):
-                orders = []
+            orders = _fetch_order_book(sdk, userid)
 
             for order in orders:
                 row = {
@@ -130,7 +318,8 @@ def get_orders() -> Dict[str, List[Dict[str, Any]]]:
                     "quantity": order.get("orderqty", ""),
                     "price": order.get("price", ""),
                     "status": order.get("orderstatus", ""),
-                    "order_id": order.get("uniqueorderid", "")
+                    "order_id": order.get("uniqueorderid", ""),
+                    "client_id": userid,
                 }
                 s = (row["status"] or "").lower()
                 if "confirm" in s:
@@ -149,6 +338,19 @@ def get_orders() -> Dict[str, List[Dict[str, Any]]]:
 
     return orders_data
 
+def _cancel_one(sdk, userid: str, name: str, order_id: str) -> str:
+    """CancelOrder for one uniqueorderid; returns the UI message."""
+    try:
+        _order_limiter.acquire(userid, lane="cancel")
+        resp = sdk.CancelOrder(order_id, userid)
+        msg  = (resp.get("message", "") or "").lower() if isinstance(resp, dict) else ""
+        if "cancel order request sent" in msg:
+            return f"✅ Cancelled Order {order_id} for {name}"
+        return f"❌ Failed to cancel Order {order_id} for {name}: {resp.get('message','') if isinstance(resp,dict) else resp}"
+    except Exception as e:
+        return f"❌ Error cancelling {order_id} for {name}: {e}"
+
+
 def cancel_orders(orders: List[Dict[str, Any]]) -> List[str]:
     """
     Cancel Motilal orders in parallel.
@@ -161,12 +363,13 @@ def cancel_orders(orders: List[Dict[str, Any]]) -> List[str]:
     messages: List[str] = []
     lock = threading.Lock()
 
-    # map client display name -> client json
+    # map client display name -> client json (only needed for rows the router didn't resolve)
     by_name: Dict[str, Dict[str, Any]] = {}
-    for c in _read_clients():
-        nm = (c.get("name") or c.get("display_name") or "").strip()
-        if nm:
-            by_name[nm] = c
+    if not all((od or {}).get("_client_json") for od in orders):
+        for c in _read_clients():
+            nm = (c.get("name") or c.get("display_name") or "").strip()
+            if nm:
+                by_name[nm] = c
 
     def cancel_single(order: Dict[str, Any]) -> None:
         name     = (order or {}).get("name")
@@ -176,7 +379,7 @@ def cancel_orders(orders: List[Dict[str, Any]]) -> List[str]:
                 messages.append(f"❌ Missing data in order: {order}")
             return
 
-        cj = by_name.get(name)
+        cj = order.get("_client_json") or by_name.get(name)
         if not cj:
             with lock:
                 messages.append(f"❌ Session not found for: {name}")
@@ -189,17 +392,9 @@ def cancel_orders(orders: List[Dict[str, Any]]) -> List[str]:
                 messages.append(f"❌ Session not found for: {name}")
             return
 
-        try:
-            resp = sdk.CancelOrder(order_id, userid)
-            msg  = (resp.get("message", "") or "").lower() if isinstance(resp, dict) else ""
-            with lock:
-                if "cancel order request sent" in msg:
-                    messages.append(f"✅ Cancelled Order {order_id} for {name}")
-                else:
-                    messages.append(f"❌ Failed to cancel Order {order_id} for {name}: {resp.get('message','') if isinstance(resp,dict) else resp}")
-        except Exception as e:
-            with lock:
-                messages.append(f"❌ Error cancelling {order_id} for {name}: {e}")
+        msg = _cancel_one(sdk, userid, name, order_id)
+        with lock:
+            messages.append(msg)
 
     threads: List[threading.Thread] = []
     for od in orders:
@@ -273,22 +468,9 @@ def get_positions() -> Dict[str, List[Dict[str, Any]]]:
 
     return data
 
-def close_positions(positions: List[Dict[str, Any]]) -> List[str]:
-    """
-    Close (square-off) positions for given [{name, symbol}] by placing
-    opposite MARKET orders via MOFSLOPENAPI. Also prints the exact payload
-    and raw response so you can see them in Railway Logs.
-    """
-    import json, os, sqlite3, sys, logging
-
-    # --- map client display name -> client json (reuse the login/session flow)
-    by_name: Dict[str, Dict[str, Any]] = {}
-    for c in _read_clients():
-        nm = (c.get("name") or c.get("display_name") or "").strip()
-        if nm:
-            by_name[nm] = c
-
-    # --- load min-qty map once (Security ID -> Min Qty). We key by symboltoken.
+def _load_min_qty_map() -> Dict[str, int]:
+    """Security ID (symboltoken) -> Min Qty from the symbols DB; {} if unavailable."""
+    import sqlite3
     min_qty_map: Dict[str, int] = {}
     try:
         if os.path.exists(SQLITE_DB):
@@ -304,125 +486,343 @@ def close_positions(positions: List[Dict[str, Any]]) -> List[str]:
             conn.close()
     except Exception as e:
         print(f"[MO][CLOSE] min-qty DB read error: {e}", flush=True)
+    return min_qty_map
+
+
+def _square_off_row(sdk, uid: str, name: str, symbol: str,
+                    pos_row: Dict[str, Any], min_qty_map: Dict[str, int]) -> str:
+    """Opposite MARKET order for one GetPosition row; returns the UI message."""
+    buy_q  = int(pos_row.get("buyquantity", 0) or 0)
+    sell_q = int(pos_row.get("sellquantity", 0) or 0)
+    net_q  = buy_q - sell_q
+    if net_q == 0:
+        return f"ℹ️ Already flat: {name} - {symbol}"
+
+    side = "SELL" if net_q > 0 else "BUY"
+    qty  = abs(net_q)
+
+    # --- lot sizing: use symboltoken to pick min qty (defaults to 1)
+    token   = str(pos_row.get("symboltoken") or "")
+    min_qty = max(1, int(min_qty_map.get(token, 1)))
+    lots    = max(1, int(qty // min_qty)) if min_qty > 0 else int(qty)
+
+    # producttype from position; MO usually expects NORMAL/VALUEPLUS/etc.
+    product = (pos_row.get("productname") or pos_row.get("producttype") or "CNC")
+
+    # --- build MO payload
+    order = {
+        "clientcode": uid,
+        "exchange": pos_row.get("exchange", "NSE"),
+        "symboltoken": int(token),
+        "buyorsell": side,
+        "ordertype": "MARKET",
+        "producttype": product,
+        "orderduration": "DAY",
+        "price": 0,
+        "triggerprice": 0,
+        "quantityinlot": int(lots),
+        "disclosedquantity": 0,
+        "amoorder": "N",
+        "algoid": "",
+        "goodtilldate": "",
+        "tag": "SQUAREOFF",
+    }
+
+    # --- print the payload (one line, so concurrent closes don't interleave)
+    try:
+        print(f"[MO][CLOSE] payload for {name} - {symbol} => {json.dumps(order)}", flush=True)
+    except Exception:
+        # never let logging break the flow
+        pass
+
+    # --- call the API
+    try:
+        _order_limiter.acquire(uid, lane="squareoff")
+        r = sdk.PlaceOrder(order)
+    except Exception as e:
+        r = {"status": "ERROR", "message": str(e)}
+
+    # --- print the raw response too
+    try:
+        print(f"[MO][CLOSE] response for {name} - {symbol} => {json.dumps(r)}", flush=True)
+    except Exception:
+        pass
+
+    # --- normalize message for UI
+    msg = r.get("message") if isinstance(r, dict) else None
+    ok = False
+    if isinstance(r, dict):
+        st = (r.get("status") or "").upper()
+        ok = st == "SUCCESS" or ("order placed" in (msg or "").lower())
+    return f"{'✅' if ok else '❌'} {name} - close {symbol}: {msg or r}"
+
+
+def close_positions(positions: List[Dict[str, Any]]) -> List[str]:
+    """
+    Close (square-off) positions for given [{name, symbol}] by placing
+    opposite MARKET orders via MOFSLOPENAPI. Positions are fetched once per
+    client and all square-offs are sent concurrently. Also prints the exact
+    payload and raw response so you can see them in Railway Logs.
+    """
+    # --- map client display name -> client json (reuse the login/session flow)
+    by_name: Dict[str, Dict[str, Any]] = {}
+    for c in _read_clients():
+        nm = (c.get("name") or c.get("display_name") or "").strip()
+        if nm:
+            by_name[nm] = c
+
+    # --- load min-qty map once (Security ID -> Min Qty). We key by symboltoken.
+    min_qty_map = _load_min_qty_map()
 
-    out: List[str] = []
+    reqs = list(positions or [])
+    out: List[Optional[str]] = [None] * len(reqs)
 
-    for req in positions or []:
+    # --- group requests by client so each client's positions are fetched once
+    groups: Dict[str, List[int]] = {}
+    for i, req in enumerate(reqs):
         name   = (req or {}).get("name")   or ""
         symbol = (req or {}).get("symbol") or ""
         if not name or not symbol:
-            out.append(f"❌ Missing name/symbol in request: {req}")
+            out[i] = f"❌ Missing name/symbol in request: {req}"
             continue
+        groups.setdefault(name, []).append(i)
 
+    def _fetch(name: str):
+        """Session + one GetPosition for this client (runs on the pool)."""
         cj  = by_name.get(name)
         uid = (cj.get("userid") or cj.get("client_id") or "").strip() if cj else ""
         sdk = _ensure_session(cj) if cj else None
         if not (cj and uid and sdk):
-            out.append(f"❌ No session for: {name}")
-            continue
-
-        # --- fetch fresh positions so we get exchange, product, symboltoken, and net qty
+            return name, uid, None, [], "no_session"
         try:
             resp = sdk.GetPosition()
             rows = resp.get("data", []) if (resp and resp.get("status") == "SUCCESS") else []
+            return name, uid, sdk, rows or [], None
         except Exception as e:
-            out.append(f"❌ GetPosition failed for {name}: {e}")
-            continue
+            return name, uid, sdk, [], e
+
+    jobs = []
+    for name, uid, sdk, rows, err in parallel_map(_fetch, list(groups), MAX_WORKERS):
+        by_sym: Dict[str, Dict[str, Any]] = {}
+        for r in rows:
+            by_sym.setdefault(r.get("symbol") or "", r)
+        for i in groups[name]:
+            symbol = (reqs[i] or {}).get("symbol") or ""
+            if err == "no_session":
+                out[i] = f"❌ No session for: {name}"
+            elif err is not None:
+                out[i] = f"❌ GetPosition failed for {name}: {err}"
+            elif symbol not in by_sym:
+                out[i] = f"❌ Position not found: {name} - {symbol}"
+            else:
+                jobs.append((i, name, symbol, uid, sdk, by_sym[symbol]))
 
-        pos_row = next((r for r in rows if (r.get("symbol") or "") == symbol), None)
-        if not pos_row:
-            out.append(f"❌ Position not found: {name} - {symbol}")
-            continue
+    def _square_off(job) -> str:
+        _, name, symbol, uid, sdk, pos_row = job
+        return _square_off_row(sdk, uid, name, symbol, pos_row, min_qty_map)
 
-        buy_q  = int(pos_row.get("buyquantity", 0) or 0)
-        sell_q = int(pos_row.get("sellquantity", 0) or 0)
-        net_q  = buy_q - sell_q
-        if net_q == 0:
-            out.append(f"ℹ️ Already flat: {name} - {symbol}")
-            continue
+    # --- every square-off, across all clients, goes out together
+    for job, msg in zip(jobs, parallel_map(_square_off, jobs, MAX_WORKERS)):
+        out[job[0]] = msg
 
-        side = "SELL" if net_q > 0 else "BUY"
-        qty  = abs(net_q)
-
-        # --- lot sizing: use symboltoken to pick min qty (defaults to 1)
-        token   = str(pos_row.get("symboltoken") or "")
-        min_qty = max(1, int(min_qty_map.get(token, 1)))
-        lots    = max(1, int(qty // min_qty)) if min_qty > 0 else int(qty)
-
-        # producttype from position; MO usually expects NORMAL/VALUEPLUS/etc.
-        product = (pos_row.get("productname") or pos_row.get("producttype") or "CNC")
-
-        # --- build MO payload
-        order = {
-            "clientcode": uid,
-            "exchange": pos_row.get("exchange", "NSE"),
-            "symboltoken": int(token),
-            "buyorsell": side,
-            "ordertype": "MARKET",
-            "producttype": product,
-            "orderduration": "DAY",
-            "price": 0,
-            "triggerprice": 0,
-            "quantityinlot": int(lots),
-            "disclosedquantity": 0,
-            "amoorder": "N",
-            "algoid": "",
-            "goodtilldate": "",
-            "tag": "SQUAREOFF",
-        }
+    return [m for m in out if m is not None]
 
-        # --- print the payload (and flush so it appears in logs immediately)
-        try:
-            print(f"[MO][CLOSE] payload for {name} - {symbol} =>", flush=True)
-            print(json.dumps(order, indent=2), flush=True)
-        except Exception:
-            # never let logging break the flow
-            pass
 
-        # --- call the API
-        try:
-            r = sdk.PlaceOrder(order)
-        except Exception as e:
-            r = {"status": "ERROR", "message": str(e)}
+def _same_instrument(row: Dict[str, Any], exchange: str, ids: Tuple[str, ...]) -> bool:
+    """Order/position row is the instrument (symboltoken in `ids`, same exchange); no `ids` = any."""
+    if not ids:
+        return True
+    if str(row.get("symboltoken") or row.get("scripcode") or "") not in ids:
+        return False
+    ex = str(row.get("exchange") or "").upper()
+    return not exchange or not ex or ex == exchange.upper()
 
-        # --- print the raw response too
-        try:
-            print(f"[MO][CLOSE] response for {name} - {symbol} =>", flush=True)
-            print(json.dumps(r, indent=2), flush=True)
-        except Exception:
-            pass
 
-        # --- normalize message for UI
-        msg = r.get("message") if isinstance(r, dict) else None
-        ok = False
-        if isinstance(r, dict):
-            st = (r.get("status") or "").upper()
-            ok = st == "SUCCESS" or ("order placed" in (msg or "").lower())
-        out.append(f"{'✅' if ok else '❌'} {name} - close {symbol}: {msg or r}")
+def open_orders(cj: Dict[str, Any], exchange: str = "", ids: Tuple[str, ...] = (), sdk=None) -> List[Dict[str, Any]]:
+    """
+    Working orders for one client from the cached (incremental) order book:
+    status "confirm" (what get_orders calls pending) plus partial fills,
+    optionally only one instrument (`exchange` + symbol tokens).
+    """
+    uid = str(cj.get("userid") or cj.get("client_id") or "").strip()
+    sdk = sdk or (_ensure_session(cj) if uid else None)
+    if not sdk:
+        return []
+    out = []
+    for o in _fetch_order_book(sdk, uid):
+        st = str(o.get("orderstatus") or "").lower()
+        if (o.get("uniqueorderid") and ("confirm" in st or "partial" in st)
+                and _same_instrument(o, exchange, ids)):
+            out.append(o)
+    return out
+
+
+def net_positions(cj: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+    """
+    Net position per symbol token for one client (seeds the router's risk
+    counters): [{symbol, net_qty, avg_price, realized}], None if the fetch failed.
+    """
+    uid = str(cj.get("userid") or cj.get("client_id") or "").strip()
+    sdk = _ensure_session(cj) if uid else None
+    if not sdk:
+        return None
+    try:
+        resp = sdk.GetPosition({"clientcode": uid})
+    except Exception as e:
+        logging.error("[MO] net_positions error for %s: %s", uid, e)
+        return None
+    if not (isinstance(resp, dict) and resp.get("status") == "SUCCESS"):
+        return None
+    rows = resp.get("data")
+    out = []
+    for r in (rows if isinstance(rows, list) else []):
+        buy_qty, sell_qty = int(r.get("buyquantity", 0) or 0), int(r.get("sellquantity", 0) or 0)
+        net = buy_qty - sell_qty
+        if net > 0:
+            avg = (r.get("buyamount", 0) or 0) / buy_qty
+        elif net < 0:
+            avg = (r.get("sellamount", 0) or 0) / sell_qty
+        else:
+            avg = 0.0
+        out.append({
+            "symbol": str(r.get("symboltoken") or r.get("scripcode") or ""),
+            "net_qty": net,
+            "avg_price": float(avg),
+            "realized": float(r.get("bookedprofitloss", 0) or 0),
+        })
+    return out
+
 
+def get_order_snapshots(client: Dict[str, Any], order_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Current order-book row for each uniqueorderid of ONE client (one incremental book pull)."""
+    uid = str(client.get("userid") or client.get("client_id") or "").strip()
+    want = {str(o).strip() for o in order_ids or [] if str(o).strip()}
+    sdk = _sessions.get(uid) or (_ensure_session(client) if uid else None)
+    if not sdk or not want:
+        return {}
+    out: Dict[str, Dict[str, Any]] = {}
+    for o in _fetch_order_book(sdk, uid):
+        oid = str(o.get("uniqueorderid") or "")
+        if oid in want:
+            out[oid] = o
     return out
 
 
-def _get_available_margin(sdk, clientcode: str) -> float:
+def kill_client(cj: Dict[str, Any], exchange: str = "", ids: Tuple[str, ...] = (),
+                pool=None) -> Dict[str, Any]:
+    """
+    Kill-switch for one client: cancel every open order, then square off every
+    non-zero position (optionally only one instrument). Cancels and square-offs each
+    go out concurrently (on `pool` when the caller shares one across clients).
+    Returns messages plus a per-phase latency breakdown:
+    { client_id, name, cancelled:[...], closed:[...],
+      timing:{orders_ms, cancel_ms, positions_ms, close_ms, total_ms} }
+    """
+    t0   = time.perf_counter()
+    name = cj.get("name") or cj.get("display_name") or cj.get("userid") or cj.get("client_id") or ""
+    uid  = str(cj.get("userid") or cj.get("client_id") or "").strip()
+    out: Dict[str, Any] = {"client_id": uid, "name": name, "cancelled": [], "closed": [], "timing": {}}
+    timing = out["timing"]
+
+    def _ms(a: float, b: float) -> float:
+        return round((b - a) * 1000.0, 3)
+
+    sdk = _ensure_session(cj) if uid else None
+    if not sdk:
+        out["cancelled"].append(f"❌ No session for: {name}")
+        return out
+
+    # --- 1) cancel open orders
+    t = time.perf_counter()
+    try:
+        open_ids = [str(o["uniqueorderid"]) for o in open_orders(cj, exchange, ids, sdk)]
+    except Exception as e:
+        open_ids = []
+        out["cancelled"].append(f"❌ Fetch orders failed for {name}: {e}")
+    t1 = time.perf_counter()
+    timing["orders_ms"] = _ms(t, t1)
+
+    out["cancelled"].extend(parallel_map(lambda oid: _cancel_one(sdk, uid, name, oid), open_ids, MAX_WORKERS, pool))
+    t2 = time.perf_counter()
+    timing["cancel_ms"] = _ms(t1, t2)
+
+    # --- 2) flatten positions
+    try:
+        resp = sdk.GetPosition({"clientcode": uid})
+        rows = resp.get("data", []) if (isinstance(resp, dict) and resp.get("status") == "SUCCESS") else []
+        rows = rows if isinstance(rows, list) else []
+    except Exception as e:
+        rows = []
+        out["closed"].append(f"❌ GetPosition failed for {name}: {e}")
+    open_pos = [
+        r for r in rows
+        if int(r.get("buyquantity", 0) or 0) != int(r.get("sellquantity", 0) or 0)
+        and _same_instrument(r, exchange, ids)
+    ]
+    min_qty_map = _load_min_qty_map() if open_pos else {}
+    t3 = time.perf_counter()
+    timing["positions_ms"] = _ms(t2, t3)
+
+    out["closed"].extend(parallel_map(
+        lambda r: _square_off_row(sdk, uid, name, r.get("symbol") or "", r, min_qty_map),
+        open_pos, MAX_WORKERS, pool
+    ))
+    t4 = time.perf_counter()
+    timing["close_ms"] = _ms(t3, t4)
+    timing["total_ms"] = _ms(t0, t4)
+    return out
+
+
+def _get_available_margin(sdk, clientcode: str, on_error: Optional[float] = 0.0) -> Optional[float]:
     """
     Motilal: fetch 'Total Available Margin for Cash' via GetReportMarginSummary.
-    Returns 0.0 on any error.
+    Returns `on_error` (0.0 by default) on any error or when the row is missing.
     """
     try:
         resp = sdk.GetReportMarginSummary(clientcode)
         if not (isinstance(resp, dict) and resp.get("status") == "SUCCESS"):
-            return 0.0
+            return on_error
         rows = resp.get("data", []) or []
         for item in rows:
             if (item.get("particulars") or "").strip().lower() == "total available margin for cash":
                 try:
                     return float(item.get("amount", 0) or 0)
                 except Exception:
-                    return 0.0
+                    return on_error
     except Exception as e:
         logging.error("❌ GetReportMarginSummary error for %s: %s", clientcode, e)
-    return 0.0
+    return on_error
+
+
 
+def fetch_available_margin(cj: Dict[str, Any]) -> Optional[float]:
+    """Cash margin for one client; None when there is no session or the call fails (unknown, not zero)."""
+    uid = str(cj.get("userid") or cj.get("client_id") or "").strip()
+    sdk = _ensure_session(cj) if uid else None
+    if not sdk:
+        return None
+    return _get_available_margin(sdk, uid, on_error=None)
+
+
+def fetch_ltp(exchange: str, scrip: int) -> Optional[float]:
+    """One GetLtp through the feed session (or any logged-in client); rupees, None on failure."""
+    sdk, uid = _ltp_feed["sdk"], _ltp_feed["uid"]
+    if sdk is None:
+        for c in _read_clients():
+            sdk = _ensure_session(c)
+            if sdk:
+                uid = str(c.get("userid") or c.get("client_id") or "").strip()
+                break
+    if sdk is None:
+        return None
+    try:
+        resp = sdk.GetLtp({"clientcode": uid, "exchange": (exchange or "NSE").upper(), "scripcode": int(scrip)})
+        if isinstance(resp, dict) and resp.get("status") == "SUCCESS":
+            ltp = float((resp.get("data") or {}).get("ltp", 0) or 0) / 100.0   # paise -> rupees
+            return ltp or None
+    except Exception as e:
+        print(f"[MO][LTP] GetLtp {exchange}:{scrip} failed: {e}", flush=True)
+    return None
 
 
 def get_holdings() -> Dict[str, Any]:
@@ -543,103 +943,231 @@ def get_holdings() -> Dict[str, Any]:
 
     return {"holdings": holdings_rows, "summary": summaries}
 
-def place_orders(orders: List[Dict[str, Any]]) -> Dict[str, Any]:
-    import json, threading
-    from typing import Dict, Any, List
+def prepare_order(od: Dict[str, Any], cj: Dict[str, Any] | None) -> Dict[str, Any]:
+    """
+    Price-independent part of a new order: session + PlaceOrder payload.
+    Returns {"key", "name", "uid", "sdk", "payload"} or {"key", "name", "error": {...}};
+    send_prepared() stamps price/trigger and sends it.
+    """
+    uid  = str(od.get("client_id") or "").strip()
+    name = od.get("name") or uid
+    key  = od.get("slice_key") or f"{od.get('tag') or ''}:{uid}"   # freeze slices carry their own key
+
+    if not cj:
+        print(f"[MO] skip name={name} uid={uid} -> Client JSON not found")
+        return {"key": key, "name": name, "error": {"status": "ERROR", "message": "Client JSON not found"}}
+
+    sdk = _ensure_session(cj)
+    if not sdk:
+        print(f"[MO] skip name={name} uid={uid} -> Session not found")
+        return {"key": key, "name": name, "error": {"status": "ERROR", "message": "Session not found"}}
+
+    payload = {
+        "clientcode": uid,
+        "exchange": (od.get("exchange") or "NSE").upper(),
+        "symboltoken": int(od.get("security_id") or 0),
+        "buyorsell": od.get("action"),
+        "ordertype": od.get("ordertype"),
+        "producttype": od.get("producttype"),
+        "orderduration": od.get("orderduration"),
+        "price": 0.0,
+        "triggerprice": 0.0,
+        "quantityinlot": int(od.get("qty") or 0),
+        "disclosedquantity": int(od.get("disclosedquantity") or 0),
+        "amoorder": od.get("amoorder", "N"),
+        "algoid": "",
+        "goodtilldate": "",
+        "tag": od.get("tag") or "",
+    }
+    return {"key": key, "name": name, "uid": uid, "sdk": sdk, "payload": payload}
 
-    if not isinstance(orders, list) or not orders:
-        return {"status": "empty", "order_responses": {}}
 
-    by_id: Dict[str, Dict[str, Any]] = {}
-    for c in _read_clients():
-        uid = str(c.get("userid") or c.get("client_id") or "").strip()
-        if uid:
-            by_id[uid] = c
+def _is_transient(resp: Any, exc: Optional[BaseException] = None) -> bool:
+    if exc is not None:
+        return isinstance(exc, _TRANSIENT_EXC)
+    if not isinstance(resp, dict) or str(resp.get("status") or "").upper() == "SUCCESS":
+        return False
+    code = str(resp.get("errorcode") or "").strip()
+    if code:
+        return code in _TRANSIENT_CODES
+    # MOFSLOPENAPI.PlaceOrder: a failed POST comes back as "POST ERROR ..." text, and
+    # json.loads() of that (or of a gateway error page) is reported with no errorcode
+    msg = str(resp.get("message") or "")
+    return msg.startswith("POST ERROR") or msg.startswith("Expecting value")
 
-    responses: Dict[str, Any] = {}
-    lock = threading.Lock()
-    threads: List[threading.Thread] = []
 
-    def _worker(od: Dict[str, Any]):
-        uid  = str(od.get("client_id") or "").strip()
-        name = od.get("name") or uid
-        cj   = by_id.get(uid)
-        key  = f"{od.get('tag') or ''}:{uid}"
+def _send_key(uid: str, payload: Dict[str, Any]) -> tuple:
+    """Sends with the same key (e.g. freeze slices) are indistinguishable in the order book."""
+    return (uid, str(payload.get("symboltoken")), str(payload.get("buyorsell") or "").upper(),
+            payload.get("tag") or "", int(payload.get("quantityinlot") or 0))
 
-        if not cj:
-            with lock:
-                responses[key] = {"status": "ERROR", "message": "Client JSON not found"}
-                print(f"[MO] skip name={name} uid={uid} -> Client JSON not found")
-            return
 
-        sdk = _ensure_session(cj)
-        if not sdk:
-            with lock:
-                responses[key] = {"status": "ERROR", "message": "Session not found"}
-                print(f"[MO] skip name={name} uid={uid} -> Session not found")
-            return
+def _claim(oid: str, key: Optional[tuple] = None) -> Optional[bool]:
+    """
+    Attribute a uniqueorderid to one send. With `key`, None means an identical
+    sibling send is still in flight, so a book row cannot be told apart from its order.
+    """
+    global _claimed_day
+    with _claimed_lock:
+        today = datetime.now(IST).date()
+        if today != _claimed_day:
+            # the order book is per day, so yesterday's ids can never match again
+            _claimed_ids.clear()
+            _claimed_day = today
+        if key is not None and _inflight.get(key, 0) > 1:
+            return None
+        if not oid or oid in _claimed_ids:
+            return False
+        _claimed_ids.add(oid)
+        return True
 
-        payload = {
-            "clientcode": uid,
-            "exchange": (od.get("exchange") or "NSE").upper(),
-            "symboltoken": int(od.get("security_id") or 0),
-            "buyorsell": od.get("action"),
-            "ordertype": od.get("ordertype"),
-            "producttype": od.get("producttype"),
-            "orderduration": od.get("orderduration"),
-            "price": float(od.get("price") or 0),
-            "triggerprice": float(od.get("triggerprice") or 0),
-            "quantityinlot": int(od.get("qty") or 0),
-            "disclosedquantity": int(od.get("disclosedquantity") or 0),
-            "amoorder": od.get("amoorder", "N"),
-            "algoid": "",
-            "goodtilldate": "",
-            "tag": od.get("tag") or "",
-        }
 
-        with lock:
-            print(f"[MO] placing name={name} uid={uid}")
-            print("[MO] payload =>")
-            try:
-                print(json.dumps(payload, indent=2))
-            except Exception:
-                print(payload)
+def _find_placed(sdk, uid: str, payload: Dict[str, Any], since: float,
+                 key: Optional[tuple] = None) -> Optional[Dict[str, Any]]:
+    """
+    An order-book row matching this payload inserted at/after `since` (epoch) and not
+    yet claimed; {"_ambiguous": True} when an identical sibling send is in flight.
+    """
+    try:
+        rows = _fetch_order_book(sdk, uid)
+    except Exception:
+        return None
+    floor = datetime.fromtimestamp(since - 2.0, IST).replace(tzinfo=None)
+    for row in reversed(rows):
+        if (str(row.get("symboltoken")) != str(payload.get("symboltoken"))
+                or str(row.get("buyorsell") or "").upper() != str(payload.get("buyorsell") or "").upper()
+                or (row.get("tag") or "") != (payload.get("tag") or "")):
+            continue
+        if row.get("quantityinlot") not in (None, "") and int(row["quantityinlot"]) != int(payload["quantityinlot"]):
+            continue
+        ts = _parse_mo_ts(row.get("recordinserttime"))
+        if ts and ts.replace(tzinfo=None) < floor:
+            continue
+        got = _claim(str(row.get("uniqueorderid") or ""), key)
+        if got is None:
+            return {"_ambiguous": True}
+        if got:
+            return {"status": "SUCCESS", "uniqueorderid": row["uniqueorderid"], "orderstatus": row.get("orderstatus")}
+    return None
 
-        try:
-            resp = sdk.PlaceOrder(payload)
-        except Exception as e:
-            resp = {"status": "ERROR", "message": str(e)}
 
-        with lock:
-            print("[MO] response =>")
+def send_prepared(prep: Dict[str, Any], price: Any = 0, triggerprice: Any = 0) -> Dict[str, Any]:
+    """
+    Stamp price/trigger onto a prepare_order() result and PlaceOrder it (adds _sent_at/_ack_at).
+    Transient failures are retried with jittered backoff inside RETRY_DEADLINE_SEC.
+    """
+    if prep.get("error"):
+        return dict(prep["error"])
+
+    payload = dict(prep["payload"])
+    payload["price"] = float(price or 0)
+    payload["triggerprice"] = float(triggerprice or 0)
+    # a re-login since arming replaces the session object
+    sdk = _sessions.get(prep["uid"]) or prep["sdk"]
+
+    key = _send_key(prep["uid"], payload)
+    with _claimed_lock:
+        _inflight[key] = _inflight.get(key, 0) + 1
+    first_sent = first_ack = None
+    retries, deduped, ambiguous = 0, False, False
+    try:
+        while True:
+            exc = None
+            _order_limiter.acquire(prep["uid"])
+            sent_at = time.time()
             try:
-                print(json.dumps(resp, indent=2))
-            except Exception:
-                print(resp)
-            responses[key] = resp
+                resp = sdk.PlaceOrder(payload)
+            except Exception as e:
+                resp, exc = {"status": "ERROR", "message": str(e)}, e
+            ack_at = time.time()
+            if first_sent is None:
+                first_sent, first_ack = sent_at, ack_at
+            if isinstance(resp, dict) and resp.get("uniqueorderid"):
+                # claimed before this send stops counting as in flight, so a retrying sibling never takes it
+                _claim(str(resp["uniqueorderid"]))
+            if retries >= RETRY_MAX or not _is_transient(resp, exc):
+                break
+            delay = backoff_delay(retries)
+            if ack_at + delay - first_sent > RETRY_DEADLINE_SEC:
+                break
+            time.sleep(delay)
+            retries += 1
+            placed = _find_placed(sdk, prep["uid"], payload, first_sent, key)
+            if placed and placed.get("_ambiguous"):
+                # an identical order (freeze slice) is still being sent: whichever book row we
+                # found may be its order, and resending could duplicate ours -> fail this child
+                ambiguous = True
+                break
+            if placed:
+                resp, deduped, ack_at = placed, True, time.time()
+                break
+    finally:
+        with _claimed_lock:
+            _inflight[key] -= 1
+            if not _inflight[key]:
+                del _inflight[key]
 
-    for od in orders:
-        t = threading.Thread(target=_worker, args=(od,))
-        t.start()
-        threads.append(t)
-    for t in threads:
-        t.join()
+    try:
+        print(f"[MO] placed name={prep['name']} uid={prep['uid']} in {(ack_at - sent_at) * 1000:.0f}ms"
+              f"{f' retries={retries}' if retries else ''}{' (deduped)' if deduped else ''} "
+              f"payload={json.dumps(payload)} -> {json.dumps(resp, default=str)}", flush=True)
+    except Exception:
+        print(resp)
+
+    if isinstance(resp, dict):
+        resp.setdefault("_sent_at", first_sent)
+        resp.setdefault("_ack_at", ack_at)
+        if retries:
+            resp["_retries"] = retries
+            resp["_retry_ms"] = round((ack_at - first_ack) * 1000.0, 3)
+            if deduped:
+                resp["_deduped"] = True
+        if ambiguous:
+            resp["_retry_skipped"] = "identical order in flight; status unknown, not resent"
+    return resp
 
-    return {"status": "completed", "order_responses": responses}
+
+def place_orders(orders: List[Dict[str, Any]]) -> Dict[str, Any]:
+    if not isinstance(orders, list) or not orders:
+        return {"status": "empty", "order_responses": {}}
+
+    by_id: Dict[str, Dict[str, Any]] = {}
+    for c in _read_clients():
+        uid = str(c.get("userid") or c.get("client_id") or "").strip()
+        if uid:
+            by_id[uid] = c
+
+    # fairness: which client goes first changes per batch (DISPATCH_ORDER / row "dispatch_order")
+    mode = str(orders[0].get("dispatch_order") or DISPATCH_ORDER).lower()
+    orders = dispatch_order(orders, lambda od: str(od.get("client_id") or "").strip(), mode,
+                            capital=lambda od: (by_id.get(str(od.get("client_id") or "").strip()) or {}).get("capital"))
+
+    def _worker(item):
+        pos, od = item
+        prep = prepare_order(od, by_id.get(str(od.get("client_id") or "").strip()))
+        resp = send_prepared(prep, od.get("price"), od.get("triggerprice"))
+        if isinstance(resp, dict):
+            resp["_dispatch_pos"] = pos
+            if resp.get("_sent_at") and resp.get("_ack_at"):
+                resp["_ack_ms"] = round((resp["_ack_at"] - resp["_sent_at"]) * 1000.0, 3)
+        return prep["key"], resp
+
+    responses: Dict[str, Any] = dict(parallel_map(_worker, list(enumerate(orders)), MAX_WORKERS))
+    return {"status": "completed", "order_responses": responses, "retry": retry_summary(responses.values()), "dispatch": mode}
 
 def modify_orders(orders: List[Dict[str, Any]]) -> Dict[str, Any]:
     """
-    Motilal ModifyOrder (order-details aware):
-      • Prefer GetOrderDetails to fetch symboltoken, orderqty, and *exact* last-modified time.
-      • Fall back to GetOrderBook if details missing.
+    Motilal ModifyOrder (order-details aware), grouped by client:
+      • One snapshot round trip per client: GetOrderDetailByUniqueorderID when the
+        client has a single row, else one (incremental) GetOrderBook pull.
       • If UI = NO_CHANGE, derive type from snapshot so STOPLOSS/SL-M don't become MARKET.
       • Convert SHARES -> LOTS using min-qty in SQLite symbols.db.
       • Always include newordertype and lastmodifiedtime per MO requirement.
+      • ModifyOrder calls run concurrently (MO_MAX_WORKERS) within each client's
+        rate budget; messages keep input order.
     """
     import json, os, sqlite3
 
-    messages: List[str] = []
-
     # ---------- small utils ----------
     def _num_i(x, default=None):
         try:
@@ -701,52 +1229,47 @@ def modify_orders(orders: List[Dict[str, Any]]) -> Dict[str, Any]:
         if has_p and not has_t: return "LIMIT"
         return "MARKET"
 
-    # load client JSON by display name
-    def _load_client(name: str) -> Dict[str, Any] | None:
-        needle = (name or "").strip().lower()
-        try:
-            for fn in os.listdir(_MO_DIR):
-                if not fn.endswith(".json"): continue
-                with open(os.path.join(_MO_DIR, fn), "r", encoding="utf-8") as f:
-                    cj = json.load(f)
-                nm = (cj.get("name") or cj.get("display_name") or "").strip().lower()
-                if nm == needle:
-                    return cj
-        except Exception:
-            pass
-        return None
+    # client JSON by display name (one folder scan, only if the router didn't attach it)
+    by_name: Dict[str, Dict[str, Any]] = {}
+    if not all((r or {}).get("_client_json") for r in orders or []):
+        for c in _read_clients():
+            nm = (c.get("name") or c.get("display_name") or "").strip().lower()
+            if nm:
+                by_name[nm] = c
 
     # ---- data sources for live order ----
     def _fetch_order_details(sdk, uid: str, oid: str) -> dict | None:
         """
-        Preferred: ask broker for a single order's details.
-        Expect fields like: symboltoken, orderqty, recordinsertime/lastmodifiedtime, etc.
+        Ask broker for a single order's details (symboltoken, orderqty, lastmodifiedtime, ...).
+        The reply may list several states of the order; keep the most recent one.
         """
         try:
-            # if your SDK signature differs, adjust accordingly
-            resp = sdk.GetOrderDetails({"clientcode": uid, "uniqueorderid": oid})
+            resp = sdk.GetOrderDetailByUniqueorderID(oid, uid)
             if isinstance(resp, dict) and resp.get("status") == "SUCCESS":
                 data = resp.get("data")
-                # some SDKs return a dict, some a 1-element list
                 if isinstance(data, list) and data:
-                    return data[0]
+                    return max(data, key=lambda r: _row_ts(r) or datetime.min)
                 if isinstance(data, dict):
                     return data
         except Exception:
             pass
         return None
 
-    def _fetch_order_book_row(sdk, uid: str, oid: str) -> dict | None:
+    def _fetch_client_snapshots(group: Dict[str, Any]) -> Dict[str, dict]:
+        sdk, uid, oids = group["sdk"], group["uid"], group["oids"]
+        out: Dict[str, dict] = {}
+        if len(oids) == 1:
+            d = _fetch_order_details(sdk, uid, oids[0])
+            if d:
+                return {oids[0]: d}
         try:
-            ts = now_ist_str().split(" ")[0] + " 09:00:00"   # "DD-MMM-YYYY 09:00:00"
-            ob = sdk.GetOrderBook({"clientcode": uid, "datetimestamp": ts})
-            rows = ob.get("data", []) if isinstance(ob, dict) else []
-            for r in rows or []:
-                if str(r.get("uniqueorderid") or "") == str(oid):
-                    return r
+            for r in _fetch_order_book(sdk, uid):
+                oid = str(r.get("uniqueorderid") or "")
+                if oid in oids:
+                    out[oid] = r
         except Exception:
             pass
-        return None
+        return out
 
     def _extract_last_mod(s: dict) -> str:
         """
@@ -793,120 +1316,131 @@ def modify_orders(orders: List[Dict[str, Any]]) -> Dict[str, Any]:
     except Exception as e:
         print(f"[MO][MODIFY] min-qty DB read error: {e}", flush=True)
 
-    # --------- process each order ---------
-    for row in (orders or []):
-        try:
-            # Debug IN row
-            try:
-                print("\n---- [MO][MODIFY] ROW (router) ----", flush=True)
-                print(json.dumps(row, indent=2, default=str), flush=True)
-            except Exception:
-                pass
-
-            name = (row.get("name") or "").strip() or "<unknown>"
-            oid  = str(row.get("order_id") or row.get("orderId") or "").strip()
-            if not oid:
-                messages.append(f"ℹ️ {name}: skipped (missing order_id)")
-                continue
-
-            cj = _load_client(name)
-            if not cj:
-                messages.append(f"❌ {name} ({oid}): client JSON not found")
-                continue
-
-            uid = str(cj.get("userid") or cj.get("client_id") or "").strip()
-            sdk = _ensure_session(cj)
+    # --------- 1) resolve each row to its client; group by client ---------
+    messages: List[str] = [""] * len(orders or [])
+    groups: Dict[str, Dict[str, Any]] = {}
+    for i, row in enumerate(orders or []):
+        name = (row.get("name") or "").strip() or "<unknown>"
+        oid  = str(row.get("order_id") or row.get("orderId") or "").strip()
+        if not oid:
+            messages[i] = f"ℹ️ {name}: skipped (missing order_id)"
+            continue
+        cj = row.get("_client_json") or by_name.get(name.lower())
+        if not cj:
+            messages[i] = f"❌ {name} ({oid}): client JSON not found"
+            continue
+        uid = str(cj.get("userid") or cj.get("client_id") or "").strip()
+        g = groups.get(uid)
+        if g is None:
+            sdk = _ensure_session(cj) if uid else None
             if not (uid and sdk):
-                messages.append(f"❌ {name} ({oid}): session not available")
+                messages[i] = f"❌ {name} ({oid}): session not available"
                 continue
-
-            price_in = row.get("price")
-            trig_in  = row.get("triggerPrice", row.get("triggerprice"))
-            qty_shares_in = _num_i(row.get("quantity"))   # router sends SHARES
-
-            # Prefer order details; fallback to order book
-            snap = _fetch_order_details(sdk, uid, oid)
-            if not snap:
-                snap = _fetch_order_book_row(sdk, uid, oid) or {}
-
-            token     = _extract_token(snap)
-            min_qty   = max(1, int(min_qty_map.get(token, 1))) if token else 1
-            shares    = qty_shares_in if _pos(qty_shares_in) else _extract_orderqty(snap) or 0
-            lots      = int(shares // min_qty) if _pos(shares) else 0
-            last_mod  = _extract_last_mod(snap)
-
-            if lots <= 0:
-                messages.append(f"❌ {name} ({oid}): cannot determine quantity in LOTS "
-                                f"(shares={shares}, token={token}, min_qty={min_qty})")
-                continue
-
-            # Decide order type (always include)
-            ui_type = _ui_to_mo(row.get("orderType"))
-            if not ui_type:  # NO_CHANGE
-                ui_type = _infer_type_from_snapshot(snap)
-
-            payload = {
-                "clientcode": uid,
-                "uniqueorderid": oid,
-                "newordertype": ui_type or "MARKET",
-                "neworderduration": str(row.get("validity") or "DAY").upper(),
-                "newdisclosedquantity": 0,
-                "lastmodifiedtime": last_mod,     # <-- echo broker's last modified time
-                "newquantityinlot": lots,         # MO expects LOTS
-            }
-            if _pos(_num_f(price_in)): payload["newprice"] = float(price_in)
-            if _pos(_num_f(trig_in)):  payload["newtriggerprice"] = float(trig_in)
-
-            # Type-specific validations
-            if payload["newordertype"] == "LIMIT" and "newprice" not in payload:
-                messages.append(f"❌ {name} ({oid}): LIMIT requires Price > 0")
-                continue
-            if payload["newordertype"] == "STOPLOSS" and not (("newprice" in payload) and ("newtriggerprice" in payload)):
-                messages.append(f"❌ {name} ({oid}): STOPLOSS requires Price & Trigger > 0")
-                continue
-            if payload["newordertype"] == "SL-M" and "newtriggerprice" not in payload:
-                messages.append(f"❌ {name} ({oid}): SL-M requires Trigger > 0")
-                continue
-
-            # Debug OUT payload
-            try:
-                print("---- [MO][MODIFY] OUT (payload) ----", flush=True)
-                print(json.dumps(payload, indent=2, default=str), flush=True)
-                print(f"[MO][MODIFY] qty calc: shares={shares}, token={token}, min_qty={min_qty}, lots={lots}", flush=True)
-            except Exception:
-                pass
-
-            # Call API
-            resp = sdk.ModifyOrder(payload)
-
-            # Debug RESP
+            g = groups[uid] = {"uid": uid, "sdk": sdk, "oids": [], "rows": []}
+        g["oids"].append(oid)
+        g["rows"].append((i, name, oid, row))
+        if isinstance(row.get("_snapshot"), dict):
+            # caller already holds a fresh book row (e.g. /modify_by_symbol)
+            g.setdefault("given", {})[oid] = row["_snapshot"]
+
+    # --------- 2) one snapshot round trip per client, clients in parallel ---------
+    glist = list(groups.values())
+    need  = [g for g in glist if len(g.get("given") or {}) < len(g["oids"])]
+    for g, snaps in zip(need, parallel_map(_fetch_client_snapshots, need, MAX_WORKERS)):
+        g["snaps"] = snaps or {}
+    for g in glist:
+        g["snaps"] = {**(g.get("given") or {}), **(g.get("snaps") or {})}
+
+    # --------- 3) build payloads ---------
+    tasks: List[Dict[str, Any]] = []
+    for g in glist:
+        uid = g["uid"]
+        for i, name, oid, row in g["rows"]:
             try:
-                print("---- [MO][MODIFY] RESP (raw) ----", flush=True)
-                print(json.dumps(resp if isinstance(resp, dict) else {"raw": resp}, indent=2, default=str), flush=True)
-            except Exception:
-                pass
-
-            # Normalize result
-            ok, msg = False, ""
-            if isinstance(resp, dict):
-                status = str(resp.get("Status") or resp.get("status") or "").lower()
-                code   = str(resp.get("ErrorCode") or resp.get("errorCode") or "")
-                msg    = resp.get("Message") or resp.get("message") or resp.get("ErrorMsg") or resp.get("errorMessage") or code
-                ok     = ("success" in status) or (resp.get("Success") is True) or code in ("0","200","201")
-            else:
-                ok = bool(resp)
-                msg = "" if ok else str(resp)
-
-            messages.append(f"{'✅' if ok else '❌'} {name} ({oid}): {'Modified' if ok else (msg or 'modify failed')}")
-
+                price_in = row.get("price")
+                trig_in  = row.get("triggerPrice", row.get("triggerprice"))
+                qty_shares_in = _num_i(row.get("quantity"))   # router sends SHARES
+
+                snap      = g["snaps"].get(oid) or {}
+                token     = _extract_token(snap)
+                min_qty   = max(1, int(min_qty_map.get(token, 1))) if token else 1
+                shares    = qty_shares_in if _pos(qty_shares_in) else _extract_orderqty(snap) or 0
+                lots      = int(shares // min_qty) if _pos(shares) else 0
+                last_mod  = _extract_last_mod(snap)
+
+                if lots <= 0:
+                    messages[i] = (f"❌ {name} ({oid}): cannot determine quantity in LOTS "
+                                   f"(shares={shares}, token={token}, min_qty={min_qty})")
+                    continue
+
+                # Decide order type (always include)
+                ui_type = _ui_to_mo(row.get("orderType"))
+                if not ui_type:  # NO_CHANGE
+                    ui_type = _infer_type_from_snapshot(snap)
+
+                payload = {
+                    "clientcode": uid,
+                    "uniqueorderid": oid,
+                    "newordertype": ui_type or "MARKET",
+                    "neworderduration": str(row.get("validity") or "DAY").upper(),
+                    "newdisclosedquantity": 0,
+                    "lastmodifiedtime": last_mod,     # <-- echo broker's last modified time
+                    "newquantityinlot": lots,         # MO expects LOTS
+                }
+                if _pos(_num_f(price_in)): payload["newprice"] = float(price_in)
+                if _pos(_num_f(trig_in)):  payload["newtriggerprice"] = float(trig_in)
+
+                # Type-specific validations
+                if payload["newordertype"] == "LIMIT" and "newprice" not in payload:
+                    messages[i] = f"❌ {name} ({oid}): LIMIT requires Price > 0"
+                    continue
+                if payload["newordertype"] == "STOPLOSS" and not (("newprice" in payload) and ("newtriggerprice" in payload)):
+                    messages[i] = f"❌ {name} ({oid}): STOPLOSS requires Price & Trigger > 0"
+                    continue
+                if payload["newordertype"] == "SL-M" and "newtriggerprice" not in payload:
+                    messages[i] = f"❌ {name} ({oid}): SL-M requires Trigger > 0"
+                    continue
+
+                tasks.append({"i": i, "name": name, "oid": oid, "uid": uid, "sdk": g["sdk"], "payload": payload})
+            except Exception as e:
+                messages[i] = f"❌ {name} ({oid}): {e}"
+
+    # --------- 4) ModifyOrder calls, bounded + rate-limited per client ---------
+    def _send(t: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            _order_limiter.acquire(t["uid"], lane="modify")
+            t["sent_at"] = time.time()
+            resp = t["sdk"].ModifyOrder(t["payload"])
+            t["ack_at"] = time.time()
         except Exception as e:
-            messages.append(f"❌ {row.get('name','<unknown>')} ({row.get('order_id','?')}): {e}")
-
-    return {"message": messages}
-
-
-
-
-
-
-
+            t["ack_at"] = None
+            return {"i": t["i"], "msg": f"❌ {t['name']} ({t['oid']}): {e}"}
+
+        print(f"[MO][MODIFY] {t['uid']}/{t['oid']} in {(t['ack_at'] - t['sent_at']) * 1000:.0f}ms "
+              f"{json.dumps(t['payload'], default=str)} -> {json.dumps(resp, default=str)}", flush=True)
+
+        # Normalize result
+        ok, msg = False, ""
+        if isinstance(resp, dict):
+            status = str(resp.get("Status") or resp.get("status") or "").lower()
+            code   = str(resp.get("ErrorCode") or resp.get("errorCode") or "")
+            msg    = resp.get("Message") or resp.get("message") or resp.get("ErrorMsg") or resp.get("errorMessage") or code
+            ok     = ("success" in status) or (resp.get("Success") is True) or code in ("0","200","201")
+        else:
+            ok = bool(resp)
+            msg = "" if ok else str(resp)
+        t["ok"] = ok
+        return {"i": t["i"], "msg": f"{'✅' if ok else '❌'} {t['name']} ({t['oid']}): {'Modified' if ok else (msg or 'modify failed')}"}
+
+    for r in parallel_map(_send, tasks, MAX_WORKERS):
+        messages[r["i"]] = r["msg"]
+
+    acked = [t for t in tasks if t.get("ack_at")]
+    timing: Dict[str, Any] = {"count": len(acked), "snapshot_calls": len(need)}
+    if acked:
+        timing.update(timing_summary(t["ack_at"] - t["sent_at"] for t in acked))
+        timing["first_to_last_ack_ms"] = round((max(t["ack_at"] for t in acked)
+                                                - min(t["ack_at"] for t in acked)) * 1000, 3)
+
+    return {"message": [m for m in messages if m], "timing": timing,
+            "modified": [t["oid"] for t in tasks if t.get("ok")]}
@@ -0,0 +1,201 @@
+# Dhan_feed_stub.py
+"""
+Local stand-in for Dhan's order-update websocket (wss://api-order-update.dhan.co).
+
+Speaks just enough RFC 6455 to accept the LoginReq message and push
+order_alert frames, so Broker_dhan's order feed can be exercised offline:
+
+    stub = StubOrderFeedServer().start()
+    Broker_dhan.start_order_feed(client, url=stub.url)
+    stub.push({"OrderNo": "1", "ClientId": "1000000001", "Status": "Pending", ...})
+    stub.drop_connections()      # forces the client to reconnect with backoff
+    stub.stop()
+
+Run directly to get a server on ws://127.0.0.1:8765 that echoes logins.
+"""
+
+import base64, hashlib, json, socket, socketserver, struct, threading
+from typing import Any, Dict, List, Optional
+
+_WS_MAGIC = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def _read_exact(sock: socket.socket, n: int) -> bytes:
+    buf = b""
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError("peer closed")
+        buf += chunk
+    return buf
+
+
+def _read_frame(sock: socket.socket):
+    """Return (opcode, payload) for one client frame (clients always mask)."""
+    b1, b2 = _read_exact(sock, 2)
+    opcode = b1 & 0x0F
+    length = b2 & 0x7F
+    if length == 126:
+        length = struct.unpack(">H", _read_exact(sock, 2))[0]
+    elif length == 127:
+        length = struct.unpack(">Q", _read_exact(sock, 8))[0]
+    mask = _read_exact(sock, 4) if b2 & 0x80 else b""
+    data = _read_exact(sock, length)
+    if mask:
+        data = bytes(b ^ mask[i % 4] for i, b in enumerate(data))
+    return opcode, data
+
+
+def _frame(payload: bytes, opcode: int = 0x1) -> bytes:
+    head = bytes([0x80 | opcode])
+    n = len(payload)
+    if n < 126:
+        head += bytes([n])
+    elif n < 65536:
+        head += bytes([126]) + struct.pack(">H", n)
+    else:
+        head += bytes([127]) + struct.pack(">Q", n)
+    return head + payload
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self) -> None:
+        server: "StubOrderFeedServer" = self.server.owner  # type: ignore[attr-defined]
+        sock = self.request
+
+        # --- HTTP upgrade
+        raw = b""
+        while b"\r\n\r\n" not in raw:
+            chunk = sock.recv(4096)
+            if not chunk:
+                return
+            raw += chunk
+        headers = {}
+        for line in raw.decode("latin-1").split("\r\n")[1:]:
+            if ":" in line:
+                k, v = line.split(":", 1)
+                headers[k.strip().lower()] = v.strip()
+        key = headers.get("sec-websocket-key", "")
+        accept = base64.b64encode(hashlib.sha1((key + _WS_MAGIC).encode()).digest()).decode()
+        sock.sendall((
+            "HTTP/1.1 101 Switching Protocols\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept}\r\n\r\n"
+        ).encode())
+
+        # --- frames
+        client_id = ""
+        try:
+            while True:
+                opcode, data = _read_frame(sock)
+                if opcode == 0x8:  # close
+                    break
+                if opcode == 0x9:  # ping -> pong
+                    sock.sendall(_frame(data, 0xA))
+                    continue
+                if opcode != 0x1:
+                    continue
+                try:
+                    msg = json.loads(data.decode("utf-8"))
+                except Exception:
+                    continue
+                login = (msg or {}).get("LoginReq") or {}
+                if login:
+                    client_id = str(login.get("ClientId") or "")
+                    if server.tokens is not None and server.tokens.get(client_id) != login.get("Token"):
+                        break  # bad credentials: drop like the real feed does
+                    server._register(client_id, sock)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            server._unregister(client_id, sock)
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class StubOrderFeedServer:
+    """
+    In-process order-update server. `tokens` ({ClientId: Token}) enables
+    login checks; leave it None to accept any login.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0,
+                 tokens: Optional[Dict[str, str]] = None) -> None:
+        self.tokens = tokens
+        self.logins: List[str] = []
+        self._lock = threading.Lock()
+        self._socks: Dict[str, List[socket.socket]] = {}
+        self._srv = _TCPServer((host, port), _Handler)
+        self._srv.owner = self  # type: ignore[attr-defined]
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._srv.server_address[:2]
+        return f"ws://{host}:{port}"
+
+    def start(self) -> "StubOrderFeedServer":
+        self._thread = threading.Thread(target=self._srv.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.drop_connections()
+        self._srv.shutdown()
+        self._srv.server_close()
+
+    def _register(self, client_id: str, sock: socket.socket) -> None:
+        with self._lock:
+            self.logins.append(client_id)
+            self._socks.setdefault(client_id, []).append(sock)
+
+    def _unregister(self, client_id: str, sock: socket.socket) -> None:
+        with self._lock:
+            lst = self._socks.get(client_id) or []
+            if sock in lst:
+                lst.remove(sock)
+
+    def connected(self, client_id: str) -> int:
+        with self._lock:
+            return len(self._socks.get(client_id) or [])
+
+    def push(self, data: Dict[str, Any], client_id: str = "") -> int:
+        """Send an order_alert to every socket logged in as the order's client."""
+        cid = client_id or str(data.get("ClientId") or "")
+        frame = _frame(json.dumps({"Type": "order_alert", "Data": data}).encode("utf-8"))
+        sent = 0
+        with self._lock:
+            targets = list(self._socks.get(cid) or [])
+        for sock in targets:
+            try:
+                sock.sendall(frame)
+                sent += 1
+            except OSError:
+                pass
+        return sent
+
+    def drop_connections(self) -> None:
+        with self._lock:
+            targets = [s for lst in self._socks.values() for s in lst]
+            self._socks.clear()
+        for sock in targets:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+                sock.close()
+            except OSError:
+                pass
+
+
+if __name__ == "__main__":
+    import time
+    stub = StubOrderFeedServer(port=8765).start()
+    print(f"stub order feed on {stub.url}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stub.stop()
@@ -1,5 +1,5 @@
 # MultiBroker_Router.py
-import os, json, importlib, base64
+import os, json, importlib, base64, csv
 from typing import Any, Dict, List,Optional
 from fastapi import FastAPI, Body, BackgroundTasks, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
@@ -7,7 +7,12 @@ from collections import OrderedDict
 import importlib, os, time
 import threading
 import os, sqlite3, threading, requests
+from concurrent.futures import ThreadPoolExecutor
+from Broker_common import parallel_map, timing_summary
+from Trigger_engine import TriggerEngine
+from Risk_limits import RiskBook, merge_limits, side_sign
 from fastapi import Query
+import numpy as np
 import pandas as pd
 
 
@@ -17,6 +22,8 @@ SYMBOL_DB_PATH = os.path.join(os.path.abspath(os.environ.get("DATA_DIR", "./data
 SYMBOL_TABLE   = "symbols"
 SYMBOL_CSV_URL = "https://raw.githubusercontent.com/Pramod541988/Stock_List/refs/heads/main/security_id.csv"
 _symbol_db_lock = threading.Lock()
+# full per-order JSON dumps in the logs (off by default: they cost more than the dispatch on big groups)
+ROUTER_DEBUG = os.getenv("ROUTER_DEBUG", "").strip().lower() in ("1", "true", "yes")
 
 
 # --- GitHub global config (single source of truth) ---
@@ -138,6 +145,7 @@ def _github_sync_dir(rel_dir: str):
 def _github_sync_down_all():
     for rel in ("clients/dhan", "clients/motilal", "groups", "copy_setups"):
         _github_sync_dir(rel)
+    _invalidate_plan_cache("github sync")
 
 
 # === GitHub persistence helpers ===
@@ -364,6 +372,10 @@ def _save(path: str, data: Dict[str, Any]):
     # write to local file
     with open(path, "w", encoding="utf-8") as f:
         json.dump(data, f, indent=4)
+    # client / group docs feed the cached order plans
+    ap = os.path.abspath(path)
+    if ap.startswith(os.path.abspath(CLIENTS_ROOT)) or ap.startswith(os.path.abspath(GROUPS_ROOT)):
+        _invalidate_plan_cache()
     # replicate to GitHub
     try:
         rel_path = os.path.relpath(path, BASE_DIR)
@@ -416,6 +428,9 @@ def _save_minimal(broker: str, payload: Dict[str, Any]) -> str:
             "session_active": bool(payload.get("session_active", False)),
         }
 
+    if isinstance(payload.get("risk_limits"), dict):
+        doc["risk_limits"] = payload["risk_limits"]
+
     path = _path_for(broker, userid)
     _save(path, doc)
     return path
@@ -476,6 +491,11 @@ def _update_minimal(broker: str, payload: Dict[str, Any]) -> str:
             "session_active": bool(payload.get("session_active", existing.get("session_active", False))),
         }
 
+    # risk limits are edited separately from the modal fields; never drop them
+    risk_limits = payload.get("risk_limits", existing.get("risk_limits"))
+    if isinstance(risk_limits, dict):
+        doc["risk_limits"] = risk_limits
+
     # Write new file
     _save(new_path, doc)
 
@@ -484,6 +504,7 @@ def _update_minimal(broker: str, payload: Dict[str, Any]) -> str:
         try:
             if os.path.exists(old_path):
                 os.remove(old_path)
+                _invalidate_plan_cache()
         except Exception:
             pass
 
@@ -556,6 +577,18 @@ def _dispatch_login(broker: str, path: str):
         # Save session status
         client["session_active"] = ok
         _save(path, client)
+        _reindex_client(broker, client)
+
+        # (Re)attach the Dhan order-update feed to the fresh token
+        if ok and broker == "dhan" and callable(getattr(mod, "start_order_feed", None)):
+            mod.start_order_feed(client)
+
+        # auto sizing / margin checks skip clients whose margin is unknown
+        if ok:
+            _refresh_client_margin(broker, client)
+
+        # armed baskets hold this client's token/session: recompile them
+        _rearm_baskets_for(str(client.get("userid") or client.get("client_id") or ""))
 
     except ModuleNotFoundError:
         print(f"[router] module for {broker} not found (Broker_dhan.py / Broker_motilal.py)")
@@ -572,6 +605,7 @@ def _delete_client_file(broker: str, userid: str) -> bool:
     path = _path_for(broker, userid)
     try:
         os.remove(path)
+        _invalidate_plan_cache()
         # Remove from GitHub as well
         try:
             rel_path = os.path.relpath(path, BASE_DIR).replace("\\", "/")
@@ -727,6 +761,16 @@ def _symbols_startup():
     _lazy_init_symbol_db()
     _github_sync_down_all()  # <- add this line
 
+@app.on_event("startup")
+def _order_feeds_startup():
+    """Open Dhan order-update sockets so order reads are served from memory."""
+    try:
+        dh = importlib.import_module("Broker_dhan")
+        n = dh.start_order_feeds()
+        print(f"[router] dhan order feeds started: {n}")
+    except Exception as e:
+        print(f"[router] dhan order feeds not started: {e}")
+
 @app.get("/health")
 def health():
     status = {}
@@ -889,6 +933,8 @@ def add_group(payload: Dict[str, Any] = Body(...)):
         "multiplier": multiplier,
         "members": members,
     }
+    if isinstance(payload.get("risk_limits"), dict):
+        doc["risk_limits"] = payload["risk_limits"]
 
     path = _group_path(doc["id"])
     _save(path, doc)
@@ -961,6 +1007,10 @@ def edit_group(payload: Dict[str, Any] = Body(...)):
             raise HTTPException(status_code=400, detail="at least one valid member is required")
         doc["members"] = members
 
+    # risk limits (replace as a whole)
+    if isinstance(payload.get("risk_limits"), dict):
+        doc["risk_limits"] = payload["risk_limits"]
+
     # ensure id present in doc
     doc["id"] = doc.get("id") or os.path.splitext(os.path.basename(path))[0]
 
@@ -985,6 +1035,7 @@ def delete_group(payload: Dict[str, Any] = Body(...)):
         if p and os.path.exists(p):
             try:
                 os.remove(p)
+                _invalidate_plan_cache()
                 # replicate delete to GitHub
                 try:
                     rel_path = os.path.relpath(p, BASE_DIR).replace("\\", "/")
@@ -1140,6 +1191,86 @@ def delete_copy_setup(payload: Dict[str, Any] = Body(...)):
 def delete_copytrading_setup(payload: Dict[str, Any] = Body(...)):
     return delete_copy_setup(payload)  # re-use the same logic
 
+# ---------- order index: order_id -> owner ----------
+# Every order id returned by get_orders / place_orders maps to
+# {broker, userid, client_json, snapshot} so cancel/modify fan-outs can
+# resolve rows without touching disk or the network. Capped at ORDER_INDEX_MAX
+# ids; the least recently indexed go first (misses fall back to a name lookup).
+ORDER_INDEX_MAX = int(os.getenv("ORDER_INDEX_MAX", "50000"))
+_order_index: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_order_index_lock = threading.Lock()
+
+def _clients_by_uid() -> Dict[str, Dict[str, Any]]:
+    """One directory scan -> {userid: {"broker", "json"}} for both brokers."""
+    out: Dict[str, Dict[str, Any]] = {}
+    for brk, folder in (("dhan", DHAN_DIR), ("motilal", MO_DIR)):
+        try:
+            for fn in os.listdir(folder):
+                if not fn.endswith(".json"):
+                    continue
+                cj = _read_json(os.path.join(folder, fn))
+                uid = str(cj.get("userid") or cj.get("client_id") or "").strip()
+                if uid:
+                    out[uid] = {"broker": brk, "json": cj}
+        except FileNotFoundError:
+            continue
+    return out
+
+def _index_order(order_id: str, broker: str, userid: str,
+                 client_json: Optional[Dict[str, Any]], snapshot: Optional[Dict[str, Any]] = None) -> None:
+    oid = str(order_id or "").strip()
+    if not oid or broker not in ("dhan", "motilal"):
+        return
+    with _order_index_lock:
+        cur = _order_index.get(oid) or {}
+        _order_index[oid] = {
+            "broker": broker,
+            "userid": str(userid or cur.get("userid") or ""),
+            "client_json": client_json or cur.get("client_json") or {},
+            "snapshot": {**(cur.get("snapshot") or {}), **(snapshot or {})},
+        }
+        _order_index.move_to_end(oid)
+        while len(_order_index) > ORDER_INDEX_MAX:
+            _order_index.popitem(last=False)
+
+def _reindex_client(broker: str, client_json: Dict[str, Any]) -> None:
+    """Point indexed orders at a client's latest JSON (e.g. after a token change)."""
+    uid = str(client_json.get("userid") or client_json.get("client_id") or "").strip()
+    with _order_index_lock:
+        for ent in _order_index.values():
+            if ent["broker"] == broker and ent["userid"] == uid:
+                ent["client_json"] = client_json
+
+def _lookup_order(order_id: str) -> Optional[Dict[str, Any]]:
+    with _order_index_lock:
+        return _order_index.get(str(order_id or "").strip())
+
+def _response_order_id(broker: str, resp: Any) -> str:
+    if not isinstance(resp, dict):
+        return ""
+    if broker == "dhan":
+        return str(resp.get("orderId") or "").strip()
+    return str(resp.get("uniqueorderid") or resp.get("UniqueOrderID") or "").strip()
+
+def _index_placed(broker: str, sent: List[Dict[str, Any]], res: Any,
+                  clients: Dict[str, Dict[str, Any]]) -> None:
+    """Index order ids from an adapter place_orders() result."""
+    responses = (res or {}).get("order_responses") if isinstance(res, dict) else None
+    if not isinstance(responses, dict):
+        return
+    for od in sent:
+        uid = str(od.get("client_id") or "")
+        tag = od.get("tag") or ""
+        # adapters key responses as "<tag>:<uid>" (Dhan drops the prefix when tag is empty)
+        resp = (responses.get(od["slice_key"]) if od.get("slice_key")
+                else responses.get(f"{tag}:{uid}") or responses.get(uid))
+        oid = _response_order_id(broker, resp)
+        if oid:
+            _index_order(oid, broker, uid, (clients.get(uid) or {}).get("json"), od)
+            sid = str(od.get("security_id") or "")
+            shares = int(od.get("qty") or 0) * (1 if broker == "dhan" else _min_qty_for(sid))
+            _risk.on_ack(oid, uid, sid, od.get("action") or "", shares, hold=od.get("risk_hold"))
+
 # put this helper near your other helpers
 def _guess_broker_from_order(order: Dict[str, Any]) -> str | None:
     """
@@ -1148,6 +1279,9 @@ def _guess_broker_from_order(order: Dict[str, Any]) -> str | None:
     - Motilal uniqueorderid: alphanumeric (letters present)
     """
     oid = str((order or {}).get("order_id", "")).strip()
+    hit = _lookup_order(oid)
+    if hit:
+        return hit["broker"]
     if oid.isdigit():
         return "dhan"
     if any(c.isalpha() for c in oid):
@@ -1182,6 +1316,7 @@ def _broker_by_client_name(name: str) -> str | None:
 def route_get_orders():
     from collections import OrderedDict
     buckets = OrderedDict({k: [] for k in STAT_KEYS})
+    clients = _clients_by_uid()
     for brk in ('dhan','motilal'):
         try:
             mod = importlib.import_module('Broker_dhan' if brk=='dhan' else 'Broker_motilal')
@@ -1190,7 +1325,12 @@ def route_get_orders():
                 data = fn()
                 if isinstance(data, dict):
                     for k in STAT_KEYS:
-                        buckets[k].extend(data.get(k, []) or [])
+                        rows = data.get(k, []) or []
+                        buckets[k].extend(rows)
+                        for row in rows:
+                            uid = str(row.get("client_id") or "")
+                            _index_order(row.get("order_id"), brk, uid,
+                                         (clients.get(uid) or {}).get("json"), row)
         except Exception as e:
             print(f"[router] get_orders error for {brk}: {e}")
     return buckets
@@ -1203,104 +1343,104 @@ def route_cancel_order(payload: Dict[str, Any] = Body(...)):
     if not isinstance(orders, list) or not orders:
         raise HTTPException(status_code=400, detail="❌ No orders received for cancellation.")
 
+    # Orders already seen on the Dhan order feed resolve from memory
+    try:
+        dh_store = importlib.import_module("Broker_dhan")
+    except Exception:
+        dh_store = None
+
     # --- bucket by broker using your working helper
     by_broker: Dict[str, List[Dict[str, Any]]] = {"dhan": [], "motilal": []}
     unknown: List[str] = []
+    by_name: Optional[Dict[str, Dict[str, Any]]] = None   # built once, only if needed
     for od in orders:
         name = (od or {}).get("name", "")
-        brk = _broker_by_client_name(name)
-        if brk in by_broker:
-            by_broker[brk].append(od)
+        hit = _lookup_order((od or {}).get("order_id", ""))
+        if hit and hit.get("client_json"):
+            by_broker[hit["broker"]].append({**od, "_client_json": hit["client_json"]})
+            continue
+        cj = dh_store.client_for_order(str((od or {}).get("order_id", ""))) if dh_store else None
+        if cj:
+            by_broker["dhan"].append({**od, "_client_json": cj})
+            continue
+        if by_name is None:
+            by_name = {}
+            for v in _clients_by_uid().values():
+                nm = (v["json"].get("name") or v["json"].get("display_name") or "").strip().lower()
+                if nm:
+                    by_name.setdefault(nm, v)
+        owner = by_name.get(str(name).strip().lower())
+        if owner:
+            by_broker[owner["broker"]].append({**od, "_client_json": owner["json"]})
         else:
             unknown.append(name or str(od))
 
-    messages: List[str] = []
+    # Both brokers' batches go out at the same time; each returns its own messages.
+    def _cancel_dhan() -> List[str]:
+        messages: List[str] = []
 
-    # -------------------------
-    # D H A N
-    # -------------------------
-    if by_broker["dhan"]:
-        try:
-            dh = importlib.import_module("Broker_dhan")
-
-            # Prefer a batch API if the module provides one
-            if hasattr(dh, "cancel_orders") and callable(getattr(dh, "cancel_orders")):
-                res = dh.cancel_orders(by_broker["dhan"])
-                if isinstance(res, list):
-                    messages.extend([str(x) for x in res])
-                elif isinstance(res, dict) and isinstance(res.get("message"), list):
-                    messages.extend([str(x) for x in res["message"]])
+        # -------------------------
+        # D H A N
+        # -------------------------
+        if by_broker["dhan"]:
+            try:
+                dh = importlib.import_module("Broker_dhan")
+                if hasattr(dh, "cancel_orders") and callable(getattr(dh, "cancel_orders")):
+                    res = dh.cancel_orders(by_broker["dhan"])
+                    if isinstance(res, list):
+                        messages.extend([str(x) for x in res])
+                    elif isinstance(res, dict) and isinstance(res.get("message"), list):
+                        messages.extend([str(x) for x in res["message"]])
+                    else:
+                        messages.append(str(res))
                 else:
-                    messages.append(str(res))
-            else:
-                # Fallback: call single-order helper cancel_order_dhan(...)
-                def _load_dhan_json(name: str) -> Optional[Dict[str, Any]]:
-                    needle = (name or "").strip().lower()
-                    try:
-                        for fn in os.listdir(DHAN_DIR):
-                            if not fn.endswith(".json"):
-                                continue
-                            path = os.path.join(DHAN_DIR, fn)
-                            with open(path, "r", encoding="utf-8") as f:
-                                cj = json.load(f)
-                            nm = (cj.get("name") or cj.get("display_name") or "").strip().lower()
-                            if nm == needle:
-                                return cj
-                    except FileNotFoundError:
-                        pass
-                    return None
-
-                for od in by_broker["dhan"]:
-                    name = od.get("name", "")
-                    oid  = od.get("order_id", "")
-                    cj   = _load_dhan_json(name)
-                    if not cj or not oid:
-                        messages.append(f"❌ Missing client JSON or order_id for {name}")
-                        continue
-                    try:
-                        resp = dh.cancel_order_dhan(cj, oid)
-                        ok = isinstance(resp, dict) and str(resp.get("status", "")).lower() == "success"
-                        if ok:
-                            messages.append(f"✅ Cancelled Order {oid} for {name}")
-                        else:
-                            err = (resp.get("message") if isinstance(resp, dict) else resp)
-                            messages.append(f"❌ Failed to cancel Order {oid} for {name}: {err}")
-                    except Exception as e:
-                        messages.append(f"❌ dhan cancel failed for {name}: {e}")
-
-        except Exception as e:
-            messages.append(f"❌ dhan cancel failed: {e}")
-
-    # -------------------------
-    # M O T I L A L
-    # -------------------------
-    if by_broker["motilal"]:
-        try:
-            mo = importlib.import_module("Broker_motilal")
-            if hasattr(mo, "cancel_orders") and callable(getattr(mo, "cancel_orders")):
-                res = mo.cancel_orders(by_broker["motilal"])
-                if isinstance(res, list):
-                    messages.extend([str(x) for x in res])
-                elif isinstance(res, dict) and isinstance(res.get("message"), list):
-                    messages.extend([str(x) for x in res["message"]])
+                    messages.append("❌ Broker_dhan.cancel_orders not implemented")
+            except Exception as e:
+                messages.append(f"❌ dhan cancel failed: {e}")
+        return messages
+
+    def _cancel_motilal() -> List[str]:
+        messages: List[str] = []
+
+        # -------------------------
+        # M O T I L A L
+        # -------------------------
+        if by_broker["motilal"]:
+            try:
+                mo = importlib.import_module("Broker_motilal")
+                if hasattr(mo, "cancel_orders") and callable(getattr(mo, "cancel_orders")):
+                    res = mo.cancel_orders(by_broker["motilal"])
+                    if isinstance(res, list):
+                        messages.extend([str(x) for x in res])
+                    elif isinstance(res, dict) and isinstance(res.get("message"), list):
+                        messages.extend([str(x) for x in res["message"]])
+                    else:
+                        messages.append(str(res))
                 else:
-                    messages.append(str(res))
-            else:
-                # Very defensive fallback: try a per-order function if it exists
-                for od in by_broker["motilal"]:
-                    try:
-                        if hasattr(mo, "cancel_order"):
-                            r = mo.cancel_order({"orders": [od]})
-                            if isinstance(r, dict) and isinstance(r.get("message"), list):
-                                messages.extend([str(x) for x in r["message"]])
+                    # Very defensive fallback: try a per-order function if it exists
+                    for od in by_broker["motilal"]:
+                        try:
+                            if hasattr(mo, "cancel_order"):
+                                r = mo.cancel_order({"orders": [od]})
+                                if isinstance(r, dict) and isinstance(r.get("message"), list):
+                                    messages.extend([str(x) for x in r["message"]])
+                                else:
+                                    messages.append(str(r))
                             else:
-                                messages.append(str(r))
-                        else:
-                            messages.append("❌ motilal cancel: no suitable function exported")
-                    except Exception as e:
-                        messages.append(f"❌ motilal cancel failed: {e}")
-        except Exception as e:
-            messages.append(f"❌ motilal cancel failed: {e}")
+                                messages.append("❌ motilal cancel: no suitable function exported")
+                        except Exception as e:
+                            messages.append(f"❌ motilal cancel failed: {e}")
+            except Exception as e:
+                messages.append(f"❌ motilal cancel failed: {e}")
+        return messages
+
+    messages: List[str] = []
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        fut_dh = ex.submit(_cancel_dhan) if by_broker["dhan"] else None
+        fut_mo = ex.submit(_cancel_motilal) if by_broker["motilal"] else None
+        for fut in (fut_dh, fut_mo):
+            if fut is not None:
+                messages.extend(fut.result())
 
     # If nothing matched, keep the UI behaviour you expect
     if not by_broker["dhan"] and not by_broker["motilal"]:
@@ -1339,45 +1479,340 @@ def route_close_positions(payload: Dict[str, Any] = Body(...)):
     if not isinstance(items, list):
         raise HTTPException(status_code=400, detail="'positions' must be a list")
 
-    # bucket by broker using name
-    def _which_broker(name: str) -> str | None:
-        if not name:
-            return None
-        needle = str(name).strip().lower()
-        for brk, folder in (("dhan", DHAN_DIR), ("motilal", MO_DIR)):
-            try:
-                for fn in os.listdir(folder):
-                    if not fn.endswith(".json"): continue
-                    with open(os.path.join(folder, fn), "r", encoding="utf-8") as f:
-                        d = json.load(f)
-                    if (d.get("name") or d.get("display_name") or "").strip().lower() == needle:
-                        return brk
-            except FileNotFoundError:
-                pass
-        return None
+    # bucket by broker using name (one directory scan; Dhan wins a name clash)
+    by_name: Dict[str, str] = {}
+    for v in _clients_by_uid().values():
+        nm = (v["json"].get("name") or v["json"].get("display_name") or "").strip().lower()
+        if nm:
+            by_name.setdefault(nm, v["broker"])
 
     buckets = {"dhan": [], "motilal": []}
     for it in items:
-        brk = _which_broker((it or {}).get("name"))
+        brk = by_name.get(str((it or {}).get("name") or "").strip().lower())
         if brk in buckets:
             buckets[brk].append(it)
 
-    messages: List[str] = []
-    for brk, rows in buckets.items():
-        if not rows: continue
+    # Both brokers' square-offs go out at the same time; each returns its own messages.
+    def _close(brk: str) -> List[str]:
+        out: List[str] = []
         try:
             mod = importlib.import_module("Broker_dhan" if brk == "dhan" else "Broker_motilal")
             fn  = getattr(mod, "close_positions", None)
-            res = fn(rows) if callable(fn) else None
+            res = fn(buckets[brk]) if callable(fn) else None
             if isinstance(res, list):
-                messages.extend([str(x) for x in res])
+                out.extend([str(x) for x in res])
             elif isinstance(res, dict):
                 msgs = res.get("message") or res.get("messages") or []
-                if isinstance(msgs, list): messages.extend([str(x) for x in msgs])
+                if isinstance(msgs, list): out.extend([str(x) for x in msgs])
         except Exception as e:
-            messages.append(f"❌ {brk} close_positions error: {e}")
+            out.append(f"❌ {brk} close_positions error: {e}")
+        return out
+
+    messages: List[str] = []
+    active = [brk for brk in ("dhan", "motilal") if buckets[brk]]
+    if active:
+        with ThreadPoolExecutor(max_workers=2) as ex:
+            for msgs in ex.map(_close, active):
+                messages.extend(msgs)
 
     return {"message": messages}
+
+
+def _scoped_clients(groups: List[str], broker: str = "") -> Dict[str, Dict[str, Any]]:
+    """{userid: {"broker","json"}} limited to the members of `groups` and/or one broker."""
+    clients = _clients_by_uid()
+    if groups:
+        allowed = set()
+        for g in groups:
+            gp = _find_group_path(str(g))
+            if not gp:
+                raise HTTPException(status_code=404, detail=f"group not found: {g}")
+            for m in (_read_json(gp).get("members") or []):
+                if isinstance(m, dict):
+                    allowed.add(str(m.get("userid") or m.get("client_id") or "").strip())
+                else:
+                    allowed.add(str(m).strip())
+        clients = {uid: ent for uid, ent in clients.items() if uid in allowed}
+    if broker:
+        clients = {uid: ent for uid, ent in clients.items() if ent["broker"] == broker}
+    return clients
+
+def _instrument_ids(symbol: str) -> Dict[str, tuple]:
+    """
+    Symbol-master id "EXCH|SYMBOL|SECURITY_ID[|MO_TOKEN]" -> per-broker (exchange, ids)
+    for the adapters' open_orders / kill_client. The brokers spell trading symbols
+    differently, so rows are matched on the instrument id, never the name.
+    """
+    parts = [p.strip() for p in str(symbol or "").split("|")]
+    if len(parts) < 3 or not parts[2]:
+        raise HTTPException(status_code=400,
+                            detail="symbol must be a symbol-master id: EXCH|SYMBOL|SECURITY_ID[|MO_TOKEN]")
+    exchange = parts[0].upper()
+    # Motilal orders are placed with the security id as symboltoken (Broker_motilal.prepare_order)
+    mo_ids = tuple(dict.fromkeys(x for x in (parts[2], parts[3] if len(parts) > 3 else "") if x))
+    return {"dhan": (exchange, (parts[2],)), "motilal": (exchange, mo_ids)}
+
+KILL_SWITCH_WORKERS       = int(os.getenv("KILL_SWITCH_WORKERS", "64"))
+KILL_SWITCH_ORDER_WORKERS = int(os.getenv("KILL_SWITCH_ORDER_WORKERS", "64"))
+
+@app.post("/kill_switch")
+def route_kill_switch(payload: Dict[str, Any] = Body(default={})):
+    """
+    Emergency exit: cancel every open order, then square off every open position,
+    for all clients of both brokers. Optional scope:
+      { group: "<id|name>" | [...], broker: "dhan"|"motilal", symbol: "EXCH|SYMBOL|SECURITY_ID[|MO_TOKEN]" }
+    Each client runs as its own task (up to KILL_SWITCH_WORKERS at once); their
+    cancels and square-offs share one pool of KILL_SWITCH_ORDER_WORKERS threads,
+    so a large scope never multiplies into clients x per-client threads.
+    Returns { message:[...], clients:[{broker, client_id, name, timing{...}}], timing:{wall_ms, per_client{...}} }
+    """
+    t0 = time.perf_counter()
+    payload = payload or {}
+    broker  = (str(payload.get("broker") or "")).strip().lower()
+    symbol  = (str(payload.get("symbol") or "")).strip()
+    groups  = payload.get("group") or payload.get("groups") or []
+    if isinstance(groups, str):
+        groups = [groups]
+    if broker and broker not in ("dhan", "motilal"):
+        raise HTTPException(status_code=400, detail="broker must be 'dhan' or 'motilal'")
+    instrument = _instrument_ids(symbol) if symbol else {"dhan": ("", ()), "motilal": ("", ())}
+
+    clients = _scoped_clients(groups, broker)
+    if not clients:
+        return {"message": ["No clients in scope."], "clients": [], "timing": {"wall_ms": 0.0}}
+
+    def _kill(item):
+        uid, ent = item
+        brk = ent["broker"]
+        t = time.perf_counter()
+        try:
+            mod = importlib.import_module("Broker_dhan" if brk == "dhan" else "Broker_motilal")
+            res = mod.kill_client(ent["json"], *instrument[brk], pool=order_pool)
+        except Exception as e:
+            res = {"client_id": uid, "name": ent["json"].get("name") or uid,
+                   "cancelled": [f"❌ {brk} kill switch failed for {uid}: {e}"], "closed": [], "timing": {}}
+        res["broker"] = brk
+        res.setdefault("timing", {}).setdefault("total_ms", round((time.perf_counter() - t) * 1000.0, 3))
+        return res
+
+    items = list(clients.items())
+    # client tasks only wait on the order pool and never submit to their own pool: no deadlock
+    with ThreadPoolExecutor(max_workers=max(1, KILL_SWITCH_ORDER_WORKERS)) as order_pool, \
+            ThreadPoolExecutor(max_workers=max(1, min(KILL_SWITCH_WORKERS, len(items)))) as ex:
+        results = list(ex.map(_kill, items))
+
+    messages: List[str] = []
+    for r in results:
+        messages.extend(str(x) for x in r.get("cancelled") or [])
+    for r in results:
+        messages.extend(str(x) for x in r.get("closed") or [])
+
+    wall_ms = round((time.perf_counter() - t0) * 1000.0, 3)
+    per_client = [{
+        "broker": r["broker"],
+        "client_id": r.get("client_id"),
+        "name": r.get("name"),
+        "cancelled": len(r.get("cancelled") or []),
+        "closed": len(r.get("closed") or []),
+        "timing": r.get("timing") or {},
+    } for r in results]
+    print(f"[KILL] scope broker={broker or '*'} group={groups or '*'} symbol={symbol or '*'} "
+          f"clients={len(items)} wall_ms={wall_ms}", flush=True)
+
+    return {
+        "message": messages or ["Nothing to cancel or close."],
+        "clients": per_client,
+        "timing": {
+            "wall_ms": wall_ms,
+            "per_client": timing_summary([(c["timing"].get("total_ms") or 0) / 1000.0 for c in per_client]),
+        },
+    }
+
+
+# ---------- modify helpers shared by /modify_order and /modify_by_symbol ----------
+def _map_ui_to_dhan(ui: str | None) -> str | None:
+    """UI / broker order-type spellings -> Dhan enum (None = keep the live type)."""
+    if not ui: return None
+    u = ui.upper().replace("-", "_")
+    m = {
+        "LIMIT": "LIMIT",
+        "MARKET": "MARKET",
+        "STOPLOSS": "STOP_LOSS",
+        "SL_LIMIT": "STOP_LOSS",
+        "SL": "STOP_LOSS",
+        "STOP_LOSS": "STOP_LOSS",
+        "SL_M": "STOP_LOSS_MARKET",
+        "SL_MARKET": "STOP_LOSS_MARKET",
+        "STOPLOSS_MARKET": "STOP_LOSS_MARKET",
+        "STOP_LOSS_MARKET": "STOP_LOSS_MARKET",
+        "NO_CHANGE": None, "": None
+    }
+    return m.get(u, None)
+
+def _modify_price_error(ot_dhan: str | None, price: float | None, trig: float | None) -> str | None:
+    """Price/trigger an explicit order-type change needs; None when the row is fine."""
+    if ot_dhan == "LIMIT" and (price is None or price <= 0):
+        return "LIMIT requires Price > 0"
+    if ot_dhan == "STOP_LOSS" and ((price is None or price <= 0) or (trig is None or trig <= 0)):
+        return "STOPLOSS requires both Price and Trigger > 0"
+    if ot_dhan == "STOP_LOSS_MARKET" and (trig is None or trig <= 0):
+        return "SL-MARKET requires Trigger > 0"
+    return None
+
+@app.post("/modify_by_symbol")
+def route_modify_by_symbol(payload: Dict[str, Any] = Body(...)):
+    """
+    Reprice every working order for one instrument across accounts.
+      { symbol: "EXCH|SYMBOL|SECURITY_ID[|MO_TOKEN]", price?, triggerprice?, orderType?, quantity?,
+        group?: "<id|name>" | [...], tag?: "<place tag>", broker?: "dhan"|"motilal" }
+    Matching orders come from the cached books (Dhan order feed store / Motilal
+    incremental order book), one lookup per client with all clients in parallel;
+    the book rows double as modify snapshots, so no per-order GET is needed.
+    Both brokers' modify_orders batches are then sent concurrently.
+    """
+    t0 = time.perf_counter()
+
+    def _f(x):
+        try:
+            s = str(x).strip()
+            return None if s == "" else float(s)
+        except Exception:
+            return None
+
+    symbol = str(payload.get("symbol") or "").strip()
+    if not symbol:
+        raise HTTPException(status_code=400, detail="'symbol' is required")
+    instrument = _instrument_ids(symbol)
+    broker = str(payload.get("broker") or "").strip().lower()
+    if broker and broker not in ("dhan", "motilal"):
+        raise HTTPException(status_code=400, detail="broker must be 'dhan' or 'motilal'")
+    groups = payload.get("group") or payload.get("groups") or []
+    if isinstance(groups, str):
+        groups = [groups]
+    tag   = str(payload.get("tag") or "").strip()
+    price = _f(payload.get("price"))
+    trig  = _f(payload.get("triggerprice") or payload.get("triggerPrice") or payload.get("trig_price"))
+    qty   = _f(payload.get("quantity"))
+    ot_ui = str(payload.get("orderType") or payload.get("ordertype") or "NO_CHANGE").strip().upper()
+    if price is None and trig is None and ot_ui in ("", "NO_CHANGE"):
+        raise HTTPException(status_code=400, detail="nothing to change: give price, triggerprice or orderType")
+    ot_dhan = _map_ui_to_dhan(ot_ui)
+    if ot_dhan is None and ot_ui not in ("", "NO_CHANGE"):
+        raise HTTPException(status_code=400, detail=f"unknown orderType: {ot_ui}")
+
+    clients = _scoped_clients(groups, broker)
+    if not clients:
+        return {"message": ["No clients in scope."], "matched": 0, "timing": {}}
+
+    def _tag_of(brk: str, row: Dict[str, Any], oid: str) -> str:
+        snap = (_lookup_order(oid) or {}).get("snapshot") or {}
+        if snap.get("tag"):
+            return str(snap["tag"])
+        if brk == "dhan":
+            # correlationId is "<tag[:13]>-<seq>" (unique per send, see Broker_dhan._child_corr)
+            return str(row.get("correlationId") or "").rsplit("-", 1)[0]
+        return str(row.get("tag") or "")
+
+    # --- 1) working orders for the symbol, one cached-book lookup per client
+    def _find(item):
+        uid, ent = item
+        brk, cj = ent["broker"], ent["json"]
+        try:
+            mod = importlib.import_module("Broker_dhan" if brk == "dhan" else "Broker_motilal")
+            return uid, brk, cj, mod.open_orders(cj, *instrument[brk]), None
+        except Exception as e:
+            return uid, brk, cj, [], e
+
+    items = list(clients.items())
+    with ThreadPoolExecutor(max_workers=max(1, min(KILL_SWITCH_WORKERS, len(items)))) as ex:
+        found = list(ex.map(_find, items))
+    t_lookup = time.perf_counter()
+
+    # --- 2) build modify rows straight from the book rows
+    by_broker: Dict[str, List[Dict[str, Any]]] = {"dhan": [], "motilal": []}
+    messages: List[str] = []
+    for uid, brk, cj, rows, err in found:
+        name = cj.get("name") or cj.get("display_name") or uid
+        if err is not None:
+            messages.append(f"❌ {name}: order book lookup failed: {err}")
+            continue
+        for r in rows:
+            oid = str(r.get("orderId") if brk == "dhan" else r.get("uniqueorderid") or "")
+            row_tag = _tag_of(brk, r, oid)
+            if tag and row_tag not in (tag, tag[:13]):
+                continue
+            _index_order(oid, brk, uid, cj)
+            # explicit type change: same price/trigger rules as /modify_order
+            err = _modify_price_error(ot_dhan,
+                                      price if price is not None else _f(r.get("price")),
+                                      trig if trig is not None else _f(r.get("triggerPrice" if brk == "dhan" else "triggerprice")))
+            if err:
+                messages.append(f"ℹ️ {name} ({oid}): {err}")
+                continue
+            lim = _risk_limits_for(uid, row_tag, cj)
+            reason = _risk.check_modify(oid, int(qty) if qty else None,
+                                        price if price is not None else _f(r.get("price")), lim) if lim else None
+            if reason:
+                messages.append(f"❌ {name} ({oid}): blocked by risk limit {reason}")
+                continue
+            if brk == "dhan":
+                ot = ot_dhan or str(r.get("orderType") or "")
+                by_broker["dhan"].append({
+                    "name": name,
+                    "order_id": oid,
+                    "validity": str(r.get("validity") or "DAY").upper(),
+                    "quantity": int(qty) if qty else int(r.get("quantity") or 0),
+                    "price": price if price is not None else (_f(r.get("price")) if ot in ("LIMIT", "STOP_LOSS") else None),
+                    "triggerPrice": trig if trig is not None else (
+                        _f(r.get("triggerPrice")) if ot in ("STOP_LOSS", "STOP_LOSS_MARKET") else None),
+                    "orderType": ot,
+                    "disclosedQuantity": 0,
+                    "_client_json": cj,
+                })
+            else:
+                by_broker["motilal"].append({
+                    "name": name,
+                    "order_id": oid,
+                    "validity": str(r.get("orderduration") or "DAY").upper(),
+                    "quantity": int(qty) if qty else None,
+                    "price": price if price is not None else _f(r.get("price")),
+                    "triggerPrice": trig if trig is not None else _f(r.get("triggerprice")),
+                    "orderType": ot_ui or "NO_CHANGE",
+                    "_client_json": cj,
+                    "_snapshot": r,
+                })
+
+    matched = len(by_broker["dhan"]) + len(by_broker["motilal"])
+    if not matched:
+        return {"message": messages or [f"No working orders for {symbol}."], "matched": 0,
+                "timing": {"lookup_ms": round((t_lookup - t0) * 1000.0, 3)}}
+
+    # --- 3) both brokers at once
+    def _send(brk: str):
+        try:
+            mod = importlib.import_module("Broker_dhan" if brk == "dhan" else "Broker_motilal")
+            return brk, mod.modify_orders(by_broker[brk])
+        except Exception as e:
+            return brk, {"message": [f"❌ {brk} modify failed: {e}"]}
+
+    timing: Dict[str, Any] = {}
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        for brk, res in ex.map(_send, [b for b in ("dhan", "motilal") if by_broker[b]]):
+            _risk_on_modified(by_broker[brk], res)
+            if isinstance(res, dict) and isinstance(res.get("message"), list):
+                messages.extend(str(x) for x in res["message"])
+                if res.get("timing"):
+                    timing[brk] = res["timing"]
+            else:
+                messages.append(str(res))
+
+    timing["lookup_ms"] = round((t_lookup - t0) * 1000.0, 3)
+    timing["wall_ms"]   = round((time.perf_counter() - t0) * 1000.0, 3)
+    print(f"[MODIFY_BY_SYMBOL] {symbol} tag={tag or '*'} group={groups or '*'} "
+          f"dhan={len(by_broker['dhan'])} motilal={len(by_broker['motilal'])} wall_ms={timing['wall_ms']}", flush=True)
+    return {"message": messages, "matched": matched, "timing": timing}
+
+
 @app.get("/get_holdings")
 def route_get_holdings():
     buckets = {"holdings": [], "summary": []}
@@ -1439,12 +1874,835 @@ def _pick_qty_for_client(ci: dict, per_client_qty: dict, default_qty: int) -> in
     return default_qty
 
 
-@app.post("/place_orders")
-def route_place_orders(payload: Dict[str, Any] = Body(...)):
-    import importlib, os, json, csv
-    from typing import Optional, Dict, Any, List
+# ------------------- min-qty lookup helpers (CSV + optional globals) -------------------
+# module level so the CSV is parsed once per process, not once per click
+def _normalize_col(name: str) -> str:
+    # "Security ID" -> "securityid", "Min qty" -> "minqty"
+    return "".join(ch for ch in str(name).lower() if ch.isalnum())
+
+def _get_min_qty_map() -> Dict[str, int]:
+    """Cache CSV -> {security_id: min_qty} on first call (per process). Robust to header variants."""
+    if hasattr(_get_min_qty_map, "_cache"):
+        return _get_min_qty_map._cache  # type: ignore[attr-defined]
+
+    cache: Dict[str, int] = {}
+    freeze: Dict[str, int] = {}
+
+    masters  = os.path.join(BASE_DIR, "masters")
+    candidates = [
+        os.environ.get("SECURITY_MIN_QTY_CSV"),
+        os.path.join(masters, "security_id_min_qty.csv"),
+        os.path.join(masters, "security_id.csv"),
+        os.path.join(BASE_DIR, "security_id_min_qty.csv"),
+        os.path.join(BASE_DIR, "security_id.csv"),
+        os.path.join(BASE_DIR, "security_master.csv"),
+        os.path.join(BASE_DIR, "security_ids.csv"),
+    ]
+    candidates = [p for p in candidates if p]
+
+    for path in candidates:
+        try:
+            if not os.path.exists(path):
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                rdr = csv.DictReader(f)
+                for row in rdr:
+                    nrow = { _normalize_col(k): v for k, v in row.items() }
+                    sid = (
+                        nrow.get("securityid") or nrow.get("security_id")
+                        or nrow.get("id") or nrow.get("token")
+                        or nrow.get("symboltoken") or ""
+                    )
+                    sid = str(sid).strip()
+                    if not sid:
+                        continue
+                    raw_mq = (
+                        nrow.get("minqty") or nrow.get("minquantity")
+                        or nrow.get("lotsize") or nrow.get("tradinglot")
+                        or nrow.get("marketlot") or nrow.get("minorderqty")
+                        or "1"
+                    )
+                    try:
+                        cache[sid] = max(1, int(float(str(raw_mq).strip())))
+                    except Exception:
+                        cache[sid] = 1
+                    raw_fz = (
+                        nrow.get("freezeqty") or nrow.get("freezequantity")
+                        or nrow.get("qtyfreeze") or nrow.get("quantityfreeze")
+                        or nrow.get("maxorderqty") or nrow.get("maxqty") or ""
+                    )
+                    try:
+                        fz = int(float(str(raw_fz).strip())) if str(raw_fz).strip() else 0
+                        if fz > 0:
+                            freeze[sid] = fz
+                    except Exception:
+                        pass
+            break
+        except Exception:
+            continue
+
+    _get_min_qty_map._cache = cache    # type: ignore[attr-defined]
+    _get_min_qty_map._freeze = freeze  # type: ignore[attr-defined]
+    return cache
+
+def _freeze_qty_for(security_id_val: str) -> int:
+    """Exchange freeze limit in shares from the symbol master; 0 = no known limit."""
+    if not security_id_val:
+        return 0
+    _get_min_qty_map()
+    return int(getattr(_get_min_qty_map, "_freeze", {}).get(str(security_id_val), 0))
+
+def _freeze_slices(qty: int, lot: int, freeze: int) -> List[int]:
+    """
+    Split `qty` (in units of `lot`, e.g. shares with lot=min qty, or lots with
+    lot=1) into lot-aligned pieces no larger than the freeze limit `freeze`
+    (same units). Returns [qty] when no split is needed.
+    """
+    lot = max(1, int(lot))
+    cap = (int(freeze) // lot) * lot
+    if cap <= 0 or qty <= cap:
+        return [int(qty)]
+    n, rem = divmod(int(qty), cap)
+    return [cap] * n + ([rem] if rem else [])
+
+def _response_key(broker: str, od: Dict[str, Any]) -> str:
+    """Key an adapter's place_orders() uses for this row in order_responses."""
+    if od.get("slice_key"):
+        return od["slice_key"]
+    uid, tag = str(od.get("client_id") or ""), od.get("tag") or ""
+    return f"{tag}:{uid}" if (tag or broker == "motilal") else uid
+
+def _expand_slices(broker: str, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """One row per freeze slice; slice rows carry slice_key (unique) and slice_of (parent key)."""
+    out: List[Dict[str, Any]] = []
+    for od in rows:
+        sl = od.get("slices") or []
+        if len(sl) < 2:
+            out.append(od)
+            continue
+        parent = _response_key(broker, od)
+        for i, q in enumerate(sl, 1):
+            out.append({**od, "qty": int(q), "slices": None, "slice_key": f"{parent}#{i}", "slice_of": parent})
+    return out
+
+def _merge_slices(broker: str, sent: List[Dict[str, Any]], res: Any) -> None:
+    """Fold slice responses back under their parent key: {status, placed, total, slices:[...]}."""
+    responses = (res or {}).get("order_responses") if isinstance(res, dict) else None
+    if not isinstance(responses, dict):
+        return
+    parents: Dict[str, Dict[str, Any]] = {}
+    for od in sent:
+        if not od.get("slice_of"):
+            continue
+        r = responses.pop(od["slice_key"], None)
+        agg = parents.setdefault(od["slice_of"], {"slices": []})
+        agg["slices"].append({"slice": od["slice_key"].rsplit("#", 1)[-1], "qty": od["qty"], "response": r})
+    for parent, agg in parents.items():
+        ok = sum(1 for s in agg["slices"] if _response_order_id(broker, s["response"]))
+        n = len(agg["slices"])
+        agg.update(status="SUCCESS" if ok == n else ("PARTIAL" if ok else "ERROR"), placed=ok, total=n)
+        responses[parent] = agg
+
+def _min_qty_for(security_id_val: str) -> int:
+    """Try user-provided helpers first, then CSV map, default=1."""
+    if not security_id_val:
+        return 1
+    for fname in ("_lookup_min_qty_sqlite", "_lookup_min_qty", "_lookup_min_qty_csv"):
+        fn = globals().get(fname)
+        if callable(fn):
+            try:
+                v = fn(str(security_id_val))
+                if v:
+                    return max(1, int(v))
+            except Exception:
+                pass
+    return int(_get_min_qty_map().get(str(security_id_val), 1))
+
+
+# ---------- plan cache: client index + compiled groups ----------
+# Placing for a group used to rescan the client folders, resolve the group file
+# (possibly scanning every group) and normalize its members on every click.
+# Both are compiled once and dropped whenever a client or group file is written
+# or deleted through the router (_save, delete endpoints, GitHub sync-down).
+_plan_cache_lock = threading.Lock()
+_plan_cache: Dict[str, Any] = {"clients": None, "groups": {}}
+_group_risk_limits: Dict[str, Dict[str, Any]] = {}   # group name -> risk_limits (loaded with the compiled group)
+
+def _invalidate_plan_cache(reason: str = "") -> None:
+    with _plan_cache_lock:
+        _plan_cache["clients"] = None
+        _plan_cache["groups"] = {}
+        _group_risk_limits.clear()
+    if reason:
+        print(f"[router] plan cache invalidated: {reason}")
+
+def _cached_client_index() -> Dict[str, Dict[str, Any]]:
+    """{userid: {"broker", "json", "name"}} for both brokers (one folder scan per invalidation)."""
+    with _plan_cache_lock:
+        idx = _plan_cache["clients"]
+    if idx is not None:
+        return idx
+    idx = {}
+    for brk, folder in (("dhan", DHAN_DIR), ("motilal", MO_DIR)):
+        try:
+            for fn in os.listdir(folder):
+                if not fn.endswith(".json"):
+                    continue
+                try:
+                    cj = _load(os.path.join(folder, fn))
+                except Exception:
+                    continue
+                uid = str(cj.get("userid") or cj.get("client_id") or "").strip()
+                if uid:
+                    idx[uid] = {"broker": brk, "json": cj, "name": cj.get("name") or cj.get("display_name") or uid}
+        except FileNotFoundError:
+            continue
+    with _plan_cache_lock:
+        _plan_cache["clients"] = idx
+    return idx
+
+def _group_member_ids(doc: Dict[str, Any]) -> List[str]:
+    out: List[str] = []
+    seen = set()
+    for m in (doc.get("members") or doc.get("clients") or []):
+        if isinstance(m, dict):
+            uid = (m.get("userid") or m.get("client_id") or m.get("id") or "").strip()
+        else:
+            uid = str(m).strip()
+        if uid and uid not in seen:
+            seen.add(uid)
+            out.append(uid)
+    return out
+
+def _compiled_group(gsel: str) -> Dict[str, Any]:
+    """
+    Resolved group: {name, key, multiplier, members, brokers, is_dhan, is_mo, risk_limits}
+    or {"error": reason}. Cached per selector until the next invalidation.
+    """
+    with _plan_cache_lock:
+        g = _plan_cache["groups"].get(gsel)
+    if g is not None:
+        return g
+    gp = _find_group_path(gsel) or os.path.join(GROUPS_ROOT, f"{str(gsel).replace(' ', '_')}.json")
+    if not gp or not os.path.exists(gp):
+        return {"error": f"group_file_missing:{gsel}"}     # not cached: the file may appear later
+    try:
+        with open(gp, "r", encoding="utf-8") as f:
+            gdoc = json.load(f) or {}
+    except Exception:
+        return {"error": f"group_file_bad:{gsel}"}
+
+    clients = _cached_client_index()
+    members = _group_member_ids(gdoc)
+    brokers = [(clients.get(u) or {}).get("broker") for u in members]
+    gname = gdoc.get("name") or gdoc.get("id") or str(gsel)
+    g = {
+        "name": gname,
+        "key": gdoc.get("id") or gname,
+        "multiplier": int(gdoc.get("multiplier", 1) or 1),
+        "members": members,
+        "brokers": brokers,
+        "is_dhan": np.fromiter((b == "dhan" for b in brokers), dtype=bool, count=len(brokers)),
+        "is_mo": np.fromiter((b == "motilal" for b in brokers), dtype=bool, count=len(brokers)),
+        "risk_limits": gdoc.get("risk_limits") or {},
+    }
+    with _plan_cache_lock:
+        _plan_cache["groups"][gsel] = g
+        _group_risk_limits[gname] = g["risk_limits"]
+    return g
+
+
+# ---------- pre-trade risk limits (Risk_limits.RiskBook) ----------
+# Limits come from "risk_limits" in client / group JSON; exposure counters are
+# fed by acks (_index_placed) and by the adapters' order-update listeners, and
+# seeded from both brokers' order books and positions at startup and each new
+# IST day (_risk_seed_loop).
+RISK_SEED_WORKERS   = int(os.getenv("RISK_SEED_WORKERS", "16"))
+RISK_SEED_CHECK_SEC = float(os.getenv("RISK_SEED_CHECK_SEC", "60"))
+_risk = RiskBook()
+
+def _risk_limits_for(uid: str, tag: str = "", cj: Optional[Dict[str, Any]] = None) -> Dict[str, float]:
+    tag = tag or ""
+    if tag and tag not in _group_risk_limits:
+        # modify/kill paths never planned this group; read it now
+        if _compiled_group(tag).get("error"):
+            with _plan_cache_lock:
+                _group_risk_limits[tag] = {}    # not a group: no rescan until the next invalidation
+    return merge_limits((cj or {}).get("risk_limits"), _group_risk_limits.get(tag))
+
+def _release_risk_holds(plans: List[Dict[str, Any]]) -> None:
+    """Free what the plans reserved but no ack consumed (rejected, failed or unsent children)."""
+    _risk.release(h for p in plans for h in (p.get("cols") or {}).get("holds") or ())
+
+def _risk_on_dhan_order(row: Dict[str, Any]) -> None:
+    _risk.on_order(row.get("orderId"), row.get("dhanClientId"), str(row.get("securityId") or ""),
+                   row.get("transactionType"), _safe_int(row.get("quantity")), _safe_int(row.get("filledQty")),
+                   _safe_float(row.get("averageTradedPrice")), row.get("orderStatus"))
+
+def _risk_on_motilal_order(uid: str, row: Dict[str, Any]) -> None:
+    _risk.on_order(row.get("uniqueorderid"), uid, str(row.get("symboltoken") or row.get("scripcode") or ""),
+                   row.get("buyorsell"), _safe_int(row.get("orderqty") or row.get("totalqty")),
+                   _safe_int(row.get("qtytradedtoday") or row.get("tradedquantity")),
+                   _safe_float(row.get("averageprice") or row.get("averagetradedprice")), row.get("orderstatus"))
+
+def _risk_on_modified(rows: List[Dict[str, Any]], res: Any) -> None:
+    """Move exposure to the new qty only for the modifies the broker accepted."""
+    ok = set(str(x) for x in ((res or {}).get("modified") or [])) if isinstance(res, dict) else set()
+    for r in rows:
+        if r.get("quantity") and str(r.get("order_id")) in ok:
+            _risk.on_modify(r["order_id"], int(r["quantity"]))
+
+def _risk_seed_once() -> None:
+    """
+    Replay every client's order book through the listeners (working orders and
+    today's fills), then overwrite net positions with the brokers' position books.
+    """
+    mods = {"dhan": importlib.import_module("Broker_dhan"), "motilal": importlib.import_module("Broker_motilal")}
+
+    def _seed(job) -> bool:
+        brk, cj = job
+        uid = str(cj.get("userid") or cj.get("client_id") or "").strip()
+        try:
+            mods[brk].open_orders(cj)
+            rows = mods[brk].net_positions(cj)
+        except Exception as e:
+            print(f"[risk] seed {brk}:{uid} failed: {e}")
+            return False
+        if rows is None:
+            return False
+        _risk.seed_positions(uid, [(r["symbol"], r["net_qty"], r["avg_price"], r["realized"]) for r in rows])
+        return True
+
+    t0 = time.time()
+    jobs = [(ent["broker"], ent["json"]) for ent in _cached_client_index().values()]
+    ok = parallel_map(_seed, jobs, RISK_SEED_WORKERS) if jobs else []
+    print(f"[risk] seeded {sum(1 for x in ok if x)}/{len(jobs)} clients in {int((time.time() - t0) * 1000)}ms")
+
+def _risk_seed_loop() -> None:
+    day = None
+    while True:
+        today = _dt.now(IST).date()
+        if today != day:
+            try:
+                _risk_seed_once()
+                day = today
+            except Exception as e:
+                print(f"[risk] seed failed: {e}")
+        time.sleep(RISK_SEED_CHECK_SEC)
+
+@app.on_event("startup")
+def _risk_startup():
+    for modname, fn in (("Broker_dhan", _risk_on_dhan_order), ("Broker_motilal", _risk_on_motilal_order)):
+        try:
+            importlib.import_module(modname).add_order_listener(fn)
+        except Exception as e:
+            print(f"[risk] {modname} order listener not registered: {e}")
+    threading.Thread(target=_risk_seed_loop, name="risk-seed", daemon=True).start()
+
+@app.get("/risk_stats")
+def route_risk_stats(userid: str = Query("")):
+    """Blocked/checked counters; ?userid= adds that client's live exposure."""
+    out: Dict[str, Any] = {"stats": {**_risk.stats, "by_reason": dict(_risk.stats["by_reason"])}}
+    if userid:
+        out["exposure"] = _risk.exposure(userid.strip())
+    return out
+
+@app.get("/rate_stats")
+def route_rate_stats():
+    """Per-broker order rate-limit lanes (cancel > squareoff > modify > new): waits and overtakes."""
+    out: Dict[str, Any] = {}
+    for key, mod_name in (("dhan", "Broker_dhan"), ("motilal", "Broker_motilal")):
+        try:
+            out[key] = importlib.import_module(mod_name)._order_limiter.stats()
+        except Exception as e:
+            out[key] = {"error": str(e)}
+    return out
+
+
+# ---------- dispatch audit: queue position, ack latency and fill slippage per child ----------
+# Each fan-out gets a batch id. Per child we keep its position in the adapter's
+# dispatch queue (see Broker_common.dispatch_order), its ack latency and, once
+# an order update shows a fill, its average fill price. /dispatch_audit compares
+# every fill with the first-dispatched filled child of the same symbol and side.
+DISPATCH_AUDIT_BATCHES = int(os.getenv("DISPATCH_AUDIT_BATCHES", "200"))
+_audit_lock = threading.Lock()
+_dispatch_audit: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()   # batch id -> {at, mode, children}
+_audit_by_oid: Dict[str, Dict[str, Any]] = {}                          # order id -> child record
+
+def _new_dispatch_batch(payload: Dict[str, Any]) -> str:
+    batch = f"B{int(time.time() * 1000)}"
+    with _audit_lock:
+        while batch in _dispatch_audit:
+            batch += "x"
+        _dispatch_audit[batch] = {"at": time.time(), "mode": payload.get("dispatch_order") or "", "children": []}
+        while len(_dispatch_audit) > DISPATCH_AUDIT_BATCHES:
+            _, old = _dispatch_audit.popitem(last=False)
+            for c in old["children"]:
+                _audit_by_oid.pop(c.get("order_id") or "", None)
+    return batch
+
+def _with_dispatch(payload: Dict[str, Any], rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Carry an explicit payload "dispatch_order" (fixed/rotate/random/capital) to the adapter rows."""
+    mode = str(payload.get("dispatch_order") or "").strip().lower()
+    return [{**od, "dispatch_order": mode} for od in rows] if mode else rows
+
+def _audit_dispatch(batch: str, broker: str, sent: List[Dict[str, Any]], res: Any) -> None:
+    """Record every child of one adapter result (call before _merge_slices folds slice responses)."""
+    responses = (res or {}).get("order_responses") if isinstance(res, dict) else None
+    if not isinstance(responses, dict):
+        return
+    with _audit_lock:
+        rec = _dispatch_audit.get(batch)
+        if rec is None:
+            return
+        if isinstance(res, dict) and res.get("dispatch"):
+            rec["mode"] = res["dispatch"]
+        for od in sent:
+            resp = responses.get(_response_key(broker, od))
+            if not isinstance(resp, dict):
+                continue
+            oid = _response_order_id(broker, resp)
+            child = {
+                "key": _response_key(broker, od), "broker": broker, "client_id": str(od.get("client_id") or ""),
+                "symbol": od.get("symbol"), "security_id": str(od.get("security_id") or od.get("symboltoken") or ""),
+                "action": (od.get("action") or "").upper(), "order_id": oid,
+                "dispatch_pos": resp.get("_dispatch_pos"), "sent_at": resp.get("_sent_at"),
+                "ack_ms": resp.get("_ack_ms"), "fill_price": None, "filled_qty": 0,
+            }
+            rec["children"].append(child)
+            if oid:
+                _audit_by_oid[oid] = child
+
+def _audit_fill(oid: Any, filled: Any, avg_price: Any) -> None:
+    child = _audit_by_oid.get(str(oid or "").strip())
+    if child is None:
+        return
+    qty, px = _safe_int(filled), _safe_float(avg_price)
+    if qty > 0 and px > 0:
+        child["filled_qty"], child["fill_price"] = qty, px
+
+def _audit_on_dhan_order(row: Dict[str, Any]) -> None:
+    _audit_fill(row.get("orderId"), row.get("filledQty"), row.get("averageTradedPrice"))
+
+def _audit_on_motilal_order(uid: str, row: Dict[str, Any]) -> None:
+    _audit_fill(row.get("uniqueorderid"), row.get("qtytradedtoday") or row.get("tradedquantity"),
+                row.get("averageprice") or row.get("averagetradedprice"))
+
+@app.on_event("startup")
+def _audit_startup():
+    for modname, fn in (("Broker_dhan", _audit_on_dhan_order), ("Broker_motilal", _audit_on_motilal_order)):
+        try:
+            importlib.import_module(modname).add_order_listener(fn)
+        except Exception as e:
+            print(f"[audit] {modname} order listener not registered: {e}")
+
+def _audit_report(batch: str, rec: Dict[str, Any]) -> Dict[str, Any]:
+    with _audit_lock:
+        children = [dict(c) for c in rec["children"]]
+    groups: Dict[tuple, List[Dict[str, Any]]] = {}
+    for c in children:
+        groups.setdefault((c["security_id"] or str(c["symbol"]), c["action"]), []).append(c)
+    summary = []
+    for (sym, action), rows in groups.items():
+        filled = sorted((c for c in rows if c["fill_price"]), key=lambda c: (c["sent_at"] or 0, c["dispatch_pos"] or 0))
+        first = filled[0] if filled else None
+        for c in filled:
+            # positive = paid more (BUY) / received less (SELL) than the first fill
+            slip = (c["fill_price"] - first["fill_price"]) * side_sign(action)
+            c["slippage"] = round(slip, 4)
+            c["slippage_bps"] = round(slip / first["fill_price"] * 1e4, 2)
+        worst = max(filled, key=lambda c: c["slippage"]) if filled else None
+        summary.append({
+            "symbol": sym, "action": action, "children": len(rows), "filled": len(filled),
+            "first_fill": first["fill_price"] if first else None,
+            "first_client": first["client_id"] if first else None,
+            "avg_slippage_bps": round(sum(c["slippage_bps"] for c in filled) / len(filled), 2) if filled else None,
+            "worst_slippage_bps": worst["slippage_bps"] if worst else None,
+            "worst_client": worst["client_id"] if worst else None,
+            "ack": timing_summary((c["ack_ms"] for c in rows), unit=1.0),
+        })
+    children.sort(key=lambda c: (c["broker"], c["dispatch_pos"] if c["dispatch_pos"] is not None else 1 << 30))
+    return {"batch": batch, "at": rec["at"], "mode": rec["mode"], "summary": summary, "children": children}
+
+@app.get("/dispatch_audit")
+def route_dispatch_audit(batch: str = Query("")):
+    """Per-child dispatch position, ack latency and fill slippage for one batch (default: the latest)."""
+    with _audit_lock:
+        batches = list(_dispatch_audit)
+        key = batch.strip() or (batches[-1] if batches else "")
+        rec = _dispatch_audit.get(key)
+    if rec is None:
+        raise HTTPException(status_code=404, detail=f"Unknown dispatch batch '{batch}'")
+    out = _audit_report(key, rec)
+    out["recent_batches"] = batches[-20:]
+    return out
+
+
+# ---------- place-and-confirm: wait for an exchange status within a deadline ----------
+# With "confirm": true, /place_orders (and legs) holds the reply until every child
+# shows an exchange status (working or terminal) or confirm_deadline_sec passes.
+# Statuses arrive by push through the adapters' order listeners (Dhan order feed,
+# Motilal order-book pulls); clients that still have unconfirmed children are also
+# polled, from CONFIRM_POLL_MIN_SEC backing off to CONFIRM_POLL_MAX_SEC.
+CONFIRM_DEADLINE_SEC = float(os.getenv("CONFIRM_DEADLINE_SEC", "5"))
+CONFIRM_DEADLINE_MAX = float(os.getenv("CONFIRM_DEADLINE_MAX", "30"))
+CONFIRM_POLL_MIN_SEC = float(os.getenv("CONFIRM_POLL_MIN_SEC", "0.1"))
+CONFIRM_POLL_MAX_SEC = float(os.getenv("CONFIRM_POLL_MAX_SEC", "1.0"))
+CONFIRM_WORKERS      = int(os.getenv("CONFIRM_WORKERS", "16"))
+_confirm_cond = threading.Condition()
+_confirm_seen: "OrderedDict[str, tuple]" = OrderedDict()   # order id -> (status, first seen at), latest 20000
+_UNCONFIRMED = ("TRANSIT", "SENT", "RECEIVED", "VALIDATION")
+_TERMINAL    = ("TRADED", "COMPLETE", "EXECUTED", "REJECT", "CANCEL", "EXPIRED", "ERROR")
+
+def _confirm_state(status: Any) -> str:
+    """'' until the order is at the exchange, then 'working' or 'terminal'."""
+    s = str(status or "").strip().upper()
+    if not s or any(w in s for w in _UNCONFIRMED):
+        return ""
+    if "PART" not in s and any(w in s for w in _TERMINAL):
+        return "terminal"
+    return "working"
+
+def _confirm_note(oid: Any, status: Any) -> None:
+    oid = str(oid or "").strip()
+    if not oid or not status:
+        return
+    with _confirm_cond:
+        prev = _confirm_seen.get(oid)
+        if prev and prev[0] == str(status):
+            return
+        _confirm_seen[oid] = (str(status), time.time())
+        _confirm_seen.move_to_end(oid)
+        while len(_confirm_seen) > 20000:
+            _confirm_seen.popitem(last=False)
+        _confirm_cond.notify_all()
+
+def _confirm_on_dhan_order(row: Dict[str, Any]) -> None:
+    _confirm_note(row.get("orderId"), row.get("orderStatus"))
+
+def _confirm_on_motilal_order(uid: str, row: Dict[str, Any]) -> None:
+    _confirm_note(row.get("uniqueorderid"), row.get("orderstatus"))
+
+@app.on_event("startup")
+def _confirm_startup():
+    for modname, fn in (("Broker_dhan", _confirm_on_dhan_order), ("Broker_motilal", _confirm_on_motilal_order)):
+        try:
+            importlib.import_module(modname).add_order_listener(fn)
+        except Exception as e:
+            print(f"[confirm] {modname} order listener not registered: {e}")
 
-    data = payload or {}
+def _confirm_deadline(payload: Dict[str, Any]) -> Optional[float]:
+    """Seconds to wait for exchange status, or None when the payload did not ask for confirm."""
+    if not payload.get("confirm"):
+        return None
+    return max(0.0, min(CONFIRM_DEADLINE_MAX, _safe_float(payload.get("confirm_deadline_sec"), CONFIRM_DEADLINE_SEC)))
+
+def _confirm_children(broker: str, sent: List[Dict[str, Any]], res: Any,
+                      client_index: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """One entry per child response of an adapter result (call before _merge_slices)."""
+    responses = (res or {}).get("order_responses") if isinstance(res, dict) else None
+    if not isinstance(responses, dict):
+        return []
+    out = []
+    for od in sent:
+        resp = responses.get(_response_key(broker, od))
+        if isinstance(resp, dict):
+            uid = str(od.get("client_id") or "")
+            out.append({"broker": broker, "client_id": uid, "cj": (client_index.get(uid) or {}).get("json"),
+                        "order_id": _response_order_id(broker, resp), "resp": resp})
+    return out
+
+def _await_confirm(children: List[Dict[str, Any]], deadline_sec: float) -> Dict[str, Any]:
+    """
+    Wait until every placed child has an exchange status or the deadline passes.
+    Stamps _confirm_state / _confirm_status / _confirm_ms onto each child response
+    and returns counts plus time-to-confirm percentiles (ms from send).
+    """
+    t0 = time.time()
+    t_end = t0 + deadline_sec
+    pending: Dict[str, Dict[str, Any]] = {}
+    for c in children:
+        st = c["resp"].get("orderStatus") or c["resp"].get("orderstatus")
+        if not c["order_id"]:
+            c["resp"].update(_confirm_state="failed", _confirm_status=st or c["resp"].get("status") or "")
+            continue
+        if _confirm_state(st):                       # the ack itself already carries an exchange status
+            _confirm_note(c["order_id"], st)
+        pending[c["order_id"]] = c
+
+    # adaptive polling per client: first look soon, then back off while the order stays in transit
+    polls: Dict[tuple, List[float]] = {}
+    for c in pending.values():
+        if c["cj"]:
+            polls.setdefault((c["broker"], c["client_id"]), [t0 + CONFIRM_POLL_MIN_SEC, CONFIRM_POLL_MIN_SEC])
+    n_polls = 0
+
+    def _poll(k: tuple) -> None:
+        brk, uid = k
+        ids = [oid for oid, c in pending.items() if (c["broker"], c["client_id"]) == k]
+        if not ids:
+            return
+        try:
+            mod = importlib.import_module("Broker_dhan" if brk == "dhan" else "Broker_motilal")
+            if brk == "dhan":
+                rows = mod.get_order_snapshots(pending[ids[0]]["cj"], ids, max_age=0)
+            else:
+                rows = mod.get_order_snapshots(pending[ids[0]]["cj"], ids)
+        except Exception as e:
+            print(f"[confirm] {brk} status poll failed for {uid}: {e}")
+            return
+        for oid, row in (rows or {}).items():
+            _confirm_note(oid, row.get("orderStatus") if brk == "dhan" else row.get("orderstatus"))
+
+    while True:
+        with _confirm_cond:
+            for oid in list(pending):
+                hit = _confirm_seen.get(oid)
+                if hit and _confirm_state(hit[0]):
+                    c = pending.pop(oid)
+                    sent_at = c["resp"].get("_sent_at") or t0
+                    c["resp"].update(_confirm_state=_confirm_state(hit[0]), _confirm_status=hit[0],
+                                     _confirm_ms=round(max(0.0, hit[1] - sent_at) * 1000.0, 3))
+            now = time.time()
+            if not pending or now >= t_end:
+                break
+            live = {(c["broker"], c["client_id"]) for c in pending.values()} & set(polls)
+            due = [k for k in live if polls[k][0] <= now]
+            if not due:
+                wake = min([polls[k][0] for k in live] + [t_end])
+                _confirm_cond.wait(max(0.001, wake - now))
+                continue
+        parallel_map(_poll, due, CONFIRM_WORKERS)
+        n_polls += len(due)
+        now = time.time()
+        for k in due:
+            iv = min(CONFIRM_POLL_MAX_SEC, polls[k][1] * 1.5)
+            polls[k] = [now + iv, iv]
+
+    with _confirm_cond:
+        for oid, c in pending.items():
+            hit = _confirm_seen.get(oid)
+            c["resp"].update(_confirm_state="unconfirmed",
+                             _confirm_status=(hit[0] if hit else c["resp"].get("orderStatus") or c["resp"].get("orderstatus") or ""))
+
+    states: Dict[str, int] = {}
+    for c in children:
+        st = c["resp"].get("_confirm_state") or "unconfirmed"
+        states[st] = states.get(st, 0) + 1
+    return {
+        "deadline_sec": deadline_sec,
+        "waited_ms": round((time.time() - t0) * 1000.0, 3),
+        "children": len(children),
+        "confirmed": states.get("working", 0) + states.get("terminal", 0),
+        "states": states,
+        "polls": n_polls,
+        "time_to_confirm": timing_summary((c["resp"].get("_confirm_ms") for c in children), unit=1.0),
+    }
+
+
+# ---------- auto sizing inputs: margin / LTP cache refreshed in the background ----------
+# qtySelection == "auto" sizes every member from capital, cached available margin
+# and a cached LTP. A daemon thread refreshes margins for all clients (and LTPs
+# for symbols that have been sized) every SIZING_REFRESH_SEC, so placing an
+# auto-sized order makes no broker calls of its own. The loop starts with the
+# app and a login refreshes that client's margin at once; until a client's
+# margin is known, orders that need it skip the client as margin_unknown.
+SIZING_REFRESH_SEC = float(os.getenv("SIZING_REFRESH_SEC", "30"))
+SIZING_WORKERS     = int(os.getenv("SIZING_WORKERS", "16"))
+_sizing_lock = threading.Lock()
+_sizing: Dict[str, Any] = {"margin": {}, "ltp": {}, "symbols": {}, "thread": None, "refreshed_at": 0.0}
+
+def _sizing_clients() -> List[tuple]:
+    out = []
+    for brk, folder in (("dhan", DHAN_DIR), ("motilal", MO_DIR)):
+        try:
+            for fn in os.listdir(folder):
+                if fn.endswith(".json"):
+                    try:
+                        out.append((brk, _load(os.path.join(folder, fn))))
+                    except Exception:
+                        continue
+        except FileNotFoundError:
+            continue
+    return out
+
+def _fetch_margin(brk: str, cj: Dict[str, Any]) -> tuple:
+    uid = str(cj.get("userid") or cj.get("client_id") or "").strip()
+    try:
+        mod = importlib.import_module("Broker_dhan" if brk == "dhan" else "Broker_motilal")
+        return uid, mod.fetch_available_margin(cj)
+    except Exception as e:
+        print(f"[sizing] margin {brk}:{uid} failed: {e}")
+        return uid, None
+
+def _refresh_client_margin(brk: str, cj: Dict[str, Any]) -> None:
+    """One client's margin right after its login, instead of at the next refresh."""
+    uid, m = _fetch_margin(brk, cj)
+    if uid and m is not None:
+        with _sizing_lock:
+            _sizing["margin"][uid] = float(m)
+
+def _refresh_sizing_once() -> None:
+    mods = {"dhan": importlib.import_module("Broker_dhan"), "motilal": importlib.import_module("Broker_motilal")}
+
+    clients = _sizing_clients()
+    now = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, min(SIZING_WORKERS, len(clients) or 1))) as ex:
+        margins = list(ex.map(lambda job: _fetch_margin(*job), clients))
+    with _sizing_lock:
+        for uid, m in margins:
+            if uid and m is not None:
+                _sizing["margin"][uid] = float(m)
+        symbols = list(_sizing["symbols"].values())
+    for exch, scrip in symbols:
+        ltp = mods["motilal"].fetch_ltp(exch, scrip)
+        if ltp:
+            with _sizing_lock:
+                _sizing["ltp"][f"{exch}:{scrip}"] = float(ltp)
+    _sizing["refreshed_at"] = now
+    print(f"[sizing] refreshed margins={sum(1 for _, m in margins if m is not None)}/{len(clients)} "
+          f"ltps={len(symbols)} in {int((time.time() - now) * 1000)}ms")
+
+def _sizing_loop() -> None:
+    while True:
+        time.sleep(SIZING_REFRESH_SEC)
+        try:
+            _refresh_sizing_once()
+        except Exception as e:
+            print(f"[sizing] refresh failed: {e}")
+
+def _ensure_sizing_cache() -> None:
+    """Start the refresh loop once per process (first refresh in the background, never on a request)."""
+    with _sizing_lock:
+        if _sizing["thread"] is not None:
+            return
+        _sizing["thread"] = threading.Thread(target=_sizing_loop, name="sizing-refresh", daemon=True)
+
+    def _first():
+        try:
+            _refresh_sizing_once()
+        except Exception as e:
+            print(f"[sizing] initial refresh failed: {e}")
+        _sizing["thread"].start()
+
+    threading.Thread(target=_first, name="sizing-first", daemon=True).start()
+
+@app.on_event("startup")
+def _sizing_startup():
+    _ensure_sizing_cache()
+
+def _cached_ltp(exchange: str, scrip: int) -> Optional[float]:
+    """Feed LTP if the trigger feed has one, else the cache (symbol is tracked from now on). No broker call."""
+    live = _triggers.last_price(exchange, scrip)
+    if live:
+        return float(live)
+    key = f"{exchange}:{scrip}"
+    with _sizing_lock:
+        _sizing["symbols"].setdefault(key, (exchange, scrip))
+        return _sizing["ltp"].get(key)
+
+def _sizing_ltp(exchange: str, scrip: int) -> Optional[float]:
+    """_cached_ltp(), but a cold symbol is fetched once."""
+    key = f"{exchange}:{scrip}"
+    ltp = _cached_ltp(exchange, scrip)
+    if ltp:
+        return ltp
+    try:
+        ltp = importlib.import_module("Broker_motilal").fetch_ltp(exchange, scrip)
+    except Exception as e:
+        print(f"[sizing] LTP {key} failed: {e}")
+        ltp = None
+    if ltp:
+        with _sizing_lock:
+            _sizing["ltp"][key] = float(ltp)
+    return ltp
+
+def _auto_size(ids: List[str], client_index: Dict[str, Dict[str, Any]], unit_cost: float,
+               capital_pct: float = 100.0) -> tuple:
+    """
+    Lots per member = floor(min(capital * pct, available margin) / unit_cost).
+    A missing capital falls back to margin alone. Returns (lots, margin_unknown
+    mask); members whose margin is not cached yet get 0 lots.
+    """
+    n = len(ids)
+    if unit_cost <= 0 or not n:
+        return np.zeros(n, dtype=np.int64), np.zeros(n, dtype=bool)
+    capital = np.fromiter((_safe_float(((client_index.get(u) or {}).get("json") or {}).get("capital")) for u in ids),
+                          dtype=float, count=n)
+    with _sizing_lock:
+        mcache = _sizing["margin"]
+        margin = np.fromiter((mcache.get(u, np.nan) for u in ids), dtype=float, count=n)
+    unknown = np.isnan(margin)
+    budget = np.where(capital > 0, capital * (capital_pct / 100.0), np.nan)
+    budget = np.nan_to_num(np.fmin(budget, margin), nan=0.0)
+    budget[unknown] = 0.0
+    return np.maximum(np.floor(budget / unit_cost), 0).astype(np.int64), unknown
+
+def _safe_float(val, default=0.0) -> float:
+    try:
+        return float(val) if val not in (None, "") else default
+    except Exception:
+        return default
+
+
+def _expand_members(data: Dict[str, Any], client_index: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Member columns for a payload's clients or groups, independent of symbol and
+    quantity: {ids, tags, gkeys, brokers, mult, is_dhan, is_mo, skipped}.
+    One parallel column per field instead of one dict per member; rows are
+    materialized only when something is about to be sent.
+    """
+    ids: List[str] = []
+    tags: List[str] = []
+    gkeys: List[str] = []
+    brokers: List[Optional[str]] = []
+    mult_chunks: List["np.ndarray"] = []
+    dhan_chunks: List["np.ndarray"] = []
+    mo_chunks: List["np.ndarray"] = []
+    skipped: List[Dict[str, Any]] = []
+
+    if bool(data.get("groupacc", False)):
+        for gsel in data.get("groups", []) or []:
+            g = _compiled_group(gsel)
+            if g.get("error"):
+                skipped.append({"_skip": True, "reason": g["error"]})
+                continue
+            m = len(g["members"])
+            ids.extend(g["members"])
+            tags.extend([g["name"]] * m)
+            gkeys.extend([g["key"]] * m)
+            brokers.extend(g["brokers"])
+            mult_chunks.append(np.full(m, g["multiplier"], dtype=np.int64))
+            dhan_chunks.append(g["is_dhan"])
+            mo_chunks.append(g["is_mo"])
+    else:
+        members = [str(c) for c in (data.get("clients", []) or [])]
+        brk_list = [(client_index.get(c) or {}).get("broker") for c in members]
+        ids.extend(members)
+        tags.extend([""] * len(members))
+        gkeys.extend([""] * len(members))
+        brokers.extend(brk_list)
+        mult_chunks.append(np.ones(len(members), dtype=np.int64))
+        dhan_chunks.append(np.fromiter((b == "dhan" for b in brk_list), dtype=bool, count=len(brk_list)))
+        mo_chunks.append(np.fromiter((b == "motilal" for b in brk_list), dtype=bool, count=len(brk_list)))
+
+    def _cat(chunks, dtype):
+        return np.concatenate(chunks) if chunks else np.zeros(0, dtype=dtype)
+
+    return {"ids": ids, "tags": tags, "gkeys": gkeys, "brokers": brokers, "mult": _cat(mult_chunks, np.int64),
+            "is_dhan": _cat(dhan_chunks, bool), "is_mo": _cat(mo_chunks, bool), "skipped": skipped}
+
+def _plan_place_orders(data: Dict[str, Any], defer_price: bool = False,
+                       members: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Everything /place_orders does before dispatch: parse the symbol, resolve
+    clients and groups, compute per-client quantities (Dhan in shares, Motilal
+    in lots). Returns {"by_broker": {"dhan": [...], "motilal": [...]},
+    "skipped": [...], "client_index": {...}}.
+    defer_price=True skips the price/trigger checks (armed baskets stamp them at fire time).
+    members: an _expand_members() result to reuse (legs of one basket share it).
+    """
+    data = data or {}
 
     # ------------------- robust symbol parsing -------------------
     raw_symbol = (data.get("symbol") or "").strip()  # "NSE|PNB EQ|110666|17000"
@@ -1485,8 +2743,6 @@ def route_place_orders(payload: Dict[str, Any] = Body(...)):
 
     # ------------------- common UI fields -------------------
     groupacc        = bool(data.get("groupacc", False))
-    groups          = data.get("groups", []) or []
-    clients         = data.get("clients", []) or []
     diffQty         = bool(data.get("diffQty", False))
     multiplier_flag = bool(data.get("multiplier", False))
     qtySelection    = data.get("qtySelection", "manual")
@@ -1503,233 +2759,237 @@ def route_place_orders(payload: Dict[str, Any] = Body(...)):
     amoorder        = data.get("amoorder", "N")
     correlation_id  = data.get("correlationId", "") or data.get("correlation_id", "")
 
-    if ordertype == "LIMIT" and price <= 0:
-        raise HTTPException(status_code=400, detail="Price must be > 0 for LIMIT orders.")
-    if "SL" in ordertype and triggerprice <= 0:
-        raise HTTPException(status_code=400, detail="Trigger price is required for SL/SL-M orders.")
-
-    # ------------------- client index (userid -> broker/name/json) -------------------
-    BASE_DIR   = os.path.abspath(os.environ.get("DATA_DIR", "./data"))
-    DHAN_DIR   = os.path.join(BASE_DIR, "clients", "dhan")
-    MO_DIR     = os.path.join(BASE_DIR, "clients", "motilal")
-    GROUPS_DIR = os.path.join(BASE_DIR, "groups")
+    if not defer_price:
+        if ordertype == "LIMIT" and price <= 0:
+            raise HTTPException(status_code=400, detail="Price must be > 0 for LIMIT orders.")
+        if "SL" in ordertype and triggerprice <= 0:
+            raise HTTPException(status_code=400, detail="Trigger price is required for SL/SL-M orders.")
 
-    def _index_clients() -> Dict[str, Dict[str, Any]]:
-        idx: Dict[str, Dict[str, Any]] = {}
-        for brk, folder in (("dhan", DHAN_DIR), ("motilal", MO_DIR)):
-            try:
-                for fn in os.listdir(folder):
-                    if not fn.endswith(".json"):
-                        continue
-                    with open(os.path.join(folder, fn), "r", encoding="utf-8") as f:
-                        cj = json.load(f)
-                    uid = str(cj.get("userid") or cj.get("client_id") or "").strip()
-                    if uid:
-                        idx[uid] = {
-                            "broker": brk,
-                            "json": cj,
-                            "name": cj.get("name") or cj.get("display_name") or uid,
-                        }
-            except FileNotFoundError:
-                continue
-        return idx
+    # ------------------- client index (userid -> broker/name/json), cached -------------------
+    client_index = _cached_client_index()
 
-    client_index = _index_clients()
+    sid = str(security_id or "")
+    lot = 1
+    try:
+        lot = max(1, int(_min_qty_for(sid))) if sid else 1
+    except Exception:
+        lot = 1
 
     # ------------------- qty calc helper -------------------
-    def _auto_qty_fallback(_client_id: str, _price: float) -> int:
-        return quantityinlot
-
-    # ------------------- min-qty lookup helpers (CSV + optional globals) -------------------
-    def _normalize_col(name: str) -> str:
-        # "Security ID" -> "securityid", "Min qty" -> "minqty"
-        return "".join(ch for ch in str(name).lower() if ch.isalnum())
-
-    def _get_min_qty_map() -> Dict[str, int]:
-        """Cache CSV -> {security_id: min_qty} on first call. Robust to header variants."""
-        if hasattr(_get_min_qty_map, "_cache"):
-            return _get_min_qty_map._cache  # type: ignore[attr-defined]
-
-        cache: Dict[str, int] = {}
-
-        masters  = os.path.join(BASE_DIR, "masters")
-        candidates = [
-            os.environ.get("SECURITY_MIN_QTY_CSV"),
-            os.path.join(masters, "security_id_min_qty.csv"),
-            os.path.join(masters, "security_id.csv"),
-            os.path.join(BASE_DIR, "security_id_min_qty.csv"),
-            os.path.join(BASE_DIR, "security_id.csv"),
-            os.path.join(BASE_DIR, "security_master.csv"),
-            os.path.join(BASE_DIR, "security_ids.csv"),
-        ]
-        candidates = [p for p in candidates if p]
-
-        for path in candidates:
-            try:
-                if not os.path.exists(path):
-                    continue
-                with open(path, "r", encoding="utf-8") as f:
-                    rdr = csv.DictReader(f)
-                    for row in rdr:
-                        nrow = { _normalize_col(k): v for k, v in row.items() }
-                        sid = (
-                            nrow.get("securityid") or nrow.get("security_id")
-                            or nrow.get("id") or nrow.get("token")
-                            or nrow.get("symboltoken") or ""
-                        )
-                        sid = str(sid).strip()
-                        if not sid:
-                            continue
-                        raw_mq = (
-                            nrow.get("minqty") or nrow.get("minquantity")
-                            or nrow.get("lotsize") or nrow.get("tradinglot")
-                            or nrow.get("marketlot") or nrow.get("minorderqty")
-                            or "1"
-                        )
-                        try:
-                            cache[sid] = max(1, int(float(str(raw_mq).strip())))
-                        except Exception:
-                            cache[sid] = 1
-                break
-            except Exception:
-                continue
-
-        _get_min_qty_map._cache = cache  # type: ignore[attr-defined]
-        return cache
-
-    def _min_qty_for(security_id_val: str) -> int:
-        """Try user-provided helpers first, then CSV map, default=1."""
-        if not security_id_val:
-            return 1
-        for fname in ("_lookup_min_qty_sqlite", "_lookup_min_qty", "_lookup_min_qty_csv"):
-            fn = globals().get(fname)
-            if callable(fn):
+    unit_cost = None
+    margin_unknown: set = set()     # auto-sized members without a cached margin
+
+    def _auto_qty(ids: List[str]) -> "np.ndarray":
+        # cost of one lot: explicit margin_per_lot (F&O), else price (LIMIT) or cached LTP x lot size
+        nonlocal unit_cost
+        if unit_cost is None:
+            _ensure_sizing_cache()
+            unit_cost = _safe_float(data.get("margin_per_lot"))
+            if unit_cost <= 0:
+                px = price if price > 0 else None
+                if px is None:
+                    try:
+                        px = _sizing_ltp(exchange_val, int(symboltoken or security_id))
+                    except Exception:
+                        px = None
+                if not px:
+                    raise HTTPException(status_code=400, detail="auto sizing needs a price: no LTP for this symbol")
+                unit_cost = float(px) * lot
+        q, unknown = _auto_size(ids, client_index, unit_cost, _safe_float(data.get("capital_pct"), 100.0))
+        margin_unknown.update(ids[i] for i in np.flatnonzero(unknown))
+        print(f"[router] auto sizing: {len(ids)} members unit_cost={unit_cost} total_lots={int(q.sum())}"
+              f" margin_unknown={int(unknown.sum())}")
+        return q
+
+    # ------------------- member columns + this order's quantity rules -------------------
+    members = members or _expand_members(data, client_index)
+    ids, tags, brokers = members["ids"], members["tags"], members["brokers"]
+    is_dhan, is_mo = members["is_dhan"], members["is_mo"]
+    skipped: List[Dict[str, Any]] = list(members["skipped"])
+    n = len(ids)
+
+    if qtySelection == "auto":
+        qty = _auto_qty(ids) if n else np.zeros(0, dtype=np.int64)
+    elif diffQty and groupacc:
+        qty = np.fromiter((int((perGroupQty.get(k) or perGroupQty.get(t) or 0) or 0)
+                           for k, t in zip(members["gkeys"], tags)), dtype=np.int64, count=n)
+    elif diffQty:
+        qty = np.fromiter((int(perClientQty.get(c, 0) or 0) for c in ids), dtype=np.int64, count=n)
+    elif multiplier_flag and groupacc:
+        qty = quantityinlot * members["mult"]
+    else:
+        qty = np.full(n, quantityinlot, dtype=np.int64)
+
+    # ------------------- DHAN: multiply qty by min_qty (one symbol -> one lot size) -------------------
+    if is_dhan.any():
+        qty = np.where(is_dhan, qty * lot, qty)
+        print(f"[router] DHAN lot-size applied: sid={sid} min_qty={lot} rows={int(is_dhan.sum())}")
+
+    # ------------------- freeze-limit slicing (lot-aligned) -------------------
+    # Dhan qty is in shares, Motilal qty in lots; the freeze limit is in shares.
+    freeze = _safe_int(data.get("freeze_qty"), 0) or _freeze_qty_for(sid)
+    cap = np.where(is_dhan, (freeze // lot) * lot, freeze // lot) if freeze > 0 else np.zeros(n, dtype=np.int64)
+    oversized = (cap > 0) & (qty > cap) & (is_dhan | is_mo)
+    if oversized.any():
+        print(f"[router] freeze slicing: freeze={freeze} lot={lot} rows={int(oversized.sum())}")
+
+    template = {
+        "action": action,
+        "ordertype": ordertype,
+        "producttype": producttype,
+        "orderduration": orderduration,
+        "exchange": exchange_val,
+        "price": price,
+        "triggerprice": triggerprice,
+        "disclosedquantity": disclosedqty,
+        "amoorder": amoorder,
+        "correlation_id": correlation_id,
+        "symbol": raw_symbol,
+        "security_id": sid,                      # Dhan
+        "symboltoken": str(symboltoken or ""),   # Motilal
+        "stock_symbol": stock_symbol,
+    }
+    for i in np.flatnonzero(~(is_dhan | is_mo)):
+        skipped.append({"_skip": True, "reason": "client_not_found", "client_id": ids[i]})
+    if margin_unknown:
+        unknown = np.fromiter((u in margin_unknown for u in ids), dtype=bool, count=n) & (is_dhan | is_mo)
+        for i in np.flatnonzero(unknown):
+            skipped.append({"_skip": True, "reason": "margin_unknown", "client_id": ids[i], "broker": brokers[i]})
+        is_dhan, is_mo = is_dhan & ~unknown, is_mo & ~unknown
+        oversized = oversized & ~unknown
+
+    # ------------------- pre-trade margin check (cached snapshot, no broker calls) -------------------
+    # Orders whose estimated margin exceeds the client's cached available margin are
+    # dropped here instead of being rejected by the broker. The full order value is
+    # only the margin for cash delivery buys; F&O and leveraged intraday orders are
+    # checked only when the caller passes margin_per_lot. Unknown price -> no check;
+    # unknown margin (not cached yet or the fetch failed) -> skipped as margin_unknown.
+    delivery_buy = (action == "BUY" and str(producttype).strip().upper() in ("CNC", "DELIVERY")
+                    and exchange_val in ("NSE", "BSE"))
+    if not defer_price and n and data.get("margin_check", True) and (delivery_buy or data.get("margin_per_lot")):
+        _ensure_sizing_cache()
+        per_lot = _safe_float(data.get("margin_per_lot"))
+        if per_lot <= 0:
+            px = price if price > 0 else None
+            if px is None:
                 try:
-                    v = fn(str(security_id_val))
-                    if v:
-                        return max(1, int(v))
+                    px = _cached_ltp(exchange_val, int(symboltoken or security_id))
                 except Exception:
-                    pass
-        return int(_get_min_qty_map().get(str(security_id_val), 1))
-
-    # ------------------- make one order row -------------------
-    def _build_order(client_id: str, qty: int, tag: Optional[str]) -> Dict[str, Any]:
-        ci = client_index.get(str(client_id))
-        if not ci:
-            return {"_skip": True, "reason": "client_not_found", "client_id": client_id}
-        return {
-            "client_id": str(client_id),
-            "name": ci["name"],
-            "broker": ci["broker"],
-            "action": action,
-            "ordertype": ordertype,
-            "producttype": producttype,
-            "orderduration": orderduration,
-            "exchange": exchange_val,
-            "price": price,
-            "triggerprice": triggerprice,
-            "disclosedquantity": disclosedqty,
-            "amoorder": amoorder,
-            "qty": int(qty),  # front-end qty
-            "tag": tag or "",
-            "correlation_id": correlation_id,
-            "symbol": raw_symbol,
-            "security_id": str(security_id or ""),   # Dhan
-            "symboltoken": str(symboltoken or ""),   # Motilal
-            "stock_symbol": stock_symbol,
-        }
-
-    # ------------------- expand to per-client orders -------------------
-    per_client_orders: List[Dict[str, Any]] = []
-
-    if groupacc:
-        def _member_ids(doc: Dict[str, Any]) -> List[str]:
-            out: List[str] = []
-            raw = (doc.get("members") or doc.get("clients") or [])
-            for m in raw:
-                if isinstance(m, dict):
-                    uid = (m.get("userid") or m.get("client_id") or m.get("id") or "").strip()
-                else:
-                    uid = str(m).strip()
-                if uid and uid not in out:
-                    out.append(uid)
-            return out
-
-        for gsel in groups:
-            gp = (globals().get("_find_group_path")(gsel)
-                  or os.path.join(GROUPS_DIR, f"{str(gsel).replace(' ', '_')}.json"))
-            if not gp or not os.path.exists(gp):
-                per_client_orders.append({"_skip": True, "reason": f"group_file_missing:{gsel}"})
-                continue
-
+                    px = None
+            per_lot = float(px) * lot if px else 0.0
+        if per_lot > 0:
+            with _sizing_lock:
+                mcache = _sizing["margin"]
+                margin = np.fromiter((mcache.get(u, np.nan) for u in ids), dtype=float, count=n)
+            need = np.where(is_dhan, qty // lot, qty) * per_lot
+            unknown = (is_dhan | is_mo) & np.isnan(margin)
+            short = (is_dhan | is_mo) & (need > margin)   # NaN margin compares False
+            for i in np.flatnonzero(unknown):
+                skipped.append({"_skip": True, "reason": "margin_unknown", "client_id": ids[i], "broker": brokers[i]})
+            for i in np.flatnonzero(short):
+                skipped.append({"_skip": True, "reason": "insufficient_margin", "client_id": ids[i],
+                                "broker": brokers[i], "required": round(float(need[i]), 2),
+                                "available": round(float(margin[i]), 2)})
+            short = short | unknown
+            if short.any():
+                is_dhan, is_mo = is_dhan & ~short, is_mo & ~short
+                oversized = oversized & ~short
+                print(f"[router] margin check: skipped {int(short.sum())}/{n} (per_lot={per_lot})")
+
+    # ------------------- risk limits (constant-time check per child) -------------------
+    holds: List[Optional[int]] = [None] * n
+    if not defer_price and n:
+        px_est = price
+        if px_est <= 0:
             try:
-                with open(gp, "r", encoding="utf-8") as f:
-                    gdoc = json.load(f) or {}
+                px_est = _cached_ltp(exchange_val, int(symboltoken or security_id)) or 0.0
             except Exception:
-                per_client_orders.append({"_skip": True, "reason": f"group_file_bad:{gsel}"})
+                px_est = 0.0
+        blocked = np.zeros(n, dtype=bool)
+        for i in np.flatnonzero(is_dhan | is_mo):
+            uid = ids[i]
+            lim = _risk_limits_for(uid, tags[i], client_index[uid]["json"])
+            if not lim:
                 continue
+            shares = int(qty[i]) if is_dhan[i] else int(qty[i]) * lot
+            # held until acked, so the next child / leg for this client counts it
+            reason, holds[i] = _risk.reserve(uid, sid, action, shares, px_est, lim)
+            if reason:
+                blocked[i] = True
+                skipped.append({"_skip": True, "reason": f"risk_limit:{reason}", "client_id": uid,
+                                "broker": brokers[i]})
+        if blocked.any():
+            is_dhan, is_mo = is_dhan & ~blocked, is_mo & ~blocked
+            oversized = oversized & ~blocked
+            print(f"[router] risk limits: blocked {int(blocked.sum())}/{n}")
+
+    return {
+        "cols": {"ids": ids, "tags": tags, "brokers": brokers, "qty": qty,
+                 "is_dhan": is_dhan, "is_mo": is_mo, "cap": cap, "oversized": oversized, "holds": holds},
+        "template": template,
+        "skipped": skipped,
+        "client_index": client_index,
+    }
 
-            gname = gdoc.get("name") or gdoc.get("id") or str(gsel)
-            gkey  = gdoc.get("id") or gname
-            members = _member_ids(gdoc)
-            group_multiplier = int(gdoc.get("multiplier", 1) or 1)
-
-            for client_id in members:
-                if qtySelection == "auto":
-                    q = _auto_qty_fallback(str(client_id), price)
-                elif diffQty:
-                    q = int((perGroupQty.get(gkey) or perGroupQty.get(gname) or 0) or 0)
-                elif multiplier_flag:
-                    q = quantityinlot * group_multiplier
-                else:
-                    q = quantityinlot
-                per_client_orders.append(_build_order(str(client_id), q, gname))
-    else:
-        for client_id in clients:
-            if qtySelection == "auto":
-                q = _auto_qty_fallback(str(client_id), price)
-            elif diffQty:
-                q = int(perClientQty.get(str(client_id), 0) or 0)
-            else:
-                q = quantityinlot
-            per_client_orders.append(_build_order(str(client_id), q, None))
 
-    # ------------------- bucket by broker -------------------
+def _plan_rows(plan: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Materialize a plan's columns into per-client order rows
+    {"dhan": [...], "motilal": [...]} (cached on the plan).
+    """
+    if "by_broker" in plan:
+        return plan["by_broker"]
+    cols, tmpl, idx = plan["cols"], plan["template"], plan["client_index"]
+    ids, tags, qty, cap, oversized = cols["ids"], cols["tags"], cols["qty"], cols["cap"], cols["oversized"]
+    holds = cols.get("holds") or [None] * len(ids)
     by_broker: Dict[str, List[Dict[str, Any]]] = {"dhan": [], "motilal": []}
-    skipped: List[Dict[str, Any]] = []
-    for od in per_client_orders:
-        if od.get("_skip"):
-            skipped.append(od)
-            continue
-        brk = od.get("broker")
-        if brk in by_broker:
-            by_broker[brk].append(od)
+    for brk, mask in (("dhan", cols["is_dhan"]), ("motilal", cols["is_mo"])):
+        rows = by_broker[brk]
+        for i in np.flatnonzero(mask):
+            uid = ids[i]
+            od = {"client_id": uid, "name": idx[uid]["name"], "broker": brk, **tmpl,
+                  "qty": int(qty[i]), "tag": tags[i] or ""}
+            if oversized[i]:
+                od["slices"] = _freeze_slices(int(qty[i]), 1, int(cap[i]))
+            if holds[i] is not None:
+                od["risk_hold"] = holds[i]
+            rows.append(od)
+    plan["by_broker"] = by_broker
+    return by_broker
 
-    # ------------------- DHAN: multiply qty by min_qty -------------------
-    if by_broker.get("dhan"):
-        for od in by_broker["dhan"]:
-            try:
-                sid = od.get("security_id") or ""
-                minq = _min_qty_for(sid) if sid else 1
-                old_q = int(od.get("qty", 0))
-                new_q = old_q * max(1, int(minq))
-                od["qty"] = new_q
-                print(f"[router] DHAN lot-size applied: sid={sid} min_qty={minq} qty:{old_q} -> {new_q}")
-            except Exception:
-                od["qty"] = int(od.get("qty", 0))
+
+@app.post("/place_orders")
+def route_place_orders(payload: Dict[str, Any] = Body(...)):
+    """
+    One symbol for a set of clients/groups, or a multi-leg basket when the
+    payload carries "legs" (see _place_legs).
+    """
+    if payload and payload.get("legs"):
+        if str(payload.get("mode") or "").lower() == "spread":
+            return _place_spread(payload)
+        return _place_legs(payload)
+
+    plan = _plan_place_orders(payload)
+    by_broker, skipped, client_index = _plan_rows(plan), plan["skipped"], plan["client_index"]
 
     # ------------------- print & dispatch -------------------
     try:
         if by_broker.get("dhan"):
             print(f"[router] DHAN orders ({len(by_broker['dhan'])}) ->")
-            print(json.dumps(by_broker["dhan"], indent=2))
+            if ROUTER_DEBUG:
+                print(json.dumps(by_broker["dhan"], indent=2))
         if by_broker.get("motilal"):
             print(f"[router] MOTILAL orders ({len(by_broker['motilal'])}) ->")
-            print(json.dumps(by_broker["motilal"], indent=2))
+            if ROUTER_DEBUG:
+                print(json.dumps(by_broker["motilal"], indent=2))
     except Exception:
         pass
 
     results: Dict[str, Any] = {"skipped": skipped}
+    batch = _new_dispatch_batch(payload)
+    confirm_sec = _confirm_deadline(payload)
+    confirm_children: List[Dict[str, Any]] = []
+    pending_merge: List[tuple] = []
     for brk in ("dhan", "motilal"):
         lst = by_broker.get(brk, [])
         if not lst:
@@ -1737,24 +2997,742 @@ def route_place_orders(payload: Dict[str, Any] = Body(...)):
         try:
             print(f"[router] dispatching {len(lst)} orders to {brk}...")
             modname = "Broker_dhan" if brk == "dhan" else "Broker_motilal"
+            # no reload: the adapters keep live state (order store, feeds, sessions)
             mod = importlib.import_module(modname)
-            try:
-                mod = importlib.reload(mod)
-            except Exception:
-                pass
             fn = getattr(mod, "place_orders", None)
-            res = fn(lst) if callable(fn) else {"status": "error", "message": "place_orders not implemented"}
+            sent = _with_dispatch(payload, _expand_slices(brk, lst))
+            res = fn(sent) if callable(fn) else {"status": "error", "message": "place_orders not implemented"}
         except Exception as e:
+            sent = lst
             res = {"status": "error", "message": str(e)}
         results[brk] = res
+        _index_placed(brk, sent, res, client_index)
+        _audit_dispatch(batch, brk, sent, res)
+        if confirm_sec is not None:
+            confirm_children += _confirm_children(brk, sent, res, client_index)
+        pending_merge.append((brk, sent, res))
+    _release_risk_holds([plan])
+
+    # children are confirmed individually; slices fold under their parent afterwards
+    if confirm_sec is not None:
+        results["confirm"] = _await_confirm(confirm_children, confirm_sec)
+    for brk, sent, res in pending_merge:
+        _merge_slices(brk, sent, res)
+
+    return {"status": "completed", "result": results, "dispatch_batch": batch}
+
+# ---------- multi-leg baskets: legs x clients in one dispatch ----------
+# {..common fields.., "legs": [{symbol, action, quantityinlot, ordertype, price, ...}, ...]}
+# Each leg is the common payload with its own fields on top. Client/group
+# expansion comes from the compiled group cache, so it is resolved once for all
+# legs; every leg x client row of a broker goes to that broker's place_orders()
+# in one parallel batch and both brokers run at the same time.
+def _leg_payloads(payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+    legs = payload.get("legs")
+    if not isinstance(legs, list) or not all(isinstance(l, dict) for l in legs):
+        raise HTTPException(status_code=400, detail="'legs' must be a list of order objects")
+    common = {k: v for k, v in payload.items() if k not in ("legs", "mode")}
+    return [{**common, **leg} for leg in legs]
+
+def _leg_rows(leg: int, broker: str, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Freeze-expand one leg's rows and prefix their response keys with the leg number."""
+    out: List[Dict[str, Any]] = []
+    for od in _expand_slices(broker, rows):
+        r = {**od, "leg": leg, "slice_key": f"leg{leg}/{_response_key(broker, od)}"}
+        if od.get("slice_of"):
+            r["slice_of"] = f"leg{leg}/{od['slice_of']}"
+        out.append(r)
+    return out
 
-    return {"status": "completed", "result": results}
+def _plan_legs(payload: Dict[str, Any], defer_price: bool = False) -> List[Dict[str, Any]]:
+    # clients / groups normally come from the common payload: expand them once
+    # and let every leg apply its own quantity rules to the same member columns
+    client_index = _cached_client_index()
+    expanded: Dict[tuple, Dict[str, Any]] = {}
+    plans = []
+    for i, lp in enumerate(_leg_payloads(payload)):
+        sel = (bool(lp.get("groupacc", False)), tuple(str(g) for g in lp.get("groups") or []),
+               tuple(str(c) for c in lp.get("clients") or []))
+        if sel not in expanded:
+            expanded[sel] = _expand_members(lp, client_index)
+        try:
+            plans.append(_plan_place_orders(lp, defer_price=defer_price, members=expanded[sel]))
+        except HTTPException as e:
+            raise HTTPException(status_code=e.status_code, detail=f"leg {i}: {e.detail}")
+    return plans
+
+def _place_legs(payload: Dict[str, Any]) -> Dict[str, Any]:
+    leg_payloads = _leg_payloads(payload)
+    plans = _plan_legs(payload)
+    sent: Dict[str, List[Dict[str, Any]]] = {"dhan": [], "motilal": []}
+    for i, plan in enumerate(plans):
+        rows = _plan_rows(plan)
+        for brk in sent:
+            sent[brk].extend(_leg_rows(i, brk, rows[brk]))
+    client_index = plans[0]["client_index"] if plans else {}
+    sent = {brk: _with_dispatch(payload, rows) for brk, rows in sent.items()}
+    batch = _new_dispatch_batch(payload)
+    print(f"[router] legs={len(plans)} dispatch dhan={len(sent['dhan'])} motilal={len(sent['motilal'])}")
+
+    def _dispatch(brk: str):
+        try:
+            mod = importlib.import_module("Broker_dhan" if brk == "dhan" else "Broker_motilal")
+            return brk, mod.place_orders(sent[brk])
+        except Exception as e:
+            return brk, {"status": "error", "message": str(e)}
+
+    t0 = time.time()
+    active = [b for b in ("dhan", "motilal") if sent[b]]
+    with ThreadPoolExecutor(max_workers=max(1, len(active))) as ex:
+        results = dict(ex.map(_dispatch, active))
+    wall_ms = round((time.time() - t0) * 1000.0, 3)
+
+    confirm_sec = _confirm_deadline(payload)
+    children: List[Dict[str, Any]] = []
+    for brk, res in results.items():
+        _audit_dispatch(batch, brk, sent[brk], res)
+        if confirm_sec is not None:
+            children += _confirm_children(brk, sent[brk], res, client_index)
+    confirm = _await_confirm(children, confirm_sec) if confirm_sec is not None else None
+    legs_out, acks = _group_by_leg(leg_payloads, plans, sent, results, client_index, t0)
+    _release_risk_holds(plans)
+    out = {"status": "completed", "legs": legs_out, "dispatch_batch": batch,
+           "timing": {"wall_ms": wall_ms, "acks": timing_summary(acks)}}
+    if confirm is not None:
+        out["confirm"] = confirm
+    return out
+
+def _group_by_leg(leg_payloads: List[Dict[str, Any]], plans: List[Dict[str, Any]],
+                  sent: Dict[str, List[Dict[str, Any]]], results: Dict[str, Any],
+                  client_index: Dict[str, Dict[str, Any]], t0: float):
+    """Index + merge slices per broker, then split responses back into legs. Returns (legs, ack offsets)."""
+    legs_out = [{"leg": i, "symbol": lp.get("symbol"), "action": (lp.get("action") or "").upper(),
+                 "skipped": plans[i]["skipped"], "dhan": {}, "motilal": {}}
+                for i, lp in enumerate(leg_payloads)]
+    acks: List[float] = []
+    for brk, res in results.items():
+        _index_placed(brk, sent[brk], res, client_index)
+        _merge_slices(brk, sent[brk], res)
+        responses = (res or {}).get("order_responses") if isinstance(res, dict) else None
+        if not isinstance(responses, dict):
+            for leg in legs_out:
+                leg[brk] = {"status": "error", "message": (res or {}).get("message") if isinstance(res, dict) else str(res)}
+            continue
+        for key, resp in responses.items():
+            head, _, rest = str(key).partition("/")
+            if head.startswith("leg") and head[3:].isdigit() and int(head[3:]) < len(legs_out):
+                legs_out[int(head[3:])][brk][rest] = resp
+            parts = [x.get("response") for x in resp.get("slices", [])] if isinstance(resp, dict) else []
+            for r in (parts or [resp]):
+                if isinstance(r, dict) and r.get("_ack_at"):
+                    acks.append(r["_ack_at"] - t0)
+    return legs_out, acks
+
+# ---------- spread mode: per-client leg ordering (hedge first) ----------
+# mode="spread": legs are sent in order for each client (hedge first, then the
+# main leg as soon as the hedge is acked) while all clients run in parallel.
+# Orders are precompiled with the adapters' prepare_order() so the gap between
+# a client's legs is just the hedge round trip plus one send.
+SPREAD_WORKERS = int(os.getenv("SPREAD_WORKERS", "64"))
+
+def _spread_leg_order(leg_payloads: List[Dict[str, Any]]) -> List[int]:
+    """role=hedge legs first (role=main last); without roles, BUY legs before SELL legs."""
+    roles = [str(lp.get("role") or "").lower() for lp in leg_payloads]
+    if any(roles):
+        rank = [0 if r == "hedge" else (2 if r == "main" else 1) for r in roles]
+    else:
+        rank = [0 if (lp.get("action") or "").upper() == "BUY" else 1 for lp in leg_payloads]
+    return sorted(range(len(leg_payloads)), key=lambda i: (rank[i], i))
+
+def _place_spread(payload: Dict[str, Any]) -> Dict[str, Any]:
+    leg_payloads = _leg_payloads(payload)
+    plans = _plan_legs(payload)
+    client_index = plans[0]["client_index"] if plans else {}
+    order = _spread_leg_order(leg_payloads)
+    stop_on_fail = bool(payload.get("stop_on_fail", True))
+    mods = {"dhan": importlib.import_module("Broker_dhan"), "motilal": importlib.import_module("Broker_motilal")}
+
+    # per-client chains in leg order; freeze slices of a leg stay together
+    chains: Dict[str, List[tuple]] = {}
+    for pos, i in enumerate(order):
+        rows = _plan_rows(plans[i])
+        for brk in ("dhan", "motilal"):
+            for r in _leg_rows(i, brk, rows[brk]):
+                chains.setdefault(r["client_id"], []).append((pos, brk, r))
+
+    # planning may drop a client from one leg (margin, risk, lot size); sending the
+    # rest of its chain would leave the main leg unhedged, so the client is skipped
+    extra_skips: Dict[int, List[Dict[str, Any]]] = {}
+    for uid in list(chains):
+        have = {it[0] for it in chains[uid]}
+        if len(have) == len(order):
+            continue
+        missing = [order[p] for p in range(len(order)) if p not in have]
+        for pos, brk, r in chains.pop(uid):
+            extra_skips.setdefault(order[pos], []).append(
+                {"_skip": True, "reason": "spread_incomplete", "client_id": uid, "broker": brk, "missing_legs": missing})
+    if extra_skips:
+        print(f"[router] spread: skipped {len({s['client_id'] for v in extra_skips.values() for s in v})} "
+              f"client(s) missing a leg")
+    sent: Dict[str, List[Dict[str, Any]]] = {"dhan": [], "motilal": []}
+    for chain in chains.values():
+        for pos, brk, r in chain:
+            sent[brk].append(r)
+
+    def _prep(item):
+        pos, brk, r = item
+        cj = (client_index.get(str(r["client_id"])) or {}).get("json")
+        return (pos, brk, r, mods[brk].prepare_order(r, cj))
+
+    flat = [it for ch in chains.values() for it in ch]
+    with ThreadPoolExecutor(max_workers=max(1, min(SPREAD_WORKERS, len(flat) or 1))) as ex:
+        prepared = list(ex.map(_prep, flat))
+    by_client: Dict[str, List[tuple]] = {}
+    for it in prepared:
+        by_client.setdefault(it[2]["client_id"], []).append(it)
+
+    def _send(item):
+        pos, brk, r, prep = item
+        if prep.get("error"):
+            return prep["error"]
+        try:
+            return mods[brk].send_prepared(prep, r.get("price"), r.get("triggerprice"))
+        except Exception as e:
+            return {"status": "ERROR", "message": str(e)}
+
+    def _run(chain: List[tuple]):
+        # one step per leg; a leg's freeze slices go out together
+        steps: Dict[int, List[tuple]] = {}
+        for it in chain:
+            steps.setdefault(it[0], []).append(it)
+        out, first_sent, failed = [], {}, False
+        for pos in sorted(steps):
+            items = steps[pos]
+            if failed:
+                out.extend((it[1], it[2], {"status": "SKIPPED", "message": "earlier leg failed"}) for it in items)
+                continue
+            resps = parallel_map(_send, items, len(items))
+            sent_at = [r["_sent_at"] for r in resps if isinstance(r, dict) and r.get("_sent_at")]
+            if sent_at:
+                first_sent[pos] = min(sent_at)
+            if stop_on_fail and not all(_response_order_id(it[1], r) for it, r in zip(items, resps)):
+                failed = True
+            out.extend((it[1], it[2], r) for it, r in zip(items, resps))
+        ks = sorted(first_sent)
+        gaps = [first_sent[b] - first_sent[a] for a, b in zip(ks, ks[1:])]
+        return out, gaps
+
+    t0 = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, min(SPREAD_WORKERS, len(by_client) or 1))) as ex:
+        runs = list(ex.map(_run, by_client.values()))
+    wall_ms = round((time.time() - t0) * 1000.0, 3)
+
+    results: Dict[str, Any] = {b: {"status": "completed", "order_responses": {}} for b in ("dhan", "motilal") if sent[b]}
+    gaps: List[float] = []
+    for out, g in runs:
+        gaps.extend(g)
+        for brk, r, resp in out:
+            results[brk]["order_responses"][r["slice_key"]] = resp
+    legs_out, acks = _group_by_leg(leg_payloads, plans, sent, results, client_index, t0)
+    _release_risk_holds(plans)
+    for i, extra in extra_skips.items():
+        # one entry per client and leg, even when the leg was freeze-sliced
+        seen = set()
+        legs_out[i]["skipped"] = list(legs_out[i]["skipped"]) + [
+            x for x in extra if (x["client_id"], x["broker"]) not in seen and not seen.add((x["client_id"], x["broker"]))]
+    gap = timing_summary(gaps)
+    print(f"[router] spread legs={order} clients={len(by_client)} wall_ms={wall_ms} inter_leg_gap={gap}")
+    return {"status": "completed", "mode": "spread", "leg_order": order, "legs": legs_out,
+            "timing": {"wall_ms": wall_ms, "clients": len(by_client),
+                       "acks": timing_summary(acks), "inter_leg_gap": gap}}
 
 # Backward-compatibility for UIs posting to /place_order
 @app.post("/place_order")
 def route_place_order_compat(payload: Dict[str, Any] = Body(...)):
     return route_place_orders(payload)
 
+
+# ---------- armed baskets: precompiled per-client payloads ----------
+# A basket is a /place_orders payload planned ahead of time: clients, groups,
+# quantities and lot sizes are resolved, and each adapter's prepare_order()
+# builds the broker payload with its token/session. /fire_basket only stamps
+# the price and sends, so click-to-wire is one network round trip.
+BASKET_WORKERS = int(os.getenv("BASKET_WORKERS", "64"))
+_baskets: Dict[str, Dict[str, Any]] = {}
+_baskets_lock = threading.Lock()
+
+def _arm_basket(basket_id: str, spec: Dict[str, Any]) -> Dict[str, Any]:
+    plan = _plan_place_orders(spec, defer_price=True)
+    jobs = [(brk, od) for brk in ("dhan", "motilal") for od in _expand_slices(brk, _plan_rows(plan)[brk])]
+
+    def _prep(job):
+        brk, od = job
+        mod = importlib.import_module("Broker_dhan" if brk == "dhan" else "Broker_motilal")
+        cj  = (plan["client_index"].get(str(od.get("client_id"))) or {}).get("json")
+        return brk, {"row": od, "prep": mod.prepare_order(od, cj)}
+
+    prepared: Dict[str, List[Dict[str, Any]]] = {"dhan": [], "motilal": []}
+    if jobs:
+        # Motilal prepare may log in; do all clients at once
+        with ThreadPoolExecutor(max_workers=max(1, min(BASKET_WORKERS, len(jobs)))) as ex:
+            for brk, item in ex.map(_prep, jobs):
+                prepared[brk].append(item)
+
+    return {
+        "id": basket_id,
+        "name": spec.get("name") or basket_id,
+        "spec": spec,
+        "prepared": prepared,
+        "skipped": plan["skipped"],
+        "client_index": plan["client_index"],
+        "client_ids": sorted({str(i["row"].get("client_id")) for v in prepared.values() for i in v}),
+        "armed_at": time.time(),
+    }
+
+def _basket_view(b: Dict[str, Any]) -> Dict[str, Any]:
+    """Public shape of an armed basket (no tokens / sessions)."""
+    errors = [{"key": i["prep"]["key"], **i["prep"]["error"]}
+              for v in b["prepared"].values() for i in v if i["prep"].get("error")]
+    spec = b["spec"]
+    return {
+        "id": b["id"],
+        "name": b["name"],
+        "symbol": spec.get("symbol"),
+        "action": spec.get("action"),
+        "ordertype": spec.get("ordertype"),
+        "armed": {brk: len(v) for brk, v in b["prepared"].items()},
+        "clients": b["client_ids"],
+        "skipped": b["skipped"],
+        "errors": errors,
+        "armed_at": b["armed_at"],
+    }
+
+def _rearm_baskets_for(userid: str) -> None:
+    """Recompile baskets that include `userid` (after a login / token change)."""
+    with _baskets_lock:
+        hit = [(bid, b["spec"]) for bid, b in _baskets.items() if userid in b["client_ids"]]
+    for bid, spec in hit:
+        try:
+            nb = _arm_basket(bid, spec)
+            with _baskets_lock:
+                if bid in _baskets:
+                    _baskets[bid] = nb
+        except Exception as e:
+            print(f"[router] re-arm basket {bid} failed: {e}")
+
+def _basket_risk_filter(b: Dict[str, Any], jobs: List[tuple], price: float) -> tuple:
+    """
+    Pre-trade risk limits for an armed basket, run at fire time with the
+    stamped price (arming skips them, the price is not known yet). A client's
+    slices are checked and reserved together; blocked clients drop out of `jobs`.
+    Returns (jobs, skipped, {(broker, uid): hold id}).
+    """
+    per_client: Dict[tuple, Dict[str, Any]] = {}
+    for brk, item in jobs:
+        od = item["row"]
+        uid = str(od.get("client_id") or "")
+        sid = str(od.get("security_id") or "")
+        ent = per_client.setdefault((brk, uid), {"od": od, "shares": 0})
+        ent["shares"] += int(od.get("qty") or 0) * (1 if brk == "dhan" else _min_qty_for(sid))
+    if not per_client:
+        return jobs, [], {}
+
+    px = price
+    if px <= 0:
+        od = next(iter(per_client.values()))["od"]
+        try:
+            px = _cached_ltp(od.get("exchange") or "", int(od.get("symboltoken") or od.get("security_id"))) or 0.0
+        except Exception:
+            px = 0.0
+
+    blocked: set = set()
+    skipped: List[Dict[str, Any]] = []
+    holds: Dict[tuple, int] = {}
+    for (brk, uid), ent in per_client.items():
+        od = ent["od"]
+        cj = (b["client_index"].get(uid) or {}).get("json")
+        lim = _risk_limits_for(uid, od.get("tag") or "", cj)
+        if not lim:
+            continue
+        reason, hold = _risk.reserve(uid, str(od.get("security_id") or ""), od.get("action") or "",
+                                     ent["shares"], px, lim)
+        if hold is not None:
+            holds[(brk, uid)] = hold
+        if reason:
+            blocked.add((brk, uid))
+            skipped.append({"_skip": True, "reason": f"risk_limit:{reason}", "client_id": uid, "broker": brk})
+    if blocked:
+        print(f"[router] basket {b['id']} risk limits: blocked {len(blocked)}/{len(per_client)}")
+        jobs = [(brk, item) for brk, item in jobs
+                if (brk, str(item["row"].get("client_id") or "")) not in blocked]
+    return jobs, skipped, holds
+
+def _fire_basket(b: Dict[str, Any], price: float, trig: float, t_click: float) -> Dict[str, Any]:
+    """
+    Send every prepared order of an armed basket concurrently (price/trigger
+    stamped) and index the placed ids. `t_click` is the wall-clock instant
+    the fire was requested for. Returns {"result", "timing", "children"}
+    where children carry each order's send offset from t_click and ack latency.
+    """
+    t0 = time.perf_counter()
+    mods = {brk: importlib.import_module("Broker_dhan" if brk == "dhan" else "Broker_motilal")
+            for brk, v in b["prepared"].items() if v}
+    jobs = [(brk, item) for brk, v in b["prepared"].items() for item in v]
+    jobs, blocked, holds = _basket_risk_filter(b, jobs, price)
+
+    def _fire(job):
+        brk, item = job
+        return brk, item, mods[brk].send_prepared(item["prep"], price, trig)
+
+    results: Dict[str, Any] = {"skipped": b["skipped"] + blocked}
+    acks: List[Dict[str, Any]] = []
+    children: List[Dict[str, Any]] = []
+    sent_rows: Dict[str, List[Dict[str, Any]]] = {"dhan": [], "motilal": []}
+    if jobs:
+        with ThreadPoolExecutor(max_workers=max(1, min(BASKET_WORKERS, len(jobs)))) as ex:
+            for brk, item, resp in ex.map(_fire, jobs):
+                res = results.setdefault(brk, {"status": "completed", "order_responses": {}})
+                res["order_responses"][item["prep"]["key"]] = resp
+                sent_rows[brk].append({**item["row"], "price": price, "triggerprice": trig,
+                                       "risk_hold": holds.get((brk, str(item["row"].get("client_id") or "")))})
+                child = {"broker": brk, "key": item["prep"]["key"]}
+                if isinstance(resp, dict) and resp.get("_sent_at"):
+                    acks.append(resp)
+                    child["send_offset_ms"] = round((resp["_sent_at"] - t_click) * 1000.0, 3)
+                    child["ack_ms"] = round((resp["_ack_at"] - resp["_sent_at"]) * 1000.0, 3)
+                children.append(child)
+
+    for brk, rows in sent_rows.items():
+        if rows:
+            _index_placed(brk, rows, results[brk], b["client_index"])
+            _merge_slices(brk, rows, results[brk])
+    _risk.release(holds.values())
+
+    timing: Dict[str, Any] = {"count": len(acks), "wall_ms": round((time.perf_counter() - t0) * 1000.0, 3)}
+    if acks:
+        timing["click_to_first_send_ms"] = round((min(r["_sent_at"] for r in acks) - t_click) * 1000.0, 3)
+        timing.update(timing_summary(r["_ack_at"] - r["_sent_at"] for r in acks))
+        timing["first_to_last_ack_ms"] = round((max(r["_ack_at"] for r in acks)
+                                                - min(r["_ack_at"] for r in acks)) * 1000.0, 3)
+    return {"result": results, "timing": timing, "children": children}
+
+def _basket_prices(spec: Dict[str, Any], override: Dict[str, Any]) -> tuple:
+    """(price, trigger) for a fire: override values, else the armed spec; validated like /place_orders."""
+    ordertype = str(spec.get("ordertype") or "").upper()
+    price = float(override.get("price") if override.get("price") not in (None, "") else (spec.get("price") or 0))
+    trig  = float(override.get("triggerprice") if override.get("triggerprice") not in (None, "")
+                  else (spec.get("triggerprice") or 0))
+    if ordertype == "LIMIT" and price <= 0:
+        raise HTTPException(status_code=400, detail="Price must be > 0 for LIMIT orders.")
+    if "SL" in ordertype and trig <= 0:
+        raise HTTPException(status_code=400, detail="Trigger price is required for SL/SL-M orders.")
+    return price, trig
+
+@app.post("/arm_basket")
+def route_arm_basket(payload: Dict[str, Any] = Body(...)):
+    """
+    Arm a basket from a /place_orders-shaped payload (symbol, action, ordertype,
+    producttype, groupacc/groups or clients, quantity rules...) plus optional
+    id/name. Price and trigger may be left out; they are given at fire time.
+    Re-arming an existing id replaces it.
+    """
+    spec = dict(payload or {})
+    bid  = _safe(str(spec.get("id") or spec.get("name") or f"basket_{int(time.time() * 1000)}"))
+    b = _arm_basket(bid, spec)
+    with _baskets_lock:
+        _baskets[bid] = b
+    view = _basket_view(b)
+    print(f"[router] armed basket {bid}: {view['armed']} errors={len(view['errors'])} skipped={len(view['skipped'])}")
+    return {"success": True, "basket": view}
+
+@app.get("/baskets")
+def route_list_baskets():
+    with _baskets_lock:
+        return {"baskets": [_basket_view(b) for b in _baskets.values()]}
+
+@app.post("/disarm_basket")
+def route_disarm_basket(payload: Dict[str, Any] = Body(...)):
+    bid = _safe(str((payload or {}).get("id") or (payload or {}).get("name") or ""))
+    with _baskets_lock:
+        gone = _baskets.pop(bid, None)
+    if not gone:
+        raise HTTPException(status_code=404, detail=f"basket not found: {bid}")
+    return {"success": True, "id": bid}
+
+@app.post("/fire_basket")
+def route_fire_basket(payload: Dict[str, Any] = Body(...)):
+    """
+    { id, price?, triggerprice?, disarm?: bool }
+    Stamps price/trigger (falling back to the armed spec) onto every prepared
+    order and sends them all concurrently across both brokers. Same result shape
+    as /place_orders plus timing: click_to_first_send_ms, ack latency
+    percentiles, first_to_last_ack_ms and wall_ms.
+    """
+    t_click = time.time()
+    payload = payload or {}
+    bid = _safe(str(payload.get("id") or payload.get("name") or ""))
+    with _baskets_lock:
+        b = _baskets.get(bid)
+    if not b:
+        raise HTTPException(status_code=404, detail=f"basket not found: {bid}")
+    price, trig = _basket_prices(b["spec"], payload)
+    if payload.get("disarm"):
+        with _baskets_lock:
+            _baskets.pop(bid, None)
+
+    out = _fire_basket(b, price, trig, t_click)
+    print(f"[router] fired basket {bid}: {len(out['children'])} orders price={price} trig={trig} timing={out['timing']}")
+    return {"status": "completed", "result": out["result"], "timing": out["timing"]}
+
+
+# ---------- scheduled firing at a wall-clock instant ----------
+# A schedule waits until `at - prewarm_sec`, then arms a private basket (clients,
+# payloads, sessions resolved), opens keep-alive connections and estimates the
+# broker clock offset from HTTP Date headers. It sleeps to ~20ms before the
+# (offset-corrected) instant, spins the rest, and fires; every child's send
+# time is reported relative to the target.
+from datetime import datetime as _dt, timedelta as _td, timezone as _tz
+
+IST = _tz(_td(hours=5, minutes=30))
+SCHED_PREWARM_SEC    = float(os.getenv("SCHED_PREWARM_SEC", "20"))
+SCHED_SPIN_SEC       = float(os.getenv("SCHED_SPIN_SEC", "0.02"))
+SCHED_MAX_CLOCK_UNC_MS = float(os.getenv("SCHED_MAX_CLOCK_UNC_MS", "250"))   # only trust a tight offset
+_schedules: Dict[str, Dict[str, Any]] = {}
+_schedules_lock = threading.Lock()
+
+def _parse_at(at: Any) -> float:
+    """Epoch seconds from epoch number, ISO-8601 datetime, or 'HH:MM:SS[.fff]' (today, IST)."""
+    if isinstance(at, (int, float)):
+        return float(at)
+    txt = str(at or "").strip()
+    if not txt:
+        raise ValueError("'at' is required")
+    try:
+        return float(txt)
+    except ValueError:
+        pass
+    if "T" in txt or "-" in txt:
+        d = _dt.fromisoformat(txt)
+        return (d if d.tzinfo else d.replace(tzinfo=IST)).timestamp()
+    fmt = "%H:%M:%S.%f" if "." in txt else "%H:%M:%S"
+    t = _dt.strptime(txt, fmt)
+    today = _dt.now(IST)
+    return today.replace(hour=t.hour, minute=t.minute, second=t.second,
+                         microsecond=t.microsecond).timestamp()
+
+def _sched_view(rec: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in rec.items() if k not in ("cancel", "spec", "basket")}
+
+def _run_schedule(sid: str) -> None:
+    with _schedules_lock:
+        rec = _schedules.get(sid)
+    if not rec:
+        return
+    stop: threading.Event = rec["cancel"]
+    target = rec["target_ts"]
+    try:
+        # 1) idle until the pre-warm window
+        if stop.wait(max(0.0, target - rec["prewarm_sec"] - time.time())):
+            return
+
+        # 2) resolve clients / payloads / sessions
+        rec["status"] = "arming"
+        b = _arm_basket(f"sched_{sid}", rec["spec"])
+        rec["basket"] = b
+        rec["armed"] = {brk: len(v) for brk, v in b["prepared"].items()}
+
+        # 3) warm sockets and measure the broker clock
+        fire_at = target
+        if b["prepared"]["dhan"]:
+            dh = importlib.import_module("Broker_dhan")
+            rec["prewarmed"] = dh.prewarm(len(b["prepared"]["dhan"]))
+            clock = dh.broker_clock_offset()
+            rec["clock"] = clock
+            unc = clock.get("uncertainty_ms")
+            if rec["use_broker_clock"] and unc is not None and unc <= SCHED_MAX_CLOCK_UNC_MS:
+                # broker ahead of us (offset > 0) -> fire earlier on our clock
+                fire_at = target - clock["offset_ms"] / 1000.0
+        rec["fire_at_local"] = fire_at
+        rec["status"] = "armed"
+
+        # 4) keep the pooled sockets hot, then sleep / spin to the instant
+        if stop.wait(max(0.0, fire_at - 1.0 - time.time())):
+            return
+        if b["prepared"]["dhan"]:
+            importlib.import_module("Broker_dhan").prewarm(len(b["prepared"]["dhan"]))
+        if stop.wait(max(0.0, fire_at - SCHED_SPIN_SEC - time.time())):
+            return
+        while time.time() < fire_at:
+            pass
+
+        # 5) fire
+        rec["status"] = "firing"
+        out = _fire_basket(b, rec["price"], rec["triggerprice"], fire_at)
+        offs = [c["send_offset_ms"] for c in out["children"] if "send_offset_ms" in c]
+        rec["result"]   = out["result"]
+        rec["timing"]   = out["timing"]
+        rec["children"] = out["children"]
+        if offs:
+            rec["jitter"] = {**timing_summary([o / 1000.0 for o in offs]),
+                             "first_send_after_target_ms": min(offs),
+                             "last_send_after_target_ms": max(offs)}
+        rec["status"] = "fired"
+        print(f"[sched] {sid} fired {len(out['children'])} orders; jitter={rec.get('jitter')}")
+    except Exception as e:
+        rec["status"] = "failed"
+        rec["error"] = str(e)
+        print(f"[sched] {sid} failed: {e}")
+    finally:
+        if stop.is_set() and rec["status"] not in ("fired", "failed"):
+            rec["status"] = "cancelled"
+
+@app.post("/schedule_order")
+def route_schedule_order(payload: Dict[str, Any] = Body(...)):
+    """
+    { at: "09:15:00" | ISO-8601 | epoch, order: {/place_orders payload},
+      price?, triggerprice?, prewarm_sec?, use_broker_clock?: bool (default true), id? }
+    Fires the order at `at` (plain times are IST, today).
+    """
+    payload = payload or {}
+    spec = payload.get("order") or payload.get("payload")
+    if not isinstance(spec, dict):
+        raise HTTPException(status_code=400, detail="'order' must be a /place_orders payload")
+    try:
+        target = _parse_at(payload.get("at"))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"invalid 'at': {e}")
+    if target <= time.time():
+        raise HTTPException(status_code=400, detail="'at' is in the past")
+    price, trig = _basket_prices(spec, payload)
+    # fail fast on a bad spec (unknown group, bad qty) instead of at the instant
+    _plan_place_orders(spec, defer_price=True)
+
+    sid = _safe(str(payload.get("id") or f"sched_{int(target * 1000)}"))
+    rec = {
+        "id": sid,
+        "at": payload.get("at"),
+        "target_ts": target,
+        "target_iso": _dt.fromtimestamp(target, IST).isoformat(timespec="milliseconds"),
+        "price": price,
+        "triggerprice": trig,
+        "prewarm_sec": float(payload.get("prewarm_sec") or SCHED_PREWARM_SEC),
+        "use_broker_clock": bool(payload.get("use_broker_clock", True)),
+        "status": "waiting",
+        "spec": spec,
+        "cancel": threading.Event(),
+    }
+    with _schedules_lock:
+        old = _schedules.get(sid)
+        if old and old["status"] in ("waiting", "arming", "armed"):
+            raise HTTPException(status_code=409, detail=f"schedule already pending: {sid}")
+        _schedules[sid] = rec
+    threading.Thread(target=_run_schedule, args=(sid,), daemon=True, name=f"sched-{sid}").start()
+    print(f"[sched] {sid} scheduled for {rec['target_iso']}")
+    return {"success": True, "schedule": _sched_view(rec)}
+
+@app.get("/scheduled_orders")
+def route_scheduled_orders():
+    with _schedules_lock:
+        return {"schedules": [_sched_view(r) for r in _schedules.values()]}
+
+@app.post("/cancel_scheduled")
+def route_cancel_scheduled(payload: Dict[str, Any] = Body(...)):
+    sid = _safe(str((payload or {}).get("id") or ""))
+    with _schedules_lock:
+        rec = _schedules.get(sid)
+    if not rec:
+        raise HTTPException(status_code=404, detail=f"schedule not found: {sid}")
+    if rec["status"] not in ("waiting", "arming", "armed"):
+        return {"success": False, "message": f"schedule is {rec['status']}"}
+    rec["cancel"].set()
+    rec["status"] = "cancelled"
+    return {"success": True, "id": sid}
+
+
+# ---------- local price triggers (LTP crosses level -> group order) ----------
+# Rules live in Trigger_engine's per-scrip sorted books; Motilal's broadcast
+# LTP feed drives them. A fired rule goes through the normal /place_orders
+# dispatch with the stored payload.
+def _fire_trigger(rule: Dict[str, Any]) -> Dict[str, Any]:
+    print(f"[trigger] {rule['id']} fired: {rule['exchange']}:{rule['scrip']} "
+          f"{rule['direction']} {rule['level']} ltp={rule.get('fired_ltp')}")
+    return route_place_orders(rule["order"])
+
+_triggers = TriggerEngine(_fire_trigger, max_workers=int(os.getenv("TRIGGER_WORKERS", "8")))
+
+def _trigger_view(r: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in r.items() if not k.startswith("_")}
+
+@app.post("/add_trigger")
+def route_add_trigger(payload: Dict[str, Any] = Body(...)):
+    """
+    { order: {/place_orders payload}, level: number, direction?: "above"|"below",
+      exchange?, scripcode?, id? }
+    Exchange and scrip default to the order symbol's exchange and token
+    ("NSE|PNB EQ|<security id>[|<mo token>]"). Without a direction the side is taken
+    from the last seen LTP.
+    """
+    payload = payload or {}
+    order = payload.get("order")
+    if not isinstance(order, dict):
+        raise HTTPException(status_code=400, detail="'order' must be a /place_orders payload")
+    try:
+        level = float(payload.get("level"))
+    except Exception:
+        raise HTTPException(status_code=400, detail="'level' must be a number")
+
+    parts = [p.strip() for p in str(order.get("symbol") or "").split("|")]
+    exchange = str(payload.get("exchange") or order.get("exchange") or (parts[0] if parts else "") or "NSE").upper()
+    # symbol master ids are "EXCH|SYMBOL|SECURITY_ID[|MO_TOKEN]"; Motilal orders use the security id
+    scrip = (payload.get("scripcode") or payload.get("symboltoken")
+             or (parts[3] if len(parts) > 3 else "") or (parts[2] if len(parts) > 2 else ""))
+    try:
+        scrip = int(scrip)
+    except Exception:
+        raise HTTPException(status_code=400, detail="scripcode (Motilal token) is required")
+
+    # fail fast on a bad order instead of when the price gets there
+    _release_risk_holds([_plan_place_orders(order)])
+
+    tid = _safe(str(payload.get("id") or f"trg_{exchange}_{scrip}_{int(time.time() * 1000)}"))
+    try:
+        rec = _triggers.add({"id": tid, "exchange": exchange, "scrip": scrip, "level": level,
+                             "direction": payload.get("direction") or "", "order": order})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        mo = importlib.import_module("Broker_motilal")
+        feed_ok = mo.start_ltp_feed(_triggers.on_tick)
+        mo.subscribe_ltp(exchange, scrip)
+    except Exception as e:
+        feed_ok = False
+        print(f"[trigger] LTP feed start failed: {e}")
+
+    return {"success": True, "trigger": _trigger_view(rec), "feed": bool(feed_ok),
+            "last_ltp": _triggers.last_price(exchange, scrip)}
+
+@app.get("/triggers")
+def route_list_triggers():
+    return {"triggers": [_trigger_view(r) for r in _triggers.rules()]}
+
+@app.post("/cancel_trigger")
+def route_cancel_trigger(payload: Dict[str, Any] = Body(...)):
+    tid = _safe(str((payload or {}).get("id") or ""))
+    if not _triggers.cancel(tid):
+        raise HTTPException(status_code=404, detail=f"no pending trigger: {tid}")
+    return {"success": True, "id": tid}
+
+@app.post("/ltp_tick")
+def route_ltp_tick(payload: Dict[str, Any] = Body(...)):
+    """Push an LTP from another source: { exchange, scripcode, ltp } -> triggers fired."""
+    try:
+        n = _triggers.on_tick(str(payload.get("exchange") or "NSE"), int(payload.get("scripcode")),
+                              float(payload.get("ltp")))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"fired": n}
+
 @app.post("/modify_order")
 def route_modify_order(payload: Dict[str, Any] = Body(...)):
     """
@@ -1768,8 +3746,6 @@ def route_modify_order(payload: Dict[str, Any] = Body(...)):
       - Fills missing quantity from current pending order snapshot.
       - Sends Dhan orderType as proper enum.
     """
-    import importlib, json, os
-
     # ---------- tiny utils ----------
     def _to_int_or_none(x):
         try:
@@ -1785,23 +3761,6 @@ def route_modify_order(payload: Dict[str, Any] = Body(...)):
         except Exception:
             return None
 
-    def _map_ui_to_dhan(ui: str | None) -> str | None:
-        if not ui: return None
-        u = ui.upper().replace("-", "_")
-        m = {
-            "LIMIT": "LIMIT",
-            "MARKET": "MARKET",
-            "STOPLOSS": "STOP_LOSS",
-            "SL_LIMIT": "STOP_LOSS",
-            "SL": "STOP_LOSS",
-            "STOP_LOSS": "STOP_LOSS",
-            "SL_MARKET": "STOP_LOSS_MARKET",
-            "STOPLOSS_MARKET": "STOP_LOSS_MARKET",
-            "STOP_LOSS_MARKET": "STOP_LOSS_MARKET",
-            "NO_CHANGE": None, "": None
-        }
-        return m.get(u, None)
-
     def _guess_from_values(price, trig) -> str:
         has_p = price is not None and str(price) != ""
         has_t = trig  is not None and str(trig)  != ""
@@ -1812,25 +3771,45 @@ def route_modify_order(payload: Dict[str, Any] = Body(...)):
 
     def _guess_broker_from_order(od: Dict[str, Any]) -> str | None:
         oid = str((od or {}).get("order_id") or (od or {}).get("orderId") or "").strip()
+        hit = _lookup_order(oid)
+        if hit: return hit["broker"]
         if oid.isdigit(): return "dhan"
         if any(c.isalpha() for c in oid): return "motilal"
         return _broker_by_client_name((od or {}).get("name"))
 
     # ----- try to fetch current order snapshot from broker (for quantity/defaults)
-    def _fetch_dhan_order_snapshot(order_id: str) -> dict | None:
+    # ----- current order snapshots from broker (for quantity/validity/type defaults)
+    def _dhan_owner(oid: str, name: str, by_name: Dict[str, Dict[str, Any]]) -> Dict[str, Any] | None:
+        hit = _lookup_order(oid) or {}
+        if hit.get("client_json"):
+            return hit["client_json"]
+        try:
+            cj = importlib.import_module("Broker_dhan").client_for_order(oid)
+        except Exception:
+            cj = None
+        return cj or by_name.get((name or "").strip().lower())
+
+    def _prefetch_dhan_snapshots(owners: Dict[str, Dict[str, Any]], oids: List[str]) -> Dict[str, dict]:
+        """Single-order GETs batched per owning client; clients run in parallel."""
+        batches: Dict[str, Dict[str, Any]] = {}
+        for oid in oids:
+            cj = owners.get(oid)
+            if not cj:
+                continue
+            uid = str(cj.get("userid") or cj.get("client_id") or "")
+            batches.setdefault(uid, {"client": cj, "ids": []})["ids"].append(oid)
+        if not batches:
+            return {}
         try:
             dh = importlib.import_module("Broker_dhan")
-            fn = getattr(dh, "get_orders", None)
-            if not callable(fn):
-                return None
-            data = fn() or {}
-            for key in ("pending", "traded", "rejected", "cancelled", "others"):
-                for row in (data.get(key) or []):
-                    if str(row.get("order_id") or row.get("orderId") or "") == str(order_id):
-                        return row
+            fetch = getattr(dh, "get_order_snapshots")
         except Exception:
-            return None
-        return None
+            return {}
+        out: Dict[str, dict] = {}
+        with ThreadPoolExecutor(max_workers=min(16, len(batches))) as ex:
+            for res in ex.map(lambda b: fetch(b["client"], b["ids"]), batches.values()):
+                out.update(res or {})
+        return out
 
     def _snap_qty(s: dict | None) -> int | None:
         if not isinstance(s, dict): return None
@@ -1862,11 +3841,34 @@ def route_modify_order(payload: Dict[str, Any] = Body(...)):
     prc_default  = _to_float_or_none(payload.get("price"))
     trg_default  = _to_float_or_none(payload.get("triggerprice") or payload.get("trig_price"))
     ot_default   = (payload.get("orderType") or payload.get("ordertype") or "NO_CHANGE").upper()
-    validity_in  = (payload.get("validity") or payload.get("timeForce") or "DAY").upper()
+    validity_in  = (payload.get("validity") or payload.get("timeForce") or "").upper()
 
     by_broker: Dict[str, List[Dict[str, Any]]] = {"dhan": [], "motilal": []}
     skipped: List[str] = []
 
+    # ---------- resolve Dhan owners once, then fetch only the snapshots we need ----------
+    dhan_by_name: Dict[str, Dict[str, Any]] = {}
+    names_loaded = False
+    dhan_owner: Dict[str, Dict[str, Any]] = {}
+    need_snap: List[str] = []
+    for od in orders:
+        oid = str((od or {}).get("order_id") or (od or {}).get("orderId") or "").strip()
+        if not oid or _guess_broker_from_order(od) != "dhan":
+            continue
+        if not names_loaded and not (_lookup_order(oid) or {}).get("client_json"):
+            names_loaded = True
+            for c in (v["json"] for v in _clients_by_uid().values() if v["broker"] == "dhan"):
+                dhan_by_name[(c.get("name") or c.get("display_name") or "").strip().lower()] = c
+        cj = _dhan_owner(oid, od.get("name", ""), dhan_by_name)
+        if cj:
+            dhan_owner[oid] = cj
+        q_in  = od.get("quantity") if od.get("quantity") not in (None, "") else payload.get("quantity")
+        ot_in = (od.get("orderType") or od.get("ordertype") or ot_default or "").upper()
+        if (_to_int_or_none(q_in) is None or not (od.get("validity") or validity_in)
+                or ot_in in ("", "NO_CHANGE")):
+            need_snap.append(oid)
+    dhan_snaps = _prefetch_dhan_snapshots(dhan_owner, need_snap)
+
     # ---------- build broker buckets ----------
     for od in orders:
         name = (od or {}).get("name", "")
@@ -1887,31 +3889,41 @@ def route_modify_order(payload: Dict[str, Any] = Body(...)):
 
         ot_ui    = (od.get("orderType") or od.get("ordertype") or ot_default or "").upper()
         ot_dhan  = _map_ui_to_dhan(ot_ui)
-        ot_final = ot_dhan or _guess_from_values(p, trg)
-
-        # fetch snapshot for dhan if we miss critical fields
-        snap = None
-        if brk == "dhan" and (q is None or not validity_in or ot_ui in ("", "NO_CHANGE")):
-            snap = _fetch_dhan_order_snapshot(oid)
+        row_validity = (od.get("validity") or validity_in or "").upper()
+
+        # snapshot (prefetched above) fills what the UI left out
+        snap = dhan_snaps.get(oid) if brk == "dhan" else None
+        snap_ot = _map_ui_to_dhan((snap or {}).get("orderType"))
+        if not ot_dhan and snap_ot:
+            # NO_CHANGE keeps the live type; carry over its price/trigger if not re-entered
+            ot_final = snap_ot
+            if p is None and snap_ot in ("LIMIT", "STOP_LOSS"):
+                p = _to_float_or_none((snap or {}).get("price"))
+            if trg is None and snap_ot in ("STOP_LOSS", "STOP_LOSS_MARKET"):
+                trg = _to_float_or_none((snap or {}).get("triggerPrice"))
+        else:
+            ot_final = ot_dhan or _guess_from_values(p, trg)
 
         if q is None and brk == "dhan":
             q = _snap_qty(snap)
-        if not validity_in and brk == "dhan":
+        if not row_validity and brk == "dhan":
             validity = _snap_validity(snap) or "DAY"
         else:
-            validity = validity_in or "DAY"
+            validity = row_validity or "DAY"
 
         # explicit validations (only for explicit changes)
-        if ot_dhan:
-            if ot_dhan == "LIMIT" and (p is None or p <= 0):
-                skipped.append(f"{name} ({oid}): LIMIT requires Price > 0")
-                continue
-            if ot_dhan == "STOP_LOSS" and ((p is None or p <= 0) or (trg is None or trg <= 0)):
-                skipped.append(f"{name} ({oid}): STOPLOSS requires both Price and Trigger > 0")
-                continue
-            if ot_dhan == "STOP_LOSS_MARKET" and (trg is None or trg <= 0):
-                skipped.append(f"{name} ({oid}): SL-MARKET requires Trigger > 0")
-                continue
+        err = _modify_price_error(ot_dhan, p, trg) if ot_dhan else None
+        if err:
+            skipped.append(f"{name} ({oid}): {err}")
+            continue
+
+        hit = _lookup_order(oid) or {}
+        owner = (dhan_owner.get(oid) if brk == "dhan" else None) or hit.get("client_json") or {}
+        lim = _risk_limits_for(hit.get("userid") or "", (hit.get("snapshot") or {}).get("tag") or "", owner)
+        reason = _risk.check_modify(oid, q, p, lim) if lim else None
+        if reason:
+            skipped.append(f"{name} ({oid}): blocked by risk limit {reason}")
+            continue
 
         row_common = {
             "name": name,
@@ -1930,26 +3942,8 @@ def route_modify_order(payload: Dict[str, Any] = Body(...)):
                 "orderType": ot_final,         # LIMIT | MARKET | STOP_LOSS | STOP_LOSS_MARKET
                 "disclosedQuantity": 0,        # never empty string
             }
-            # attach client json
-            # local file scan (same as in your previous version)
-            def _load_client_json_dhan(name_: str) -> Dict[str, Any] | None:
-                needle = (name_ or "").strip().lower()
-                try:
-                    for fn in os.listdir(DHAN_DIR):
-                        if not fn.endswith(".json"): continue
-                        pth = os.path.join(DHAN_DIR, fn)
-                        with open(pth, "r", encoding="utf-8") as f:
-                            cj = json.load(f)
-                        nm = (cj.get("name") or cj.get("display_name") or "").strip().lower()
-                        if nm == needle:
-                            return cj
-                except FileNotFoundError:
-                    return None
-                except Exception:
-                    return None
-                return None
-
-            row_dhan["_client_json"] = _load_client_json_dhan(name) or {}
+            # attach client json (resolved once above: index -> order feed -> name)
+            row_dhan["_client_json"] = dhan_owner.get(oid) or {}
             # If quantity is STILL None, use 0 (better than ""), Dhan ignores unchanged fields server-side.
             if row_dhan["quantity"] is None:
                 row_dhan["quantity"] = 0
@@ -1957,24 +3951,33 @@ def route_modify_order(payload: Dict[str, Any] = Body(...)):
         else:
             # Motilal keeps UI word; broker module will map
             row_mo = {**row_common, "orderType": ot_ui or "NO_CHANGE"}
+            hit = _lookup_order(oid) or {}
+            if hit.get("client_json"):
+                row_mo["_client_json"] = hit["client_json"]
             by_broker["motilal"].append(row_mo)
 
     # ---------- logs ----------
-    try:
-        print("\n[/modify_order] INBOUND =>")
-        print(json.dumps(payload, indent=2, default=str))
-        print("\n[/modify_order] DHAN bucket =>")
-        print(json.dumps(by_broker["dhan"], indent=2, default=str))
-        print("\n[/modify_order] MOTILAL bucket =>")
-        print(json.dumps(by_broker["motilal"], indent=2, default=str))
-        if skipped:
-            print("\n[/modify_order] SKIPPED =>")
-            print(json.dumps(skipped, indent=2, default=str))
-    except Exception:
-        pass
+    print(f"[/modify_order] dhan={len(by_broker['dhan'])} motilal={len(by_broker['motilal'])} skipped={len(skipped)}")
+    if ROUTER_DEBUG:
+        try:
+            print("\n[/modify_order] INBOUND =>")
+            print(json.dumps(payload, indent=2, default=str))
+            print("\n[/modify_order] DHAN bucket =>")
+            # never log the attached client JSON (tokens / passwords)
+            print(json.dumps([{k: v for k, v in r.items() if k != "_client_json"} for r in by_broker["dhan"]],
+                             indent=2, default=str))
+            print("\n[/modify_order] MOTILAL bucket =>")
+            print(json.dumps([{k: v for k, v in r.items() if k != "_client_json"} for r in by_broker["motilal"]],
+                             indent=2, default=str))
+        except Exception:
+            pass
+    if skipped:
+        print("\n[/modify_order] SKIPPED =>")
+        print(json.dumps(skipped, indent=2, default=str))
 
     # ---------- dispatch ----------
     messages: List[str] = []
+    timing: Dict[str, Any] = {}
     if skipped:
         messages.extend([f"ℹ️ {s}" for s in skipped])
 
@@ -1996,8 +3999,11 @@ def route_modify_order(payload: Dict[str, Any] = Body(...)):
             except Exception:
                 pass
 
+            _risk_on_modified(by_broker["dhan"], res)
             if isinstance(res, dict) and isinstance(res.get("message"), list):
                 messages.extend([str(x) for x in res["message"]])
+                if res.get("timing"):
+                    timing["dhan"] = res["timing"]
             elif res is not None:
                 messages.append(str(res))
         except Exception as e:
@@ -2014,8 +4020,11 @@ def route_modify_order(payload: Dict[str, Any] = Body(...)):
                     print(json.dumps(res, indent=2, default=str))
                 except Exception:
                     pass
+                _risk_on_modified(by_broker["motilal"], res)
                 if isinstance(res, dict) and isinstance(res.get("message"), list):
                     messages.extend([str(x) for x in res["message"]])
+                    if res.get("timing"):
+                        timing["motilal"] = res["timing"]
                 else:
                     messages.append(str(res))
             else:
@@ -2029,7 +4038,7 @@ def route_modify_order(payload: Dict[str, Any] = Body(...)):
     except Exception:
         print(messages)
 
-    return {"message": messages}
+    return {"message": messages, "timing": timing}
     
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,302 @@
+# Risk_limits.py
+"""
+Pre-trade risk limits with constant-time checks per child order.
+
+Limits live under "risk_limits" in a client JSON or a group JSON; every key is
+optional and 0/absent means "no limit":
+  max_order_value     : rupees per child order (qty x price)
+  max_qty_per_symbol  : shares; |net position| + working orders + this order
+  max_open_positions  : symbols with a position or a working order
+  max_daily_loss      : realized loss for the day; past it only orders that
+                        reduce a position are allowed
+A group member gets the tighter of its own and the group's value per limit.
+
+Exposure is tracked per (client, symbol) from order acks and order-state
+updates. Updates are keyed by order id and applied as deltas against the last
+state seen, so replays of the same update (REST re-seed + feed) are harmless.
+Net positions are seeded from the brokers' position books (seed_positions).
+reserve() checks and holds the quantity until the order is acked or the hold
+is released, so children of one batch are checked against each other.
+Quantities are always shares.
+"""
+
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+IST = timezone(timedelta(hours=5, minutes=30))
+
+LIMIT_KEYS = ("max_order_value", "max_qty_per_symbol", "max_open_positions", "max_daily_loss")
+_DONE_STATES = ("TRADED", "COMPLETE", "EXECUTED", "REJECTED", "CANCELLED", "CANCELED", "EXPIRED", "ERROR")
+
+
+def merge_limits(*docs: Optional[Dict[str, Any]]) -> Dict[str, float]:
+    """Tightest positive value per key across the given risk_limits dicts."""
+    out: Dict[str, float] = {}
+    for d in docs:
+        if not isinstance(d, dict):
+            continue
+        for k in LIMIT_KEYS:
+            try:
+                v = float(d.get(k) or 0)
+            except Exception:
+                continue
+            if v > 0 and (k not in out or v < out[k]):
+                out[k] = v
+    return out
+
+
+def side_sign(action: str) -> int:
+    return -1 if str(action or "").strip().upper() in ("SELL", "S") else 1
+
+
+def _is_done(status: str) -> bool:
+    s = str(status or "").upper()
+    if "PART" in s:          # PART_TRADED / Partially Traded is still working
+        return False
+    return any(w in s for w in _DONE_STATES)
+
+
+class RiskBook:
+    """Exposure counters + limit checks. All methods are O(1) per order."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._day = datetime.now(IST).date()
+        self._orders: Dict[str, Dict[str, Any]] = {}                  # oid -> {uid, sym, sign, open, filled}
+        self._working: Dict[Tuple[str, str], int] = {}                # (uid, sym) -> signed open qty
+        self._pos: Dict[Tuple[str, str], int] = {}                    # (uid, sym) -> signed net qty
+        self._avg: Dict[Tuple[str, str], float] = {}                  # (uid, sym) -> avg cost of _pos
+        self._active: Dict[str, int] = {}                             # uid -> symbols with pos or working
+        self._realized: Dict[str, float] = {}                         # uid -> realized P&L today
+        self._held: Dict[Tuple[str, str], int] = {}                   # (uid, sym) -> signed qty reserved, not yet acked
+        self._holds: Dict[int, Dict[str, Any]] = {}                   # hold id -> {key, sign, left}
+        self._next_hold = 0
+        self.stats: Dict[str, Any] = {"checked": 0, "blocked": 0, "by_reason": {}}
+
+    # ---------- counters ----------
+    def _roll_day(self) -> None:
+        today = datetime.now(IST).date()
+        if today != self._day:
+            # overnight positions carry; day orders and the loss counter do not
+            self._day = today
+            self._orders.clear()
+            self._working.clear()
+            self._realized.clear()
+            self._held.clear()
+            self._holds.clear()
+            self._active = {}
+            for (uid, _), q in self._pos.items():
+                if q:
+                    self._active[uid] = self._active.get(uid, 0) + 1
+
+    def _live(self, key: Tuple[str, str]) -> bool:
+        return bool(self._pos.get(key) or self._working.get(key) or self._held.get(key))
+
+    def _adjust(self, key: Tuple[str, str], d_working: int = 0, fill: int = 0, px: float = 0.0,
+                d_held: int = 0) -> None:
+        before = self._live(key)
+        if d_working:
+            self._working[key] = self._working.get(key, 0) + d_working
+        if d_held:
+            self._held[key] = self._held.get(key, 0) + d_held
+            if not self._held[key]:
+                del self._held[key]
+        if fill:
+            pos, avg = self._pos.get(key, 0), self._avg.get(key, 0.0)
+            if pos == 0 or (pos > 0) == (fill > 0):
+                new = pos + fill
+                self._avg[key] = (avg * abs(pos) + px * abs(fill)) / abs(new) if new else 0.0
+            else:
+                closed = min(abs(fill), abs(pos))
+                self._realized[key[0]] = self._realized.get(key[0], 0.0) + closed * (px - avg) * (1 if pos > 0 else -1)
+                new = pos + fill
+                if new and (new > 0) != (pos > 0):
+                    self._avg[key] = px     # flipped: remainder opened at this fill
+            self._pos[key] = new
+        after = self._live(key)
+        if before != after:
+            self._active[key[0]] = self._active.get(key[0], 0) + (1 if after else -1)
+
+    def on_ack(self, order_id: str, uid: str, symbol: str, action: str, qty: int,
+               hold: Optional[int] = None) -> None:
+        """A new order was accepted by the broker: count it as working (out of `hold` if given)."""
+        oid = str(order_id or "").strip()
+        if not oid or qty <= 0:
+            return
+        with self._lock:
+            self._roll_day()
+            if oid in self._orders:
+                return
+            sign = side_sign(action)
+            key = (str(uid), str(symbol))
+            self._orders[oid] = {"uid": key[0], "sym": key[1], "sign": sign, "open": int(qty), "filled": 0}
+            self._adjust(key, d_working=sign * int(qty))
+            h = self._holds.get(hold) if hold is not None else None
+            if h and h["key"] == key:
+                take = min(int(qty), h["left"])
+                h["left"] -= take
+                self._adjust(key, d_held=-h["sign"] * take)
+                if not h["left"]:
+                    del self._holds[hold]
+
+    def release(self, holds: Iterable[Optional[int]]) -> None:
+        """Drop what is left of reservations (slices that were rejected or never sent)."""
+        with self._lock:
+            for hid in holds:
+                h = self._holds.pop(hid, None) if hid is not None else None
+                if h and h["left"]:
+                    self._adjust(h["key"], d_held=-h["sign"] * h["left"])
+
+    def seed_positions(self, uid: str, rows: Iterable[Tuple[str, int, float, float]]) -> None:
+        """
+        Replace one client's net positions with the broker's position book:
+        rows of (symbol, signed net qty, avg price, realized P&L today).
+        """
+        uid = str(uid)
+        with self._lock:
+            self._roll_day()
+            seen = set()
+            realized = 0.0
+            for sym, net, avg, pnl in rows:
+                key = (uid, str(sym))
+                seen.add(key)
+                before = self._live(key)
+                self._pos[key] = int(net or 0)
+                self._avg[key] = float(avg or 0) if net else 0.0
+                realized += float(pnl or 0)
+                after = self._live(key)
+                if before != after:
+                    self._active[uid] = self._active.get(uid, 0) + (1 if after else -1)
+            for key in [k for k in self._pos if k[0] == uid and k not in seen]:
+                before = self._live(key)
+                self._pos[key] = 0
+                if before and not self._live(key):
+                    self._active[uid] = self._active.get(uid, 0) - 1
+            self._realized[uid] = realized
+
+    def on_order(self, order_id: str, uid: str, symbol: str, action: str, qty: int,
+                 filled: int, avg_price: float, status: str) -> None:
+        """Latest state of an order (feed or order book row): apply the change since the last one."""
+        oid = str(order_id or "").strip()
+        if not oid:
+            return
+        with self._lock:
+            self._roll_day()
+            rec = self._orders.get(oid)
+            if rec is None:
+                rec = {"uid": str(uid), "sym": str(symbol), "sign": side_sign(action), "open": 0, "filled": 0}
+                self._orders[oid] = rec
+            key = (rec["uid"], rec["sym"])
+            filled = max(0, int(filled or 0))
+            open_now = 0 if _is_done(status) else max(0, int(qty or 0) - filled)
+            d_fill = filled - rec["filled"]
+            d_open = open_now - rec["open"]
+            if d_fill > 0:
+                # rows carry the cumulative average; price the new fills out of it
+                avg = float(avg_price or 0)
+                px = (avg * filled - rec.get("avg", 0.0) * rec["filled"]) / d_fill if avg else 0.0
+                self._adjust(key, fill=rec["sign"] * d_fill, px=px)
+                rec["avg"] = avg
+            if d_open:
+                self._adjust(key, d_working=rec["sign"] * d_open)
+            rec["filled"], rec["open"] = max(filled, rec["filled"]), open_now
+
+    def on_modify(self, order_id: str, new_qty: int) -> None:
+        """Quantity change of a working order (shares, total including any filled part)."""
+        with self._lock:
+            rec = self._orders.get(str(order_id or "").strip())
+            if not rec or new_qty <= 0:
+                return
+            open_now = max(0, int(new_qty) - rec["filled"])
+            d = open_now - rec["open"]
+            if d:
+                self._adjust((rec["uid"], rec["sym"]), d_working=rec["sign"] * d)
+                rec["open"] = open_now
+
+    # ---------- checks ----------
+    def _block(self, reason: str) -> str:   # caller holds the lock
+        self.stats["blocked"] += 1
+        self.stats["by_reason"][reason] = self.stats["by_reason"].get(reason, 0) + 1
+        return reason
+
+    def _check(self, key: Tuple[str, str], signed: int, price: float,
+               limits: Dict[str, float]) -> Optional[str]:   # caller holds the lock
+        self.stats["checked"] += 1
+        self._roll_day()
+        pos = self._pos.get(key, 0)
+        working = self._working.get(key, 0) + self._held.get(key, 0)
+        lim = limits.get("max_order_value")
+        if lim and price > 0 and abs(signed) * price > lim:
+            return self._block("max_order_value")
+        lim = limits.get("max_qty_per_symbol")
+        if lim and abs(pos + working + signed) > lim:
+            return self._block("max_qty_per_symbol")
+        lim = limits.get("max_open_positions")
+        if lim and not self._live(key) and self._active.get(key[0], 0) >= lim:
+            return self._block("max_open_positions")
+        lim = limits.get("max_daily_loss")
+        if lim and -self._realized.get(key[0], 0.0) >= lim and abs(pos + signed) >= abs(pos):
+            return self._block("max_daily_loss")
+        return None
+
+    def check(self, uid: str, symbol: str, action: str, qty: int, price: float,
+              limits: Dict[str, float]) -> Optional[str]:
+        """None if the order passes, else the name of the limit it breaks."""
+        if not limits:
+            return None
+        with self._lock:
+            return self._check((str(uid), str(symbol)), side_sign(action) * int(qty), price, limits)
+
+    def reserve(self, uid: str, symbol: str, action: str, qty: int, price: float,
+                limits: Dict[str, float]) -> Tuple[Optional[str], Optional[int]]:
+        """
+        check() and, if it passes, hold `qty` as working until on_ack(hold=...)
+        or release(). Returns (reason, hold id); no hold without limits.
+        """
+        if not limits:
+            return None, None
+        key = (str(uid), str(symbol))
+        sign = side_sign(action)
+        with self._lock:
+            reason = self._check(key, sign * int(qty), price, limits)
+            if reason or qty <= 0:
+                return reason, None
+            self._next_hold += 1
+            self._holds[self._next_hold] = {"key": key, "sign": sign, "left": int(qty)}
+            self._adjust(key, d_held=sign * int(qty))
+            return None, self._next_hold
+
+    def check_modify(self, order_id: str, new_qty: Optional[int], price: Optional[float],
+                     limits: Dict[str, float]) -> Optional[str]:
+        """Same limits for a modification of a known order (unknown orders pass)."""
+        if not limits:
+            return None
+        with self._lock:
+            self.stats["checked"] += 1
+            rec = self._orders.get(str(order_id or "").strip())
+            if not rec:
+                return None
+            key = (rec["uid"], rec["sym"])
+            total = int(new_qty) if new_qty and new_qty > 0 else rec["open"] + rec["filled"]
+            lim = limits.get("max_order_value")
+            if lim and price and price > 0 and total * price > lim:
+                return self._block("max_order_value")
+            lim = limits.get("max_qty_per_symbol")
+            if lim and new_qty and new_qty > 0:
+                d = max(0, total - rec["filled"]) - rec["open"]
+                working = self._working.get(key, 0) + self._held.get(key, 0)
+                if abs(self._pos.get(key, 0) + working + rec["sign"] * d) > lim:
+                    return self._block("max_qty_per_symbol")
+        return None
+
+    def exposure(self, uid: str) -> Dict[str, Any]:
+        with self._lock:
+            syms = {s for (u, s) in list(self._pos) + list(self._working) + list(self._held) if u == uid}
+            return {
+                "realized_pnl": round(self._realized.get(uid, 0.0), 2),
+                "open_positions": self._active.get(uid, 0),
+                "symbols": {s: {"position": self._pos.get((uid, s), 0), "working": self._working.get((uid, s), 0),
+                                "reserved": self._held.get((uid, s), 0)}
+                            for s in syms if self._live((uid, s))},
+            }
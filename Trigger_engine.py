@@ -0,0 +1,174 @@
+# Trigger_engine.py
+"""
+Local price triggers ("when LTP crosses X, fire this order") indexed per scrip.
+
+Each scrip keeps two sorted level lists:
+  - up   : fire when LTP >= level  (ascending; a tick fires the prefix <= LTP)
+  - down : fire when LTP <= level  (stored negated so it is ascending too)
+so a tick costs one bisect per side plus the triggers it actually fires,
+never a scan of every rule.
+
+The engine is feed-agnostic: call on_tick(exchange, scrip, ltp) from any LTP
+source (Broker_motilal's broadcast feed in the router). Fired rules are handed
+to `fire` on a small pool so the feed thread is never blocked by order I/O.
+"""
+
+import bisect, itertools, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+# other spellings of the broadcast feed's segment names (message["Exchange"])
+_EXCHANGE_ALIASES = {"NSE_EQ": "NSE", "NSE_FNO": "NSEFO", "NFO": "NSEFO", "BSE_EQ": "BSE",
+                     "BSE_FNO": "BSEFO", "BFO": "BSEFO", "NSE_CURRENCY": "NSECD", "CDS": "NSECD",
+                     "MCX_COMM": "MCX"}
+
+
+def exchange_key(exchange: str) -> str:
+    """
+    Full segment name the broadcast feed reports (NSE, NSEFO, BSE, BSEFO, MCX,
+    NSECD, NCDEX). Cash and F&O scrip codes overlap, so segments are never folded.
+    """
+    e = (exchange or "").strip().upper()
+    return _EXCHANGE_ALIASES.get(e, e)
+
+
+class _ScripBook:
+    __slots__ = ("up_lv", "up_ids", "dn_lv", "dn_ids")
+
+    def __init__(self) -> None:
+        self.up_lv: List[Tuple[float, int]] = []   # (level, seq)
+        self.up_ids: List[str] = []
+        self.dn_lv: List[Tuple[float, int]] = []   # (-level, seq)
+        self.dn_ids: List[str] = []
+
+    def add(self, direction: str, level: float, seq: int, tid: str) -> None:
+        lv, ids = (self.up_lv, self.up_ids) if direction == "up" else (self.dn_lv, self.dn_ids)
+        k = (level if direction == "up" else -level, seq)
+        i = bisect.bisect_left(lv, k)
+        lv.insert(i, k)
+        ids.insert(i, tid)
+
+    def remove(self, direction: str, level: float, seq: int) -> None:
+        lv, ids = (self.up_lv, self.up_ids) if direction == "up" else (self.dn_lv, self.dn_ids)
+        k = (level if direction == "up" else -level, seq)
+        i = bisect.bisect_left(lv, k)
+        if i < len(lv) and lv[i] == k:
+            del lv[i]
+            del ids[i]
+
+    def crossed(self, ltp: float) -> List[str]:
+        """Pop and return ids of every trigger this LTP satisfies."""
+        out: List[str] = []
+        n = bisect.bisect_right(self.up_lv, (ltp, float("inf")))
+        if n:
+            out.extend(self.up_ids[:n])
+            del self.up_lv[:n], self.up_ids[:n]
+        n = bisect.bisect_right(self.dn_lv, (-ltp, float("inf")))
+        if n:
+            out.extend(self.dn_ids[:n])
+            del self.dn_lv[:n], self.dn_ids[:n]
+        return out
+
+    def __len__(self) -> int:
+        return len(self.up_lv) + len(self.dn_lv)
+
+
+class TriggerEngine:
+    """
+    Holds trigger rules {id, exchange, scrip, direction ("up"|"down"), level, ...}
+    and fires each once. `fire(rule)` runs on the engine's pool.
+    """
+
+    def __init__(self, fire: Callable[[Dict[str, Any]], Any], max_workers: int = 8) -> None:
+        self._fire = fire
+        self._lock = threading.Lock()
+        self._books: Dict[Tuple[str, int], _ScripBook] = {}
+        self._rules: Dict[str, Dict[str, Any]] = {}
+        self._ltp: Dict[Tuple[str, int], float] = {}
+        self._seq = itertools.count(1)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="trigger")
+
+    def last_price(self, exchange: str, scrip: int) -> Optional[float]:
+        return self._ltp.get((exchange_key(exchange), int(scrip)))
+
+    def add(self, rule: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Register a rule. `direction` may be omitted when an LTP is already known
+        for the scrip: a level above the last price means "up", below means "down".
+        A rule already satisfied by the last price is rejected (it would fire at once).
+        """
+        key = (exchange_key(rule["exchange"]), int(rule["scrip"]))
+        level = float(rule["level"])
+        with self._lock:
+            last = self._ltp.get(key)
+            direction = (rule.get("direction") or "").lower()
+            if direction in ("above", "up", ">="):
+                direction = "up"
+            elif direction in ("below", "down", "<="):
+                direction = "down"
+            elif last is not None:
+                direction = "up" if level > last else "down"
+            else:
+                raise ValueError("direction required until an LTP has been seen for this scrip")
+            if last is not None and ((direction == "up" and last >= level) or
+                                     (direction == "down" and last <= level)):
+                raise ValueError(f"already crossed: last={last} level={level} direction={direction}")
+
+            seq = next(self._seq)
+            rec = {**rule, "direction": direction, "level": level, "_seq": seq,
+                   "status": "pending", "created_at": time.time()}
+            self._rules[rec["id"]] = rec
+            self._books.setdefault(key, _ScripBook()).add(direction, level, seq, rec["id"])
+            return rec
+
+    def cancel(self, tid: str) -> bool:
+        with self._lock:
+            rec = self._rules.get(tid)
+            if not rec or rec["status"] != "pending":
+                return False
+            key = (exchange_key(rec["exchange"]), int(rec["scrip"]))
+            book = self._books.get(key)
+            if book:
+                book.remove(rec["direction"], rec["level"], rec["_seq"])
+            rec["status"] = "cancelled"
+            return True
+
+    def rules(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [dict(r) for r in self._rules.values()]
+
+    def scrips(self) -> List[Tuple[str, int]]:
+        """(exchange, scrip) pairs that still have pending triggers."""
+        with self._lock:
+            return [k for k, b in self._books.items() if len(b)]
+
+    def on_tick(self, exchange: str, scrip: int, ltp: float) -> int:
+        """Feed one LTP; fires crossed triggers and returns how many."""
+        key = (exchange_key(exchange), int(scrip))
+        t = time.time()
+        with self._lock:
+            self._ltp[key] = float(ltp)
+            book = self._books.get(key)
+            if not book:
+                return 0
+            fired = []
+            for tid in book.crossed(float(ltp)):
+                rec = self._rules.get(tid)
+                if rec and rec["status"] == "pending":
+                    rec.update(status="fired", fired_ltp=float(ltp), tick_at=t)
+                    fired.append(rec)
+        for rec in fired:
+            self._pool.submit(self._run, rec)
+        return len(fired)
+
+    def _run(self, rec: Dict[str, Any]) -> None:
+        try:
+            rec["dispatch_at"] = time.time()
+            rec["result"] = self._fire(rec)
+        except Exception as e:
+            rec["status"] = "failed"
+            rec["error"] = str(e)
+        finally:
+            rec["done_at"] = time.time()
+            rec["tick_to_done_ms"] = round((rec["done_at"] - rec["tick_at"]) * 1000.0, 3)
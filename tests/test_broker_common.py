@@ -0,0 +1,57 @@
+# tests/test_broker_common.py
+"""Broker_common: RateLimiter priority lanes and parallel_map ordering."""
+
+import os, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from Broker_common import RateLimiter, parallel_map
+
+
+def _queued(rl, key):
+    with rl._lock:
+        return len(rl._queues.get(key) or [])
+
+
+def _waiter(rl, key, lane, served):
+    t = threading.Thread(target=lambda: (rl.acquire(key, lane), served.append(lane)))
+    t.start()
+    return t
+
+
+def test_cancel_overtakes_queued_new_orders():
+    rl = RateLimiter(rate=10, burst=1)
+    assert rl.acquire("C1", "new") == 0.0          # bucket now empty
+    served = []
+    threads = [_waiter(rl, "C1", "new", served)]
+    while _queued(rl, "C1") < 1:
+        time.sleep(0.005)
+    threads.append(_waiter(rl, "C1", "new", served))
+    while _queued(rl, "C1") < 2:
+        time.sleep(0.005)
+    threads.append(_waiter(rl, "C1", "cancel", served))
+    for t in threads:
+        t.join(5)
+
+    assert served == ["cancel", "new", "new"]
+    st = rl.stats()
+    assert st["cancel"]["jumped"] == 2
+    assert st["new"]["acquired"] == 3
+    assert st["queued"] == 0
+
+
+def test_lanes_do_not_share_budget_across_keys():
+    rl = RateLimiter(rate=1, burst=1)
+    assert rl.acquire("A") == 0.0
+    assert rl.acquire("B", "modify") == 0.0       # another account has its own bucket
+
+
+def test_parallel_map_keeps_order_on_shared_executor():
+    def slow(x):
+        time.sleep(0.01 * (5 - x))
+        return x * x
+
+    assert parallel_map(slow, range(5), 5) == [0, 1, 4, 9, 16]
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        assert parallel_map(slow, range(5), 5, pool) == [0, 1, 4, 9, 16]
@@ -0,0 +1,123 @@
+# tests/test_dhan_feed.py
+"""
+Broker_dhan order-update feed against the local Dhan_feed_stub server:
+login, pushed order_alerts, reconnect after a drop, and how OrderStore
+merges REST snapshots with feed updates.
+"""
+
+import os, sys, time
+from datetime import timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import Broker_dhan as dh
+from Dhan_feed_stub import StubOrderFeedServer
+
+pytestmark = pytest.mark.skipif(dh.websocket is None, reason="websocket-client not installed")
+
+UID, TOKEN = "1000000001", "tok-1"
+
+
+def _wait(cond, timeout=5.0):
+    end = time.time() + timeout
+    while time.time() < end:
+        if cond():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def _alert(order_no, status="Pending", updated="2025-01-01 09:15:00", **extra):
+    return {"OrderNo": order_no, "ClientId": UID, "Status": status, "TxnType": "B", "Product": "I",
+            "OrderType": "LMT", "Exchange": "NSE", "Segment": "E", "SecurityId": "11536",
+            "Quantity": 10, "TradedQty": 0, "Price": 100.5, "LastUpdatedTime": updated, **extra}
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    monkeypatch.setattr(dh, "ORDER_WS_LOGIN_GRACE_SEC", 60.0)   # only a server message proves the login
+    monkeypatch.setattr(dh, "_order_store", dh.OrderStore())
+    srv = StubOrderFeedServer(tokens={UID: TOKEN}).start()
+    yield srv
+    dh.stop_order_feeds()
+    srv.stop()
+
+
+def test_login_then_push_updates_store(stub):
+    feed = dh.start_order_feed({"userid": UID, "apikey": TOKEN}, url=stub.url)
+    assert _wait(lambda: stub.connected(UID) == 1)
+    assert stub.logins == [UID]
+    assert not feed.logged_in()          # socket open, nothing heard back yet
+
+    assert stub.push(_alert("501")) == 1
+    assert _wait(lambda: dh.get_order("501") is not None)
+    row = dh.get_order("501")
+    assert row["dhanClientId"] == UID
+    assert row["orderStatus"] == "PENDING"
+    assert row["transactionType"] == "BUY"
+    assert row["exchangeSegment"] == "NSE_EQ"
+    assert feed.logged_in()
+
+
+def test_bad_token_never_goes_live(stub):
+    feed = dh.start_order_feed({"userid": UID, "apikey": "wrong"}, url=stub.url)
+    time.sleep(0.5)
+    assert stub.connected(UID) == 0
+    assert not feed.logged_in()
+    assert not feed.fresh()
+
+
+def test_login_grace_counts_as_live(stub, monkeypatch):
+    monkeypatch.setattr(dh, "ORDER_WS_LOGIN_GRACE_SEC", 0.2)
+    feed = dh.start_order_feed({"userid": UID, "apikey": TOKEN}, url=stub.url)
+    assert _wait(lambda: stub.connected(UID) == 1)
+    assert _wait(feed.logged_in)
+
+
+def test_reconnects_after_drop(stub):
+    feed = dh.start_order_feed({"userid": UID, "apikey": TOKEN}, url=stub.url)
+    assert _wait(lambda: stub.connected(UID) == 1)
+    stub.push(_alert("601"))
+    assert _wait(lambda: dh.get_order("601") is not None)
+    feed.seeded = True
+
+    stub.drop_connections()
+    assert _wait(lambda: not feed.live)
+    assert not feed.fresh()              # readers fall back to REST while down
+
+    assert _wait(lambda: stub.connected(UID) == 1, timeout=10)
+    assert stub.logins == [UID, UID]
+    stub.push(_alert("601", status="Traded", updated="2025-01-01 09:16:00", TradedQty=10))
+    assert _wait(lambda: (dh.get_order("601") or {}).get("orderStatus") == "TRADED")
+    assert feed.logged_in()
+
+
+def test_upsert_keeps_newer_feed_row_over_older_rest():
+    store = dh.OrderStore()
+    store.upsert({"orderId": "7", "dhanClientId": UID, "orderStatus": "TRADED", "filledQty": 10,
+                  "updateTime": "2025-01-01 09:16:00"})
+    # a REST snapshot taken before the fill must not roll the row back
+    store.upsert({"orderId": "7", "dhanClientId": UID, "orderStatus": "PENDING", "filledQty": 0,
+                  "updateTime": "2025-01-01 09:15:00"})
+    assert store.get("7")["orderStatus"] == "TRADED"
+
+    # a newer REST row wins, but its blank fields do not erase what the feed sent
+    store.upsert({"orderId": "7", "dhanClientId": UID, "orderStatus": "TRADED", "averageTradedPrice": 101.0,
+                  "correlationId": "", "updateTime": "2025-01-01 09:17:00"})
+    store.upsert({"orderId": "7", "correlationId": "", "omsErrorDescription": None,
+                  "updateTime": "2025-01-01 09:17:00"})
+    row = store.get("7")
+    assert row["averageTradedPrice"] == 101.0
+    assert row["filledQty"] == 10
+    assert [o["orderId"] for o in store.for_client(UID)] == ["7"]
+
+
+def test_store_clears_on_new_ist_day(monkeypatch):
+    store = dh.OrderStore()
+    store.upsert({"orderId": "8", "dhanClientId": UID, "orderStatus": "PENDING", "updateTime": "z"})
+    tomorrow = store._day + timedelta(days=1)
+    monkeypatch.setattr(dh.OrderStore, "_today", staticmethod(lambda: tomorrow))
+    assert store.get("8") is None
+    assert store.for_client(UID) == []
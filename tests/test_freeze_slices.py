@@ -0,0 +1,39 @@
+# tests/test_freeze_slices.py
+"""Router freeze-limit slicing: lot-aligned pieces and slice rows keyed under their parent."""
+
+import os, sys, tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="router-test-"))
+
+import MultiBroker_Router as R
+
+
+def test_no_split_under_or_at_the_limit():
+    assert R._freeze_slices(900, 75, 1800) == [900]
+    assert R._freeze_slices(1800, 75, 1800) == [1800]
+    assert R._freeze_slices(50, 1, 0) == [50]            # no freeze limit known
+
+
+def test_slices_are_lot_aligned_and_sum_to_qty():
+    sl = R._freeze_slices(4000, 75, 1800)                # cap 1800 is 24 lots
+    assert sl == [1800, 1800, 400]
+    assert sum(sl) == 4000
+
+    sl = R._freeze_slices(5000, 75, 1850)                # cap rounds down to 1800
+    assert sl[:-1] == [1800, 1800] and sum(sl) == 5000
+    assert all(s % 75 == 0 for s in sl[:-1])
+
+
+def test_lot_counts_for_motilal():
+    assert R._freeze_slices(30, 1, 24) == [24, 6]
+
+
+def test_expand_slices_keys_children_under_parent():
+    rows = [{"client_id": "C1", "tag": "", "qty": 4000, "slices": [1800, 1800, 400]},
+            {"client_id": "C2", "tag": "g", "qty": 75, "slices": None}]
+    out = R._expand_slices("dhan", rows)
+    assert [r["qty"] for r in out] == [1800, 1800, 400, 75]
+    assert [r.get("slice_key") for r in out[:3]] == ["C1#1", "C1#2", "C1#3"]
+    assert {r["slice_of"] for r in out[:3]} == {"C1"}
+    assert "slice_of" not in out[3]
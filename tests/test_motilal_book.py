@@ -0,0 +1,74 @@
+# tests/test_motilal_book.py
+"""Broker_motilal incremental order book: watermark requests and merge by uniqueorderid."""
+
+import os, sys
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import Broker_motilal as mo
+
+UID = "MO1"
+
+
+def _ts(hms):
+    return datetime.now(mo.IST).strftime("%d-%b-%Y ") + hms
+
+
+def _row(oid, status, hms):
+    return {"uniqueorderid": oid, "orderstatus": status, "lastmodifiedtime": _ts(hms)}
+
+
+class _SDK:
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.asked = []
+
+    def GetOrderBook(self, req):
+        self.asked.append(req["datetimestamp"])
+        return self.replies.pop(0)
+
+
+@pytest.fixture(autouse=True)
+def fresh_book(monkeypatch):
+    monkeypatch.setattr(mo, "_books", {})
+    monkeypatch.setattr(mo, "_order_listeners", [])
+
+
+def test_full_pull_then_delta_from_watermark():
+    sdk = _SDK([
+        {"status": "SUCCESS", "data": [_row("A", "Confirm", "09:20:00"), _row("B", "Confirm", "09:25:30")]},
+        {"status": "SUCCESS", "data": [_row("A", "Traded", "09:40:00")]},
+    ])
+    first = mo._fetch_order_book(sdk, UID)
+    assert [r["uniqueorderid"] for r in first] == ["A", "B"]
+    assert sdk.asked[0] == _ts("09:00:00")
+
+    second = mo._fetch_order_book(sdk, UID)
+    assert sdk.asked[1] == _ts("09:25:30")          # newest timestamp seen so far
+    assert {r["uniqueorderid"]: r["orderstatus"] for r in second} == {"A": "Traded", "B": "Confirm"}
+
+
+def test_empty_delta_keeps_cached_rows():
+    sdk = _SDK([
+        {"status": "SUCCESS", "data": [_row("A", "Confirm", "09:20:00")]},
+        {"status": "FAILURE", "message": "No data found"},
+    ])
+    mo._fetch_order_book(sdk, UID)
+    rows = mo._fetch_order_book(sdk, UID)
+    assert [r["uniqueorderid"] for r in rows] == ["A"]
+    assert sdk.asked[1] == _ts("09:20:00")
+
+
+def test_listeners_see_every_fetched_row():
+    seen = []
+    mo.add_order_listener(lambda uid, row: seen.append((uid, row["uniqueorderid"], row["orderstatus"])))
+    sdk = _SDK([
+        {"status": "SUCCESS", "data": [_row("A", "Confirm", "09:20:00")]},
+        {"status": "SUCCESS", "data": [_row("A", "Cancelled", "09:21:00")]},
+    ])
+    mo._fetch_order_book(sdk, UID)
+    mo._fetch_order_book(sdk, UID)
+    assert seen == [(UID, "A", "Confirm"), (UID, "A", "Cancelled")]
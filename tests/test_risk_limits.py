@@ -0,0 +1,81 @@
+# tests/test_risk_limits.py
+"""Risk_limits.RiskBook: limit checks, reservations, seeding and modify checks."""
+
+import os, sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from Risk_limits import RiskBook, merge_limits
+
+UID = "C1"
+
+
+def test_merge_limits_takes_tightest_positive():
+    assert merge_limits({"max_order_value": 1000, "max_daily_loss": 0},
+                        {"max_order_value": 500, "max_qty_per_symbol": "20"}, None) == \
+        {"max_order_value": 500.0, "max_qty_per_symbol": 20.0}
+
+
+def test_check_order_value_and_qty_per_symbol():
+    rb = RiskBook()
+    lim = {"max_order_value": 10_000, "max_qty_per_symbol": 100}
+    assert rb.check(UID, "A", "BUY", 50, 100.0, lim) is None
+    assert rb.check(UID, "A", "BUY", 101, 10.0, lim) == "max_qty_per_symbol"
+    assert rb.check(UID, "A", "BUY", 60, 200.0, lim) == "max_order_value"
+    assert rb.check(UID, "A", "BUY", 10, 100.0, {}) is None          # no limits, no check
+
+    rb.on_ack("o1", UID, "A", "BUY", 80)
+    assert rb.check(UID, "A", "BUY", 30, 1.0, lim) == "max_qty_per_symbol"
+    assert rb.check(UID, "A", "SELL", 30, 1.0, lim) is None          # sell reduces the net
+    assert rb.stats["by_reason"] == {"max_qty_per_symbol": 2, "max_order_value": 1}
+
+
+def test_open_positions_and_daily_loss():
+    rb = RiskBook()
+    rb.on_order("o1", UID, "A", "BUY", 10, 10, 100.0, "TRADED")
+    assert rb.check(UID, "B", "BUY", 1, 1.0, {"max_open_positions": 1}) == "max_open_positions"
+    assert rb.check(UID, "A", "BUY", 1, 1.0, {"max_open_positions": 1}) is None
+
+    rb.on_order("o2", UID, "A", "SELL", 4, 4, 90.0, "TRADED")         # realized -40
+    assert rb.exposure(UID)["realized_pnl"] == -40.0
+    lim = {"max_daily_loss": 40}
+    assert rb.check(UID, "A", "BUY", 1, 1.0, lim) == "max_daily_loss"
+    assert rb.check(UID, "A", "SELL", 6, 1.0, lim) is None            # reducing is still allowed
+
+
+def test_reserve_counts_until_ack_or_release():
+    rb = RiskBook()
+    lim = {"max_qty_per_symbol": 100, "max_open_positions": 1}
+    reason, h1 = rb.reserve(UID, "A", "BUY", 60, 1.0, lim)
+    assert reason is None and h1 is not None
+    assert rb.reserve(UID, "A", "BUY", 60, 1.0, lim)[0] == "max_qty_per_symbol"
+    assert rb.reserve(UID, "B", "BUY", 1, 1.0, lim)[0] == "max_open_positions"
+
+    rb.on_ack("s1", UID, "A", "BUY", 30, hold=h1)                     # one slice acked
+    rb.release([h1])                                                   # the other never was
+    assert rb.exposure(UID)["symbols"] == {"A": {"position": 0, "working": 30, "reserved": 0}}
+    assert rb.reserve(UID, "A", "BUY", 70, 1.0, lim)[0] is None
+
+
+def test_seed_positions_replaces_net_and_realized():
+    rb = RiskBook()
+    rb.on_order("o1", UID, "A", "BUY", 10, 10, 100.0, "TRADED")
+    rb.seed_positions(UID, [("B", -5, 50.0, -120.0)])
+    exp = rb.exposure(UID)
+    assert exp["open_positions"] == 1
+    assert exp["symbols"] == {"B": {"position": -5, "working": 0, "reserved": 0}}
+    assert exp["realized_pnl"] == -120.0
+    assert rb.check(UID, "B", "SELL", 96, 1.0, {"max_qty_per_symbol": 100}) == "max_qty_per_symbol"
+
+
+def test_check_modify_known_and_unknown_orders():
+    rb = RiskBook()
+    rb.on_ack("o1", UID, "A", "BUY", 40)
+    rb.on_order("o1", UID, "A", "BUY", 40, 10, 100.0, "PART_TRADED")
+    lim = {"max_qty_per_symbol": 50, "max_order_value": 5_000}
+    assert rb.check_modify("o1", 50, None, lim) is None                # 10 filled + 40 working
+    assert rb.check_modify("o1", 60, None, lim) == "max_qty_per_symbol"
+    assert rb.check_modify("o1", None, 200.0, lim) == "max_order_value"   # 40 x 200
+    assert rb.check_modify("zz", 1000, 1000.0, lim) is None            # unknown order passes
+    rb.on_modify("o1", 20)
+    assert rb.exposure(UID)["symbols"]["A"]["working"] == 10
@@ -0,0 +1,86 @@
+# tests/test_trigger_engine.py
+"""Trigger_engine: per-scrip level books and segment-keyed tick routing."""
+
+import os, sys, threading
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from Trigger_engine import TriggerEngine, _ScripBook, exchange_key
+
+
+def test_crossed_pops_only_satisfied_levels_in_order():
+    book = _ScripBook()
+    book.add("up", 105.0, 1, "u105")
+    book.add("up", 101.0, 2, "u101")
+    book.add("up", 101.0, 3, "u101b")
+    book.add("down", 95.0, 4, "d95")
+    book.add("down", 99.0, 5, "d99")
+
+    assert book.crossed(100.0) == []
+    assert book.crossed(101.0) == ["u101", "u101b"]      # equal level fires, same level keeps add order
+    assert book.crossed(99.5) == []
+    assert book.crossed(97.0) == ["d99"]                  # highest "down" level goes first
+    assert len(book) == 2
+    assert book.crossed(200.0) == ["u105"]
+    assert book.crossed(1.0) == ["d95"]
+    assert len(book) == 0
+
+
+def test_remove_drops_a_single_entry():
+    book = _ScripBook()
+    book.add("up", 10.0, 1, "a")
+    book.add("up", 10.0, 2, "b")
+    book.remove("up", 10.0, 1)
+    book.remove("down", 10.0, 2)       # wrong side: no-op
+    assert book.crossed(10.0) == ["b"]
+
+
+def test_exchange_key_keeps_segments_apart():
+    assert exchange_key("nse") == "NSE"
+    assert exchange_key("NSEFO") == "NSEFO"
+    assert exchange_key("NSE_FNO") == "NSEFO"
+    assert exchange_key("BSE") != exchange_key("BSEFO")
+
+
+def _engine():
+    done = threading.Event()
+    fired = []
+
+    def fire(rule):
+        fired.append(rule["id"])
+        done.set()
+
+    return TriggerEngine(fire, max_workers=1), fired, done
+
+
+def test_fo_tick_does_not_fire_cash_rule_on_same_scrip():
+    eng, fired, done = _engine()
+    eng.add({"id": "cash", "exchange": "NSE", "scrip": 1234, "level": 100.0, "direction": "above"})
+
+    assert eng.on_tick("NSEFO", 1234, 150.0) == 0
+    assert eng.last_price("NSE", 1234) is None
+    assert eng.last_price("NSEFO", 1234) == 150.0
+
+    assert eng.on_tick("NSE", 1234, 100.5) == 1
+    assert done.wait(2)
+    assert fired == ["cash"]
+
+
+def test_direction_from_last_price_and_already_crossed():
+    eng, fired, done = _engine()
+    eng.on_tick("NSE", 7, 50.0)
+    assert eng.add({"id": "hi", "exchange": "NSE", "scrip": 7, "level": 55.0})["direction"] == "up"
+    assert eng.add({"id": "lo", "exchange": "NSE", "scrip": 7, "level": 45.0})["direction"] == "down"
+    with pytest.raises(ValueError):
+        eng.add({"id": "x", "exchange": "NSE", "scrip": 7, "level": 60.0, "direction": "below"})
+    with pytest.raises(ValueError):
+        eng.add({"id": "y", "exchange": "NSE", "scrip": 8, "level": 60.0})   # no LTP yet
+
+    assert eng.cancel("lo")
+    assert not eng.cancel("lo")
+    assert eng.on_tick("NSE", 7, 40.0) == 0
+    assert eng.on_tick("NSE", 7, 56.0) == 1
+    assert done.wait(2)
+    assert fired == ["hi"]